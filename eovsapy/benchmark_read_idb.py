@@ -0,0 +1,192 @@
+"""Benchmark the IDB read path on synthetic IDB files.
+
+The files are written by :mod:`eovsapy.synthetic_idb` with the dimensions of
+real data (16 antennas, 136 baselines, 4 polarizations, the 34- or 52-band
+frequency plan at 1-s or 20-ms cadence), so the numbers can be reproduced
+without access to the ``/data1`` archive.  The cases timed are:
+
+``readXdata``      ``read_idb.readXdata`` of each file in turn.
+``read_idb``       ``read_idb.read_idb`` of all files, with navg and desat.
+``udbfile_create`` ``udb_util.udbfile_create`` of all files into one UDB file.
+``udbfile_write``  ``udb_util.udbfile_write`` of the data of the first file.
+``unrot``          ``read_idb.unrot`` of the data of all files.
+
+Each case runs in a fresh process, so that its peak resident memory can be
+reported along with the median wall time and the number of visibility
+records (one baseline, polarization and time) processed per second.  The
+``unrot`` case uses stand-ins for its SQL database inputs.  Results are
+printed as JSON and as a markdown table; with ``--baseline``, the table also
+gives the records/s relative to an earlier ``--output`` file, so that
+regressions are visible.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import synthetic_idb
+
+CASES = ("readXdata", "read_idb", "udbfile_create", "udbfile_write", "unrot")
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident memory of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / 1024.0**2 if sys.platform == "darwin" else peak / 1024.0
+
+
+def _run_case(case: str, files: List[str], runs: int, navg: int, nmax: int,
+              backend: Optional[str] = None) -> Dict[str, object]:
+    """Time one case, and return its timings, record count and memory use.
+    nmax is the number of times in each file.
+    """
+    from . import read_idb, udb_util
+
+    rss_start = _peak_rss_mb()
+    nrec = None
+    if case == "unrot":
+        data = read_idb.read_idb(files, nmax=nmax, backend=backend)
+        nrec = int(np.prod(data["x"].shape[:2])) * len(data["time"])
+        azel = synthetic_idb.azeldict(data["time"])
+        # Stand-in for the X-Y phase calibration record in the SQL database
+        read_idb._xyphase_cache[:] = [{"valid": 0, "checked": 2**62, "cal": synthetic_idb.xyphase_cal(data["fghz"])}]
+    elif case == "udbfile_write":
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = udb_util.readXdata(files[0])
+        nrec = int(np.prod(data["x"].shape[1:]))
+    tmpdir = tempfile.mkdtemp()
+    timings = []
+    try:
+        for n in range(runs):
+            t0 = time.perf_counter()
+            # The readers report progress on stdout
+            with contextlib.redirect_stdout(io.StringIO()):
+                if case == "readXdata":
+                    for name in files:
+                        read_idb.readXdata(name, nmax=nmax, backend=backend)
+                elif case == "read_idb":
+                    read_idb.read_idb(files, navg=navg, desat=True, nmax=nmax, backend=backend)
+                elif case == "udbfile_create":
+                    udb_util.udbfile_create(files, os.path.join(tmpdir, "UDB%d" % n))
+                elif case == "udbfile_write":
+                    udb_util.udbfile_write(data, files[0], os.path.join(tmpdir, "UDB%d" % n))
+                elif case == "unrot":
+                    read_idb.unrot(data, azel)
+                else:
+                    raise ValueError(f"unknown case {case!r}")
+            timings.append(time.perf_counter() - t0)
+    finally:
+        shutil.rmtree(tmpdir)
+    return {"timings_s": timings, "records": nrec, "rss_start_mb": rss_start, "rss_peak_mb": _peak_rss_mb()}
+
+
+def run_benchmark(files: List[str], nrec: int, nmax: int, cases=CASES, runs: int = 3, navg: int = 10,
+                  backend: Optional[str] = None, isolate: bool = True) -> List[dict]:
+    """Run the benchmark cases on files, which hold nrec visibility records and
+    nmax times each.
+
+    :param isolate: If True (default), each case runs in a new process, so its
+        peak memory is its own.  Otherwise the peak is that of this process.
+    """
+    results = []
+    for case in cases:
+        args = (case, files, runs, navg, nmax, backend)
+        if isolate:
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                out = pool.apply(_run_case, args)
+        else:
+            out = _run_case(*args)
+        records = out["records"] or nrec
+        median = statistics.median(out["timings_s"])
+        results.append({
+            "name": case,
+            "records": records,
+            "median_s": median,
+            "min_s": min(out["timings_s"]),
+            "runs": out["timings_s"],
+            "records_per_s": records / median if median else float("inf"),
+            "rss_peak_mb": out["rss_peak_mb"],
+            "rss_increase_mb": out["rss_peak_mb"] - out["rss_start_mb"],
+        })
+    return results
+
+
+def _format_markdown_table(results: List[dict], baseline: Optional[Dict[str, dict]] = None) -> str:
+    """Render one markdown summary table."""
+    header = "| Case | Records | Median (s) | Records/s | Peak RSS (MB) | RSS increase (MB) |"
+    rule = "| --- | ---: | ---: | ---: | ---: | ---: |"
+    if baseline:
+        header += " Speed vs baseline |"
+        rule += " ---: |"
+    lines = [header, rule]
+    for item in results:
+        line = "| {name} | {records} | {median_s:.3f} | {records_per_s:.0f} | {rss_peak_mb:.0f} | {rss_increase_mb:.0f} |".format(**item)
+        if baseline:
+            ref = baseline.get(item["name"])
+            line += " {:.2f}x |".format(item["records_per_s"] / ref["records_per_s"]) if ref else " - |"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Write the synthetic files, run the benchmark and print JSON plus markdown summaries."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nbands", type=int, choices=(34, 52), default=52, help="Frequency plan.")
+    parser.add_argument("--cadence", choices=sorted(synthetic_idb.CADENCES), default="1s", help="Record cadence.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of data in each file.")
+    parser.add_argument("--nfiles", type=int, default=2, help="Number of files.")
+    parser.add_argument("--runs", type=int, default=3, help="Repeated runs per case.")
+    parser.add_argument("--navg", type=int, default=10, help="navg of the read_idb case.")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES), help="Cases to run.")
+    parser.add_argument("--backend", choices=("aipy", "native"), default=None, help="Miriad reader of read_idb.")
+    parser.add_argument("--outdir", default=None, help="Directory for the files (default: a temporary one).")
+    parser.add_argument("--output", default=None, help="Also write the JSON results to this file.")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with.")
+    parser.add_argument("--no-isolate", action="store_true", help="Run the cases in this process.")
+    args = parser.parse_args(argv)
+
+    outdir = args.outdir or tempfile.mkdtemp(prefix="eovsa_bench_")
+    try:
+        t0 = time.perf_counter()
+        files, nrec = synthetic_idb.write_idb_files(outdir, nfiles=args.nfiles, duration=args.duration,
+                                                    cadence=synthetic_idb.CADENCES[args.cadence], nbands=args.nbands)
+        setup = {"nbands": args.nbands, "cadence": args.cadence, "duration_s": args.duration,
+                 "nfiles": args.nfiles, "records": nrec, "write_s": time.perf_counter() - t0}
+        nmax = int(round(args.duration / synthetic_idb.CADENCES[args.cadence]))
+        results = run_benchmark(files, nrec, nmax, args.cases, args.runs, args.navg, args.backend,
+                                isolate=not args.no_isolate)
+    finally:
+        if args.outdir is None:
+            shutil.rmtree(outdir)
+
+    report = {"setup": setup, "results": results}
+    print(json.dumps(report, indent=2))
+    print()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = {item["name"]: item for item in json.load(handle)["results"]}
+    print(_format_markdown_table(results, baseline))
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
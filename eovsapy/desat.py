@@ -0,0 +1,182 @@
+"""Table-driven correction of EOVSA correlator saturation.
+
+The saturation correction raises each auto- and cross-correlation amplitude to
+a power ``eta`` that is a function of ``x = log10(P)``, the standardized total
+power of the antennas involved (see ``read_idb.autocorr_desat``).  The erf-based
+``eta`` curves are smooth, so they are tabulated once on a fine grid of ``x``
+and evaluated by linear interpolation.  The largest interpolation error of each
+table is measured when the table is built and is kept in ``EtaTable.max_error``;
+values of ``x`` outside the table, or not finite, are evaluated exactly.
+
+The per-antenna corrections are then expanded to all baselines and
+polarization products with index arrays, and applied to the whole visibility
+array in one broadcast operation.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from scipy.special import erf
+
+# Parameters (a, b, c, d) of eta = (x + d - c)/(a*erf((x - c)/b) + d)
+EQ8_PARAMS = (1.22552, 1.37369, 2.94536, 2.14838)
+"""Curve for data taken with equalizer coefficient 8.0 (before 2021-05-16)."""
+EQ2_HI_PARAMS = (0.88025122, 1.0221639, 4.39845723, 2.38911615)
+"""Curve for equalizer coefficient 2.0, auto-correlation amplitude above 300."""
+EQ2_LO_PARAMS = (2.28517281, 2.64619331, 4.38657476, 2.37753165)
+"""Curve for equalizer coefficient 2.0, auto-correlation amplitude of 300 or less."""
+
+EQ2_MJD = 59350
+"""MJD (2021-05-16) from which the equalizer coefficient 2.0 curves apply."""
+EQ8_MIN_AMP = 50.0
+EQ2_SPLIT_AMP = 300.0
+
+TABLE_RANGE = (-2.0, 10.0)
+TABLE_STEP = 5.0e-4
+TABLE_TOLERANCE = 1.0e-6
+"""Largest interpolation error in eta that a table is allowed to have."""
+
+
+def eta_exact(x: np.ndarray, params: Sequence[float]) -> np.ndarray:
+    """Evaluate one eta curve directly.
+
+    :param x: Log10 of the standardized total power.
+    :type x: numpy.ndarray
+    :param params: Curve parameters (a, b, c, d).
+    :type params: sequence of float
+    :returns: The exponent eta for each value of x.
+    :rtype: numpy.ndarray
+    """
+    a, b, c, d = params
+    return (x + d - c) / (a * erf((x - c) / b) + d)
+
+
+class EtaTable:
+    """Linear interpolation table for one eta curve.
+
+    :param params: Curve parameters (a, b, c, d).
+    :type params: sequence of float
+    :param xrange: Range of x covered by the table.
+    :type xrange: tuple of float
+    :param step: Grid spacing in x.
+    :type step: float
+    :raises ValueError: If the interpolation error exceeds ``TABLE_TOLERANCE``.
+    """
+
+    def __init__(
+        self,
+        params: Sequence[float],
+        xrange: Tuple[float, float] = TABLE_RANGE,
+        step: float = TABLE_STEP,
+    ) -> None:
+        self.params = tuple(params)
+        self.x0, self.x1 = xrange
+        self.step = step
+        npts = int(round((self.x1 - self.x0) / step)) + 1
+        self.values = eta_exact(self.x0 + step * np.arange(npts), self.params)
+        # Linear interpolation is worst near the middle of each interval
+        mid = self.x0 + step * (np.arange(npts - 1) + 0.5)
+        self.max_error = float(np.max(np.abs(self(mid) - eta_exact(mid, self.params))))
+        if self.max_error > TABLE_TOLERANCE:
+            raise ValueError(f"EtaTable: interpolation error {self.max_error:.2e} is too large")
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Return eta for each value of x."""
+        x = np.asarray(x, dtype=np.float64)
+        pos = (x - self.x0) / self.step
+        inside = (pos >= 0) & (pos <= len(self.values) - 1)
+        pos = np.where(inside, pos, 0.0)
+        idx = np.minimum(pos.astype(np.int64), len(self.values) - 2)
+        frac = pos - idx
+        eta = self.values[idx] * (1.0 - frac) + self.values[idx + 1] * frac
+        if not np.all(inside):
+            eta[~inside] = eta_exact(x[~inside], self.params)
+        return eta
+
+
+@lru_cache(maxsize=None)
+def eta_tables() -> Dict[str, EtaTable]:
+    """Return the eta tables, which are built on first use."""
+    return {
+        "eq8": EtaTable(EQ8_PARAMS),
+        "eq2_hi": EtaTable(EQ2_HI_PARAMS),
+        "eq2_lo": EtaTable(EQ2_LO_PARAMS),
+    }
+
+
+def antenna_eta(x: np.ndarray, amp: np.ndarray, mjd: float) -> np.ndarray:
+    """Return the per-antenna correction exponent.
+
+    :param x: Log10 of the standardized total power.
+    :type x: numpy.ndarray
+    :param amp: Auto-correlation amplitude, of the same shape as x.
+    :type amp: numpy.ndarray
+    :param mjd: Date of the data, which selects the curves to use.
+    :type mjd: float
+    :returns: eta, of the same shape as x.
+    :rtype: numpy.ndarray
+    """
+    tables = eta_tables()
+    if mjd < EQ2_MJD:
+        return np.where(amp < EQ8_MIN_AMP, 1.0, tables["eq8"](x))
+    hi = tables["eq2_hi"](x)
+    lo = tables["eq2_lo"](x)
+    # Where amp is NaN neither curve applies, and eta is 1
+    return np.where(amp > EQ2_SPLIT_AMP, hi, np.where(amp <= EQ2_SPLIT_AMP, lo, 1.0))
+
+
+def pair_eta(eta_x: np.ndarray, eta_y: np.ndarray, ant1: np.ndarray, ant2: np.ndarray, axis: int) -> np.ndarray:
+    """Combine per-antenna exponents into exponents for antenna pairs.
+
+    The four polarization products XX, YY, XY, YX of the pair (i, j) get
+    ``(ex[i] + ex[j])/2``, ``(ey[i] + ey[j])/2``, ``(ex[i] + ey[j])/2`` and
+    ``(ex[j] + ey[i])/2``.  An auto-correlation is the pair (i, i).
+
+    :param eta_x: X-polarization exponents, with antennas along ``axis``.
+    :param eta_y: Y-polarization exponents, of the same shape.
+    :param ant1: First antenna index of each pair.
+    :param ant2: Second antenna index of each pair.
+    :param axis: Antenna axis of eta_x and eta_y.
+    :returns: Exponents with the pairs along ``axis``, followed by a new
+        polarization axis of length 4.
+    :rtype: numpy.ndarray
+    """
+    ex1 = np.take(eta_x, ant1, axis=axis)
+    ex2 = np.take(eta_x, ant2, axis=axis)
+    ey1 = np.take(eta_y, ant1, axis=axis)
+    ey2 = np.take(eta_y, ant2, axis=axis)
+    return np.stack([ex1 + ex2, ey1 + ey2, ex1 + ey2, ex2 + ey1], axis=axis + 1) / 2.0
+
+
+def baseline_pairs(bl2ord: np.ndarray, nbl: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the antenna pair of each of the first ``nbl`` baseline indexes.
+
+    :param bl2ord: Baseline lookup table, as ``util.bl2ord``.
+    :param nbl: Number of baseline indexes to return pairs for.
+    :returns: Arrays (ant1, ant2) of length nbl, with ant1 <= ant2.
+    """
+    ant1 = np.zeros(nbl, dtype=int)
+    ant2 = np.zeros(nbl, dtype=int)
+    for i, j in zip(*np.triu_indices(bl2ord.shape[0])):
+        if bl2ord[i, j] < nbl:
+            ant1[bl2ord[i, j]] = i
+            ant2[bl2ord[i, j]] = j
+    return ant1, ant2
+
+
+def apply_eta(vis: np.ndarray, eta: np.ndarray) -> np.ndarray:
+    """Raise the amplitudes of complex visibilities to the power eta, keeping the phases.
+
+    :param vis: Complex visibilities.
+    :param eta: Exponents, broadcastable to vis.
+    :returns: Corrected visibilities, of the same dtype as vis.
+    """
+    amp = np.abs(vis)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = (amp ** (eta - 1.0)).astype(amp.dtype)
+    out = vis * scale
+    out[amp == 0] = 0
+    return out
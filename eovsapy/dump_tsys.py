@@ -59,75 +59,46 @@
 #  2023-Jan-07  DG
 #    Changes to return source IDs in get_projects() and to select on Source ID
 #    in findfile().
+#  2026-10-17  SY
+#    file_list() now uses the persistent directory index in file_index.py rather than
+#    globbing and converting each file name with Time().  The archive folder of the
+#    second date is now searched when the range crosses midnight.
 #
 
-import subprocess, time, sys, glob
+import subprocess, time, sys, glob, os
 import numpy as np
 from .util import Time, common_val_idx
+from . import file_index
 
 
 def file_list(trange, udb=False):
     ''' Find IDB files between the dates/times provided in trange.
         Input is a 2-element Time() object with start time trange[0] and end time trange[1]
         Returns files as a list, if found, or an empty list ([]) if not found.
+
+        Files are looked up in the persistent directory index of file_index.py.
     '''
-    # Find files corresponding to date of first time
-    fstr = trange[0].iso
+    mjd0, mjd1 = trange.mjd
+    # Check if second time has different date
+    day1, day2 = trange.mjd.astype('int')
+    if day2 - day1 > 1:
+        print('Second date must differ from first by at most 1 day')
+        mjd1 = day1 + 1
     if udb:
-        # Check for existence of /data1/UDB:
         folder = '/data1/UDB/' + str(int(trange[0].jyear))
-        files = glob.glob(folder + '/UDB' + fstr.replace('-', '').split()[0] + '*')
-        files.sort()
-        # Check if second time has different date
-        mjd1, mjd2 = trange.mjd.astype('int')
-        if mjd2 != mjd1:
-            if (mjd2 - 1) != mjd1:
-                print('Second date must differ from first by at most 1 day')
-            else:
-                fstr2 = trange[1].iso
-                files2 = glob.glob(folder + '/UDB' + fstr2.replace('-', '').split()[0] + '*')
-                files2.sort()
-                files += files2
-    else:
-        # Check for existence of /data1/IDB, or use /dppdata1/IDB if not found:
-        folder = '/data1/IDB'
-        if glob.glob(folder) == []:
-            folder = '/dppdata1/IDB'
-            files = glob.glob(folder + '/IDB' + fstr.replace('-', '').split()[0] + '*')
-            files.sort()
-        if files == [] or glob.glob(folder) == []:
-            datdir = trange[0].iso[:10].replace('-', '')
+        return file_index.find_files(folder, mjd0, mjd1, prefix='UDB')
+    # Check for existence of /data1/IDB, or use /dppdata1/IDB if not found:
+    folder = '/data1/IDB'
+    if not os.path.isdir(folder):
+        folder = '/dppdata1/IDB'
+    files = file_index.find_files(folder, mjd0, mjd1, prefix='IDB')
+    if files == []:
+        # Older data are archived in one folder per date
+        for day in range(day1, min(day2, day1 + 1) + 1):
+            datdir = Time(day, format='mjd').iso[:10].replace('-', '')
             folder = '/common/archive/data1/eovsa/fits/IDB/' + datdir
-            files = glob.glob(folder + '/IDB' + fstr.replace('-', '').split()[0] + '*')
-            files.sort()
-        # Check if second time has different date
-        mjd1, mjd2 = trange.mjd.astype('int')
-        if mjd2 != mjd1:
-            if (mjd2 - 1) != mjd1:
-                print('Second date must differ from first by at most 1 day')
-            else:
-                if folder[:22] == '/common/archive/data1/eovsa/fits/IDB/':
-                    datdir = trange[1].iso[:10].replace('-', '')
-                    folder = '/common/archive/data1/eovsa/fits/IDB/' + datdir
-                fstr2 = trange[1].iso
-                files2 = glob.glob(folder + '/IDB' + fstr2.replace('-', '').split()[0] + '*')
-                files2.sort()
-                files += files2
-
-    def fname2mjd(filename):
-        fstem = filename.split('/')[-1]
-        fstr = fstem[3:7] + '-' + fstem[7:9] + '-' + fstem[9:11] + ' ' + fstem[11:13] + ':' + fstem[
-                                                                                              13:15] + ':' + fstem[
-                                                                                                             15:17]
-        t = Time(fstr)
-        return t.mjd
-
-    filelist = []
-    for filename in files:
-        mjd = fname2mjd(filename)
-        if mjd >= trange[0].mjd and mjd < trange[1].mjd:
-            filelist.append(filename)
-    return filelist
+            files += file_index.find_files(folder, max(mjd0, day), min(mjd1, day + 1), prefix='IDB')
+    return files
 
 
 def dump_tsys(trange):
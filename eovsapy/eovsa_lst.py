@@ -1,5 +1,8 @@
 #  2015-May-29  DG
 #    Converted from using datime() to using Time() based on astropy.
+#  2026-10-17  SY
+#    Added eovsa_lst_array(), which returns the LST for a whole array of times
+#    by linear interpolation between cached exact values on a fixed time grid.
 
 ##from datime import *
 ##from Astrometry import *
@@ -64,6 +67,14 @@
 from .eovsa_array import *
 from math import pi
 from .util import Time
+import numpy as np
+from functools import lru_cache
+from threading import Lock
+
+# Spacing (days) of the exact LST evaluations interpolated by eovsa_lst_array().
+# It is a power of 2 so that the node times are exact.
+LST_NODE_STEP = 1./128
+_lst_lock = Lock()
 
 # New code is ridiculously simple
 def eovsa_lst(tin=None):
@@ -77,6 +88,42 @@ def eovsa_lst(tin=None):
     aa.set_jultime(tin.jd)
     return aa.sidereal_time()
 
+@lru_cache(maxsize=1)
+def _lst_array():
+    return eovsa_array()
+
+@lru_cache(maxsize=16384)
+def _node_lst(n):
+    ''' Returns the LST (radians) at Julian Date n*LST_NODE_STEP.
+    '''
+    with _lst_lock:
+        aa = _lst_array()
+        aa.set_jultime(n*LST_NODE_STEP)
+        return float(aa.sidereal_time())
+
+def eovsa_lst_array(jd):
+    ''' Input is an array of Julian Dates.  Returns the local sidereal time for
+        EOVSA (radians) at each time, as eovsa_lst() would for each one.
+
+        The LST is evaluated exactly on a fixed grid of times LST_NODE_STEP apart
+        (which are cached), and linearly interpolated in between.  Because the LST
+        advances at a nearly constant rate, the error of the interpolation is below
+        1e-10 radians, which is smaller than the effect of the rounding of a Julian
+        Date to double precision.  The result for a given time does not depend on
+        the other times in jd.
+    '''
+    jd = np.asarray(jd, dtype=float)
+    if jd.size == 0:
+        return np.zeros(jd.shape)
+    n = np.floor(jd/LST_NODE_STEP).astype(np.int64)
+    nodes, i = np.unique(n, return_inverse=True)
+    la = np.array([_node_lst(k) for k in nodes])[i].reshape(jd.shape)
+    lb = np.array([_node_lst(k + 1) for k in nodes])[i].reshape(jd.shape)
+    # Advance of the LST over each node interval, which is less than 2*pi
+    step = np.mod(lb - la, 2*pi)
+    frac = (jd - n*LST_NODE_STEP)/LST_NODE_STEP
+    return np.mod(la + step*frac, 2*pi)
+
 def eovsa_ha(src,tin=None):
     ''' Input is a Time() object (or None to use current time).
         Returns the hour angle of the provided src for an observer at OVRO, 
@@ -0,0 +1,388 @@
+"""Persistent time index of the IDB and UDB files in a data directory.
+
+Finding the files for a time range used to mean globbing the data directory
+and converting every file name to an MJD with ``util.fname2mjd`` (one astropy
+``Time`` per name) on every call.  This module keeps, for each directory, a
+sorted table of the files in it with their start time, end time, size,
+modification time and scan type, so that a time-range lookup is a binary
+search.
+
+The table is saved as a small JSON file and reused while the directory's
+modification time is unchanged.  Only the dates that have been looked up are
+examined, so a lookup in a flat directory holding the whole archive does not
+stat every file in it.  When the directory changes, those dates are listed
+again, but only the new files are examined; files that disappeared are
+dropped.  Of the files that a lookup returns, only those that may still be
+written to (the newest file of each kind, and files that had been modified
+less than ``SETTLE_SECONDS`` before they were last checked) have their size
+and modification time checked again.  Scan types are read only on request,
+for the files returned, and read again whenever the file has changed since
+it was last read.  The index directory is
+taken from ``EOVSA_FILE_INDEX``, defaulting to ``~/.cache/eovsapy/file_index``.
+If it cannot be written, indexes are kept in memory for the life of the process.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+INDEX_VERSION = 3
+# A file not modified for this long when it was checked is taken to be complete
+SETTLE_SECONDS = 3600
+FILENAME_RE = re.compile(r"^(?P<prefix>[A-Z]{3})(?P<stamp>\d{14})$")
+
+_MJD_ORDINAL = datetime.date(1858, 11, 17).toordinal()
+# All the days that a file name can hold, as [first MJD day, last MJD day + 1)
+_ALL_DAYS = (datetime.date.min.toordinal() - _MJD_ORDINAL, datetime.date.max.toordinal() - _MJD_ORDINAL + 1)
+_indexes: Dict[str, "FileIndex"] = {}
+
+ENTRY_DTYPE = np.dtype(
+    [
+        ("name", "U32"),
+        ("start", "f8"),
+        ("end", "f8"),
+        ("size", "i8"),
+        ("mtime_ns", "i8"),
+        ("scantype", "U32"),
+        ("scan_mtime_ns", "i8"),
+        ("checked_ns", "i8"),
+    ]
+)
+
+
+def filename_mjd(filename: str) -> float:
+    """Return the start MJD encoded in a standard IDB or UDB file name.
+
+    This is the same as ``util.fname2mjd`` for a single name, but uses plain
+    arithmetic instead of astropy.  On the (rare) days with a leap second,
+    astropy spreads the day over 86401 s, so results can differ by up to 1 s.
+
+    :param filename: File name or path, e.g. ``/data1/IDB/IDB20230224001000``.
+    :type filename: str
+    :returns: Modified Julian Date of the file's start time.
+    :rtype: float
+    :raises ValueError: If the name does not hold a valid date and time.
+    """
+    stem = os.path.basename(filename.rstrip("/"))
+    stamp = datetime.datetime.strptime(stem[3:17], "%Y%m%d%H%M%S")
+    days = stamp.date().toordinal() - _MJD_ORDINAL
+    return days + (stamp.hour * 3600 + stamp.minute * 60 + stamp.second) / 86400.0
+
+
+def _day_stamp(day: int) -> str:
+    """Return the ``YYYYMMDD`` of a file name for the MJD day number ``day``."""
+    return datetime.date.fromordinal(day + _MJD_ORDINAL).strftime("%Y%m%d")
+
+
+def _day_span(mjd0: Optional[float], mjd1: Optional[float]) -> tuple:
+    """Return the MJD days ``[first, last + 1)`` of the files that can start in
+    ``[mjd0, mjd1)``, or all days if either end is ``None``.
+    """
+    if mjd0 is None or mjd1 is None:
+        return _ALL_DAYS
+    first = max(int(np.floor(mjd0)), _ALL_DAYS[0])
+    return first, max(min(int(np.ceil(mjd1)), _ALL_DAYS[1]), first)
+
+
+def _dataset_stat(path: str) -> tuple:
+    """Return the total size and latest mtime (ns) of a Miriad dataset or file."""
+    stat = os.stat(path)
+    if not os.path.isdir(path):
+        return stat.st_size, stat.st_mtime_ns
+    size, mtime = 0, stat.st_mtime_ns
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                item = entry.stat()
+                size += item.st_size
+                mtime = max(mtime, item.st_mtime_ns)
+    return size, mtime
+
+
+def _scan_type(path: str) -> str:
+    """Return the project (scan type) recorded in a Miriad dataset, or ``""``."""
+    if not os.path.isfile(os.path.join(path, "vartable")):
+        return ""
+    try:
+        import aipy
+
+        uv = aipy.miriad.UV(path)
+        proj = uv["proj"] if "proj" in uv.vartable else ""
+        del uv
+        return proj.rstrip("\x00").strip()
+    except Exception:
+        return ""
+
+
+def default_index_dir() -> str:
+    """Return the directory in which indexes are saved."""
+    return os.getenv("EOVSA_FILE_INDEX") or os.path.join(os.path.expanduser("~"), ".cache", "eovsapy", "file_index")
+
+
+class FileIndex:
+    """Sorted table of the IDB/UDB files in one directory.
+
+    :param directory: Data directory to index.
+    :type directory: str
+    :param index_dir: Where to save the index.  ``None`` uses
+        :func:`default_index_dir`; ``""`` keeps it in memory only.
+    :type index_dir: str, optional
+    :param scan_types: If True, read the scan type (Miriad ``proj`` variable)
+        of the files that a lookup returns, unless the lookup says otherwise.
+        A file is opened again only if it has changed since its scan type was
+        read.
+    :type scan_types: bool
+    """
+
+    def __init__(self, directory: str, index_dir: Optional[str] = None, scan_types: bool = False) -> None:
+        self.directory = os.path.abspath(directory)
+        self.index_dir = default_index_dir() if index_dir is None else index_dir
+        self.scan_types = scan_types
+        self.dir_mtime_ns: Optional[int] = None
+        self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        # Day spans [first, last + 1) of the dates listed since the directory last changed
+        self.covered: List[List[int]] = []
+        self._load()
+
+    @property
+    def index_path(self) -> Optional[str]:
+        """Path of the saved index, or ``None`` if it is kept in memory only."""
+        if not self.index_dir:
+            return None
+        key = hashlib.sha1(self.directory.encode("utf-8")).hexdigest()
+        return os.path.join(self.index_dir, key + ".json")
+
+    def _load(self) -> None:
+        path = self.index_path
+        if path is None:
+            return
+        try:
+            with open(path) as handle:
+                saved = json.load(handle)
+            if saved["version"] != INDEX_VERSION or saved["directory"] != self.directory:
+                return
+            rows = [tuple(row) for row in saved["entries"]]
+            self.entries = np.array(rows, dtype=ENTRY_DTYPE)
+            self.dir_mtime_ns = saved["dir_mtime_ns"]
+            self.covered = [[int(d0), int(d1)] for d0, d1 in saved["covered"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            # No usable saved index, so it will be rebuilt
+            return
+
+    def _save(self) -> None:
+        path = self.index_path
+        if path is None:
+            return
+        saved = {
+            "version": INDEX_VERSION,
+            "directory": self.directory,
+            "dir_mtime_ns": self.dir_mtime_ns,
+            "covered": self.covered,
+            "entries": [
+                [row[0], float(row[1]), float(row[2]), int(row[3]), int(row[4]), row[5], int(row[6]), int(row[7])]
+                for row in self.entries.tolist()
+            ],
+        }
+        tmp = f"{path}.tmp-{os.getpid()}"
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(tmp, "w") as handle:
+                json.dump(saved, handle)
+            os.replace(tmp, path)
+        except OSError:
+            # Read-only location: the index is still usable in memory
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def refresh(self, mjd0: Optional[float] = None, mjd1: Optional[float] = None) -> bool:
+        """Bring the index up to date with the directory for the files that
+        can start in ``[mjd0, mjd1)`` (default all files).
+
+        Costs one ``stat`` when the directory is unchanged and these dates
+        have been listed before.  Otherwise the directory is listed and the
+        new files of the dates not yet listed are examined.
+
+        :returns: True if the list of files changed.
+        :rtype: bool
+        """
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            changed = len(self.entries) > 0
+            self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+            self.dir_mtime_ns = None
+            self.covered = []
+            return changed
+        if dir_mtime != self.dir_mtime_ns:
+            self.covered = []
+            self.dir_mtime_ns = dir_mtime
+        spans = self._uncovered(*_day_span(mjd0, mjd1))
+        if not spans:
+            return False
+        changed = self._scan(spans)
+        self._save()
+        return changed
+
+    def _uncovered(self, first: int, stop: int) -> List[List[int]]:
+        """Return the parts of the days ``[first, stop)`` not yet listed."""
+        spans = []
+        for d0, d1 in self.covered:
+            if d0 > first:
+                spans.append([first, min(d0, stop)])
+            first = max(first, d1)
+            if first >= stop:
+                break
+        if first < stop:
+            spans.append([first, stop])
+        return [span for span in spans if span[0] < span[1]]
+
+    def _scan(self, spans: List[List[int]]) -> bool:
+        """List the files of the day spans, reusing the rows of known files."""
+        stamps = [(_day_stamp(d0), _day_stamp(d1 - 1)) for d0, d1 in spans]
+
+        def in_spans(name: str) -> bool:
+            day = name[3:11]
+            return any(lo <= day <= hi for lo, hi in stamps)
+
+        known = {}
+        rows = []
+        for row in self.entries.tolist():
+            if in_spans(row[0]):
+                known[row[0]] = row
+            else:
+                rows.append(row)
+        changed = False
+        for name in os.listdir(self.directory):
+            if not FILENAME_RE.match(name) or not in_spans(name):
+                continue
+            if name in known:
+                rows.append(known.pop(name))
+                continue
+            try:
+                start = filename_mjd(name)
+                size, mtime = _dataset_stat(os.path.join(self.directory, name))
+            except (OSError, ValueError):
+                continue
+            # The scan type is read when the file is first looked up
+            rows.append((name, start, np.nan, size, mtime, "", -1, time.time_ns()))
+            changed = True
+        changed = changed or len(known) > 0
+        entries = np.array(rows, dtype=ENTRY_DTYPE)
+        self.entries = entries[np.lexsort((entries["name"], entries["start"]))]
+        self._set_end_times()
+        covered = sorted(self.covered + spans)
+        self.covered = covered[:1]
+        for d0, d1 in covered[1:]:
+            if d0 <= self.covered[-1][1]:
+                self.covered[-1][1] = max(self.covered[-1][1], d1)
+            else:
+                self.covered.append([d0, d1])
+        return changed
+
+    def _check(self, rows: np.ndarray, scan_types: bool) -> bool:
+        """Refresh the size and modification time of those of the entries
+        ``rows`` that may still be written to, and if ``scan_types``, (re)read
+        the scan type of those that changed since it was read.
+
+        :returns: True if the index should be saved, i.e. a scan type was read
+            or a file was found to be complete.  A file that is still growing
+            is only updated in memory.
+        """
+        save = False
+        newest = set()
+        if len(rows) > 0:
+            prefixes = np.array([name[:3] for name in self.entries["name"]])
+            for prefix in np.unique(prefixes[rows]):
+                newest.add(np.flatnonzero(prefixes == prefix)[-1])
+        settle = SETTLE_SECONDS * 10**9
+        for i in rows:
+            entry = self.entries[i]
+            path = os.path.join(self.directory, str(entry["name"]))
+            if i in newest or entry["checked_ns"] - entry["mtime_ns"] < settle:
+                try:
+                    size, mtime = _dataset_stat(path)
+                except OSError:
+                    continue
+                entry["size"], entry["mtime_ns"], entry["checked_ns"] = size, mtime, time.time_ns()
+                save = save or entry["checked_ns"] - mtime >= settle
+            if scan_types and entry["scan_mtime_ns"] != entry["mtime_ns"]:
+                entry["scantype"], entry["scan_mtime_ns"] = _scan_type(path), entry["mtime_ns"]
+                save = True
+        return save
+
+    def _set_end_times(self) -> None:
+        """Set the end of each file to the start of the next one of the same kind.
+
+        The newest file of each kind is given the median file length.
+        """
+        prefixes = np.array([name[:3] for name in self.entries["name"]])
+        for prefix in np.unique(prefixes):
+            idx = np.where(prefixes == prefix)[0]
+            start = self.entries["start"][idx]
+            end = np.empty_like(start)
+            end[:-1] = start[1:]
+            end[-1] = start[-1] + (np.median(np.diff(start)) if len(start) > 1 else 0.0)
+            self.entries["end"][idx] = end
+
+    def lookup(self, mjd0: float, mjd1: float, prefix: str = "IDB", scan_types: Optional[bool] = None) -> np.ndarray:
+        """Return the entries of files that start in ``[mjd0, mjd1)``.
+
+        The size and modification time of the entries returned that may still
+        be written to are brought up to date, as is their scan type if asked.
+
+        :param mjd0: Start of the time range (MJD).
+        :param mjd1: End of the time range (MJD), exclusive.
+        :param prefix: Kind of file, ``"IDB"`` or ``"UDB"``.
+        :param scan_types: Whether to read the scan types of the entries.
+            Default is the ``scan_types`` of the index.
+        :returns: Entries in time order.
+        :rtype: numpy.ndarray
+        """
+        self.refresh(mjd0, mjd1)
+        rows = np.arange(len(self.entries))
+        if prefix:
+            rows = rows[np.char.startswith(self.entries["name"], prefix)]
+        i0, i1 = np.searchsorted(self.entries["start"][rows], [mjd0, mjd1], side="left")
+        rows = rows[i0:i1]
+        if self._check(rows, self.scan_types if scan_types is None else scan_types):
+            self._save()
+        return self.entries[rows]
+
+    def find_files(self, mjd0: float, mjd1: float, prefix: str = "IDB", scan_types: bool = False) -> List[str]:
+        """Return the paths of the files that start in ``[mjd0, mjd1)``, in time order.
+        The scan types are not read unless ``scan_types`` is True.
+        """
+        entries = self.lookup(mjd0, mjd1, prefix, scan_types)
+        return [os.path.join(self.directory, str(name)) for name in entries["name"]]
+
+
+def directory_index(directory: str) -> FileIndex:
+    """Return the (shared, per process) index of ``directory``."""
+    key = os.path.abspath(directory)
+    if key not in _indexes:
+        _indexes[key] = FileIndex(key)
+    return _indexes[key]
+
+
+def find_files(directory: str, mjd0: float, mjd1: float, prefix: str = "IDB") -> List[str]:
+    """Return the files in ``directory`` that start in ``[mjd0, mjd1)``, in time order.
+
+    :param directory: Data directory.  A missing directory has no files.
+    :param mjd0: Start of the time range (MJD).
+    :param mjd1: End of the time range (MJD), exclusive.
+    :param prefix: Kind of file, ``"IDB"`` or ``"UDB"``.
+    :rtype: list of str
+    """
+    if not os.path.isdir(directory):
+        return []
+    return directory_index(directory).find_files(mjd0, mjd1, prefix)
@@ -482,7 +482,7 @@ def read_idb_calibrated(files, t):
         if len(valid) == 0:
             return {}, False
         nfile = min(len(valid), 6)
-        out = ri.read_idb(valid[-nfile:], navg=10)
+        out = ri.read_idb(valid[-nfile:], navg=10, precision='compact')
         return out, False
     except Exception as err2:
         print('Fallback uncalibrated read failed: {0}'.format(err2))
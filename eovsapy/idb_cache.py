@@ -0,0 +1,236 @@
+"""On-disk columnar cache for decoded IDB and UDB files.
+
+Decoding a Miriad file through aipy is the slowest step of every IDB reader,
+and the same files are often decoded many times (pipelines, the calibration
+widget, the flare monitor).  This module keeps the dictionary returned by a
+reader on disk, one ``.npy`` file per array plus a small ``meta.json`` sidecar,
+so that a later read of the same file can be served with ``np.load`` in
+memory-mapped mode without touching aipy at all.
+
+Entries are keyed by the reader, its decoding parameters and the identity of
+the source dataset (absolute path, total size and latest modification time),
+so a file that is rewritten simply stops matching its old entry.  The total
+size of the cache is bounded, and the least recently used entries are evicted
+first.
+
+The cache is opt-in.  Set ``EOVSA_IDB_CACHE`` to a directory to enable it for
+the standard readers, and ``EOVSA_IDB_CACHE_MAXGB`` to change the size bound
+(default 20 GB).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+import numpy.ma as ma
+
+CACHE_VERSION = 1
+DEFAULT_MAX_GB = 20.0
+META_NAME = "meta.json"
+
+_default_caches: Dict[Tuple[str, float], "IDBCache"] = {}
+
+
+def source_signature(path: str) -> Dict[str, Any]:
+    """Return the identity of a Miriad dataset (or plain file).
+
+    :param path: Path to a Miriad dataset directory or a regular file.
+    :type path: str
+    :returns: Absolute path, total size in bytes and latest mtime in ns.
+    :rtype: dict
+    :raises OSError: If the path does not exist.
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        size = 0
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    size += stat.st_size
+                    mtime = max(mtime, stat.st_mtime_ns)
+    else:
+        stat = os.stat(path)
+        size, mtime = stat.st_size, stat.st_mtime_ns
+    return {"path": path, "size": size, "mtime_ns": mtime}
+
+
+def _jsonable(value: Any) -> Any:
+    """Convert a scalar reader value into a JSON value, or raise TypeError."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+class IDBCache:
+    """Size-bounded LRU cache of decoded reader output dictionaries.
+
+    :param root: Directory that holds the cache entries.
+    :type root: str
+    :param max_bytes: Upper bound on the total size of all entries.
+    :type max_bytes: int
+    """
+
+    def __init__(self, root: str, max_bytes: int = int(DEFAULT_MAX_GB * 2**30)) -> None:
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_key(self, path: str, reader: str, params: Mapping[str, Any]) -> str:
+        """Return the entry name for one decoding of one source dataset."""
+        ident = {
+            "version": CACHE_VERSION,
+            "source": source_signature(path),
+            "reader": reader,
+            "params": dict(params),
+        }
+        return hashlib.sha1(json.dumps(ident, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def load(
+        self,
+        path: str,
+        reader: str,
+        params: Mapping[str, Any],
+        mmap_mode: Optional[str] = "r",
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached output dictionary for ``path``, or ``None`` on a miss.
+
+        :param path: Source dataset that was decoded.
+        :param reader: Name of the reader that produced the dictionary.
+        :param params: Decoding parameters that affect the output.
+        :param mmap_mode: Passed to ``np.load``.  Use ``"c"`` (copy-on-write) for
+            callers that modify the returned arrays in place.
+        """
+        try:
+            entry = os.path.join(self.root, self.entry_key(path, reader, params))
+            with open(os.path.join(entry, META_NAME)) as handle:
+                meta = json.load(handle)
+            out: Dict[str, Any] = dict(meta["values"])
+            for name, info in meta["arrays"].items():
+                data = np.load(os.path.join(entry, name + ".npy"), mmap_mode=mmap_mode)
+                if info["masked"]:
+                    mask = np.load(os.path.join(entry, name + ".mask.npy"), mmap_mode=mmap_mode)
+                    data = ma.masked_array(data, mask=mask)
+                out[name] = data
+            # Mark as recently used
+            os.utime(os.path.join(entry, META_NAME))
+        except (OSError, ValueError, KeyError):
+            # Missing, partially evicted or unreadable entry
+            return None
+        return out
+
+    def store(self, path: str, reader: str, params: Mapping[str, Any], out: Mapping[str, Any]) -> bool:
+        """Write one reader output dictionary to the cache.
+
+        Arrays (including masked arrays) are written as ``.npy`` columns, other
+        values go into the JSON sidecar.  The entry is written under a temporary
+        name and renamed into place, so concurrent readers never see a partial
+        entry.  Returns False if the dictionary holds a value that cannot be cached.
+        """
+        key = self.entry_key(path, reader, params)
+        entry = os.path.join(self.root, key)
+        if os.path.isdir(entry):
+            return True
+        tmp = os.path.join(self.root, f".tmp-{key}-{os.getpid()}")
+        meta: Dict[str, Any] = {
+            "version": CACHE_VERSION,
+            "source": source_signature(path),
+            "reader": reader,
+            "params": dict(params),
+            "arrays": {},
+            "values": {},
+            "nbytes": 0,
+        }
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for name, value in out.items():
+                if isinstance(value, np.ndarray):
+                    masked = isinstance(value, ma.MaskedArray)
+                    np.save(os.path.join(tmp, name + ".npy"), ma.getdata(value))
+                    meta["nbytes"] += value.nbytes
+                    if masked:
+                        np.save(os.path.join(tmp, name + ".mask.npy"), ma.getmaskarray(value))
+                        meta["nbytes"] += value.size
+                    meta["arrays"][name] = {"masked": masked}
+                else:
+                    meta["values"][name] = _jsonable(value)
+            with open(os.path.join(tmp, META_NAME), "w") as handle:
+                json.dump(meta, handle)
+            os.rename(tmp, entry)
+        except TypeError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        except OSError:
+            # Most likely another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return os.path.isdir(entry)
+        self.evict()
+        return True
+
+    def entries(self) -> Dict[str, Tuple[float, int]]:
+        """Return ``{entry: (last use time, size in bytes)}`` for all complete entries."""
+        result = {}
+        with os.scandir(self.root) as items:
+            for item in items:
+                if item.name.startswith(".") or not item.is_dir():
+                    continue
+                try:
+                    meta_path = os.path.join(item.path, META_NAME)
+                    with open(meta_path) as handle:
+                        nbytes = int(json.load(handle)["nbytes"])
+                    result[item.name] = (os.stat(meta_path).st_mtime, nbytes)
+                except (OSError, ValueError, KeyError):
+                    continue
+        return result
+
+    def total_bytes(self) -> int:
+        """Return the total size of all cache entries."""
+        return sum(nbytes for _, nbytes in self.entries().values())
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """Remove least recently used entries until the cache fits in ``max_bytes``.
+
+        Returns the number of entries removed.
+        """
+        limit = self.max_bytes if max_bytes is None else int(max_bytes)
+        entries = sorted(self.entries().items(), key=lambda item: item[1][0])
+        total = sum(nbytes for _, (_, nbytes) in entries)
+        removed = 0
+        for name, (_, nbytes) in entries:
+            if total <= limit:
+                break
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            total -= nbytes
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        self.evict(max_bytes=0)
+
+
+def default_cache() -> Optional[IDBCache]:
+    """Return the cache configured by ``EOVSA_IDB_CACHE``, or ``None`` if it is not set."""
+    root = os.getenv("EOVSA_IDB_CACHE")
+    if not root:
+        return None
+    try:
+        max_gb = float(os.getenv("EOVSA_IDB_CACHE_MAXGB", DEFAULT_MAX_GB))
+    except ValueError:
+        max_gb = DEFAULT_MAX_GB
+    key = (os.path.abspath(root), max_gb)
+    if key not in _default_caches:
+        try:
+            _default_caches[key] = IDBCache(root, max_bytes=int(max_gb * 2**30))
+        except OSError:
+            print("IDB_CACHE: Cannot create cache directory", root, "- caching disabled.")
+            return None
+    return _default_caches[key]
@@ -0,0 +1,201 @@
+"""Pickle-free, memory-mappable file format for ``read_idb`` output dictionaries.
+
+``read_idb.read_npz`` reads NPZ files holding a single pickled dictionary, which
+must be unpickled (and decompressed) as a whole to get at any one key.  This
+module stores the same dictionary as an uncompressed zip archive with one
+``.npy`` member per array and a ``manifest.json`` member that lists the arrays
+and holds the non-array values (source name, RA, Dec, ...).  Because the
+members are stored uncompressed, any array can be read on its own, or memory
+mapped directly from the archive file.
+
+The format is versioned through the manifest.  Files written here use the
+``.idbz`` extension by convention, and :func:`convert_npz` converts existing
+NPZ files.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional
+
+import numpy as np
+import numpy.ma as ma
+
+FORMAT_NAME = "eovsapy-idb"
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+EXTENSION = ".idbz"
+
+_LOCAL_HEADER_SIZE = 30
+
+
+def _jsonable(value: Any) -> Any:
+    """Convert a non-array value into a JSON value, or raise TypeError."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+
+def save(path: str, out: Mapping[str, Any]) -> None:
+    """Write a ``read_idb``/``readXdata`` output dictionary to ``path``.
+
+    :param path: Output file name (conventionally ending in ``.idbz``).
+    :type path: str
+    :param out: Dictionary of arrays (including masked arrays) and scalars.
+    :type out: dict
+    :raises TypeError: If a value is an object array or another type that
+        cannot be stored without pickling.
+    """
+    manifest: Dict[str, Any] = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "arrays": {}, "values": {}}
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for key, value in out.items():
+                if isinstance(value, np.ndarray):
+                    if value.dtype.hasobject:
+                        raise TypeError(f"Cannot store object array {key!r}")
+                    masked = isinstance(value, ma.MaskedArray)
+                    _write_member(archive, key + ".npy", ma.getdata(value))
+                    if masked:
+                        _write_member(archive, key + ".mask.npy", ma.getmaskarray(value))
+                    manifest["arrays"][key] = {
+                        "dtype": value.dtype.str,
+                        "shape": list(value.shape),
+                        "masked": masked,
+                    }
+                else:
+                    manifest["values"][key] = _jsonable(value)
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=1))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _write_member(archive: zipfile.ZipFile, name: str, array: np.ndarray) -> None:
+    with archive.open(name, "w", force_zip64=True) as handle:
+        np.lib.format.write_array(handle, np.asanyarray(array), allow_pickle=False)
+
+
+def is_store(path: str) -> bool:
+    """Return True if ``path`` is a file in this format."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+        return manifest.get("format") == FORMAT_NAME
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return False
+
+
+class IDBStore(Mapping[str, Any]):
+    """Read-only, lazy view of a stored output dictionary.
+
+    Arrays are read from the archive only when their key is accessed.
+
+    :param path: File written by :func:`save`.
+    :type path: str
+    :param mmap_mode: If given (``"r"``, ``"c"`` or ``"r+"``), arrays are memory
+        mapped from the archive instead of read into memory.
+    :type mmap_mode: str, optional
+    :raises ValueError: If the file is not in this format, or is of a newer version.
+    """
+
+    def __init__(self, path: str, mmap_mode: Optional[str] = None) -> None:
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with zipfile.ZipFile(path) as archive:
+            try:
+                self.manifest = json.loads(archive.read(MANIFEST_NAME))
+            except KeyError:
+                raise ValueError(f"{path} has no {MANIFEST_NAME}") from None
+            self._members = {info.filename: info for info in archive.infolist()}
+        if self.manifest.get("format") != FORMAT_NAME:
+            raise ValueError(f"{path} is not an {FORMAT_NAME} file")
+        if self.manifest.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {self.manifest['version']}, newer than {FORMAT_VERSION}")
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.manifest["values"]:
+            return self.manifest["values"][key]
+        info = self.manifest["arrays"][key]
+        data = self._read(key + ".npy")
+        if info["masked"]:
+            data = ma.masked_array(data, mask=self._read(key + ".mask.npy"))
+        return data
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.manifest["arrays"]
+        yield from self.manifest["values"]
+
+    def __len__(self) -> int:
+        return len(self.manifest["arrays"]) + len(self.manifest["values"])
+
+    def _read(self, name: str) -> np.ndarray:
+        info = self._members[name]
+        with open(self.path, "rb") as handle:
+            # The local header can have a different extra field than the central directory
+            handle.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", handle.read(4))
+            start = info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len
+            handle.seek(start)
+            version = np.lib.format.read_magic(handle)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(handle)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(handle)
+            offset = handle.tell()
+            if self.mmap_mode is not None:
+                if int(np.prod(shape)) == 0:
+                    return np.zeros(shape, dtype=dtype)
+                return np.memmap(
+                    self.path, dtype=dtype, mode=self.mmap_mode, offset=offset, shape=shape,
+                    order="F" if fortran else "C",
+                )
+            count = int(np.prod(shape))
+            data = np.fromfile(handle, dtype=dtype, count=count)
+        return data.reshape(shape, order="F" if fortran else "C")
+
+    def load(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Return a plain dictionary of the given keys (default all of them)."""
+        return {key: self[key] for key in (self if keys is None else keys)}
+
+
+def load(path: str, keys: Optional[Iterable[str]] = None, mmap_mode: Optional[str] = None) -> Dict[str, Any]:
+    """Read a stored output dictionary.
+
+    :param path: File written by :func:`save`.
+    :param keys: Keys to read.  Default is all of them.
+    :param mmap_mode: Memory-map the arrays with this mode instead of reading them.
+    :rtype: dict
+    """
+    return IDBStore(path, mmap_mode=mmap_mode).load(keys)
+
+
+def convert_npz(npz_path: str, out_path: Optional[str] = None) -> str:
+    """Convert an NPZ file of the kind read by ``read_idb.read_npz``.
+
+    The NPZ file holds a pickled dictionary, so it must come from a trusted source.
+
+    :param npz_path: Existing NPZ file.
+    :param out_path: Output file.  Default replaces the ``.npz`` extension by ``.idbz``.
+    :returns: Name of the file written.
+    :rtype: str
+    """
+    if out_path is None:
+        out_path = os.path.splitext(npz_path)[0] + EXTENSION
+    with np.load(npz_path, allow_pickle=True, encoding="latin1") as data:
+        out = data[data.files[0]].item()
+    save(out_path, out)
+    return out_path
+
+
+def convert_npz_files(npz_paths: Iterable[str]) -> List[str]:
+    """Convert several NPZ files with :func:`convert_npz`, returning the new names."""
+    return [convert_npz(path) for path in npz_paths]
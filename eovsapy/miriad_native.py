@@ -0,0 +1,472 @@
+"""Pure-numpy reader for the visibility data of Miriad uv datasets.
+
+The IDB readers normally get every record through aipy's ``UV.raw_read``,
+which costs a Python call (and a round of variable lookups) per record.  This
+module reads the ``vartable``, ``header`` and ``visdata`` items of a dataset
+directly, and the ``flags`` item as one bit stream, so that the preamble, the
+correlation data, the flags and any other variable can be had for all records
+as numpy arrays.
+
+The visibility stream is a sequence of 8-byte aligned entries, each starting
+with a 4-byte header (variable number, entry kind).  A variable's value is only
+written when it changes, so the stream has to be walked from the start, but
+the records within a time have a regular layout (the same variables, in the
+same order).  The walk therefore parses records one at a time only until the
+layout of the last few records is seen to repeat, and then checks the entry
+headers of the following repeats of that block in one vectorized step, which
+confirms exactly what a record-by-record walk would have found.
+
+Only the entry kinds and variable types written by the EOVSA correlator are
+handled; anything else raises ValueError, and the aipy reader can be used
+instead.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+VAR_SIZE = 0
+VAR_DATA = 1
+VAR_EOR = 2
+
+ALIGN = 8
+MAX_PERIOD = 8
+MIN_RUN = 2 * MAX_PERIOD
+FIRST_CHECK = 16
+MAX_CHECK = 4096
+
+# Big-endian storage type and alignment of each Miriad variable type
+_DTYPES = {"a": "S1", "b": "i1", "j": ">i2", "i": ">i4", "r": ">f4", "d": ">f8", "c": ">c8"}
+_ALIGNS = {"a": 1, "b": 1, "j": 2, "i": 4, "r": 4, "d": 8, "c": 8}
+
+
+def _roundup(offset: int, align: int) -> int:
+    return -(-offset // align) * align
+
+
+def read_vartable(path: str) -> List[Tuple[str, str]]:
+    """Return the (name, type) of each uv variable, in variable-number order.
+
+    :param path: Miriad dataset directory.
+    :type path: str
+    :rtype: list of tuple
+    """
+    with open(os.path.join(path, "vartable")) as handle:
+        return [(line.split()[1], line.split()[0]) for line in handle if line.strip()]
+
+
+def read_header_item(path: str, name: str) -> Optional[Any]:
+    """Return a numeric or text item from the ``header`` file, or None if absent.
+
+    :param path: Miriad dataset directory.
+    :type path: str
+    :param name: Item name, e.g. ``vislen``.
+    :type name: str
+    """
+    with open(os.path.join(path, "header"), "rb") as handle:
+        header = handle.read()
+    # Items are 16-byte aligned: a 15-character name, a length byte, then the value
+    off = 0
+    while off + 16 <= len(header):
+        item = header[off:off + 15].rstrip(b"\0").decode("ascii", "replace")
+        length = header[off + 15]
+        value = header[off + 16:off + 16 + length]
+        if item == name:
+            kind = int.from_bytes(value[:4], "big")
+            if kind == 1:
+                return value[4:].decode("ascii", "replace")
+            dtype = {2: ">i4", 3: ">i2", 4: ">f4", 5: ">f8", 8: ">i8"}.get(kind)
+            if dtype is None:
+                raise ValueError(f"{path}: header item {name!r} has unsupported type {kind}")
+            size = np.dtype(dtype).itemsize
+            start = _roundup(4, size)
+            return np.frombuffer(value[start:start + size], dtype=dtype)[0].item()
+        off = _roundup(off + 16 + length, 16)
+    return None
+
+
+def record_count(path: str) -> Optional[int]:
+    """Return the number of records of a dataset from its ``ncorr`` header item,
+    without indexing the visibility stream.  Only the entry headers at the
+    start of ``visdata`` are read, up to the size of the first ``corr`` entry,
+    which gives the number of channels.
+
+    :param path: Miriad dataset directory.
+    :type path: str
+    :returns: The number of records, or None if the header has no ``ncorr``
+        (e.g. a file that was never closed) or ``corr`` is not found.
+    """
+    ncorr = read_header_item(path, "ncorr")
+    if ncorr is None:
+        return None
+    if ncorr == 0:
+        return 0
+    vars = read_vartable(path)
+    names = [name for name, _ in vars]
+    if "corr" not in names:
+        return None
+    corr = names.index("corr")
+    width = {"r": 8, "j": 4, "c": 8}.get(vars[corr][1])
+    if width is None:
+        return None
+    sizes: Dict[int, int] = {}
+    with open(os.path.join(path, "visdata"), "rb") as handle:
+        end = os.fstat(handle.fileno()).st_size
+        off = 0
+        while off + 8 <= end:
+            handle.seek(off)
+            head = handle.read(8)
+            var, kind = head[0], head[2]
+            if kind == VAR_SIZE:
+                size = int.from_bytes(head[4:8], "big")
+                if var == corr:
+                    return int(ncorr) // (size // width) if size >= width else None
+                sizes[var] = size
+                off += 8
+            elif kind == VAR_DATA:
+                if var not in sizes or var >= len(vars) or not _ALIGNS.get(vars[var][1]):
+                    return None
+                off = _roundup(_roundup(off + 4, _ALIGNS[vars[var][1]]) + sizes[var], ALIGN)
+            elif kind == VAR_EOR:
+                off = _roundup(off + 4, ALIGN)
+            else:
+                return None
+    return None
+
+
+class MiriadFile:
+    """Bulk reader for the uv records of one Miriad dataset.
+
+    The whole visibility stream is indexed when the file is opened (the data
+    are memory mapped, not read), after which variables, correlation data and
+    flags can be read for all records, or for a range of records.
+
+    :param path: Miriad dataset directory.
+    :type path: str
+    :raises ValueError: If the visibility stream has an entry this reader does
+        not handle.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.vars = read_vartable(path)
+        self.vartable = dict(self.vars)
+        self._index = {name: n for n, (name, _) in enumerate(self.vars)}
+        self._aligns = [_ALIGNS.get(vtype, 0) for _, vtype in self.vars]
+        size = os.path.getsize(os.path.join(path, "visdata"))
+        vislen = read_header_item(path, "vislen")
+        end = size if vislen is None else min(size, int(vislen))
+        self._handle = open(os.path.join(path, "visdata"), "rb")
+        if size > 0:
+            self._mm = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buf = np.frombuffer(self._mm, dtype=np.uint8)
+        else:
+            self._mm = None
+            self._buf = np.zeros(0, dtype=np.uint8)
+        self._words = self._buf[:len(self._buf) // 4 * 4].view(">u4")
+        # Per variable: lists of (first record, record step, count, first offset, offset step, size)
+        self._runs: List[List[Tuple[int, int, int, int, int, int]]] = [[] for _ in self.vars]
+        self._sizes: Dict[int, int] = {}
+        self.nrec = self._scan(end)
+        self._offsets: Dict[int, np.ndarray] = {}
+        self._flag_words: Optional[np.ndarray] = None
+        self._updates: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def close(self) -> None:
+        """Release the memory map of the visibility stream."""
+        self._buf = self._words = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # Arrays still view the map; it is released when they are
+                pass
+        self._handle.close()
+
+    def __enter__(self) -> "MiriadFile":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    # Walking the visibility stream
+
+    def _parse_record(self, off: int, end: int) -> Optional[Tuple[int, list]]:
+        """Parse the record starting at off.  Returns (next offset, entries), where
+        entries are (header offset, header word, variable, kind, size or data
+        offset), or None if the stream ends within the record.
+        """
+        mm = self._mm
+        entries = []
+        while off + 4 <= end:
+            var, kind = mm[off], mm[off + 2]
+            word = int.from_bytes(mm[off:off + 4], "big")
+            if kind == VAR_SIZE:
+                if off + 8 > end:
+                    return None
+                size = int.from_bytes(mm[off + 4:off + 8], "big")
+                self._sizes[var] = size
+                entries.append((off, word, var, kind, size))
+                off += 8
+            elif kind == VAR_DATA:
+                if var not in self._sizes or var >= len(self.vars) or not self._aligns[var]:
+                    raise ValueError(f"{self.path}: cannot read variable number {var} at offset {off}")
+                data = _roundup(off + 4, self._aligns[var])
+                if data + self._sizes[var] > end:
+                    return None
+                entries.append((off, word, var, kind, data))
+                off = _roundup(data + self._sizes[var], ALIGN)
+            elif kind == VAR_EOR:
+                entries.append((off, word, var, kind, 0))
+                return _roundup(off + 4, ALIGN), entries
+            else:
+                raise ValueError(f"{self.path}: unknown entry kind {kind} at offset {off}")
+        return None
+
+    def _repeats(self, start: int, length: int, entries: list, end: int) -> int:
+        """Return how many times the block of records of the given length and
+        entries, which starts at start, is repeated right after itself.
+        """
+        rel = np.array([e[0] - start for e in entries]) // 4
+        expect = np.array([e[1] for e in entries], dtype=np.uint32)
+        nmax = (end - start) // length - 1
+        nrep = 0
+        check = FIRST_CHECK
+        while nrep < nmax:
+            m = np.arange(nrep + 1, min(nmax, nrep + check) + 1)
+            pos = (start + m[:, None] * length) // 4 + rel
+            good = np.all(self._words[pos] == expect, axis=1)
+            nbad = np.argmin(good) if not good.all() else len(m)
+            nrep += nbad
+            if nbad < len(m):
+                break
+            check = min(8 * check, MAX_CHECK)
+        return nrep
+
+    def _scan(self, end: int) -> int:
+        off = 0
+        nrec = 0
+        recent: List[Tuple[int, int, tuple, list]] = []    # (start, length, layout, entries)
+        # For each period, the record number up to which a short repeat is known
+        retry = [0] * (MAX_PERIOD + 1)
+        while off < end:
+            parsed = self._parse_record(off, end)
+            if parsed is None:
+                break
+            nxt, entries = parsed
+            for e in entries:
+                if e[3] == VAR_DATA:
+                    self._runs[e[2]].append((nrec, 1, 1, e[4], 0, self._sizes[e[2]]))
+            layout = tuple((e[0] - off, e[1], e[4] - off if e[3] == VAR_DATA else e[4]) for e in entries)
+            recent.append((off, nxt - off, layout, entries))
+            nrec += 1
+            off = nxt
+            # Look for the block of the latest records that repeats furthest, with no
+            # size changes.  Short repeats are left to the record-by-record walk, so
+            # that they do not hide a longer period.
+            best = None
+            for period in range(1, min(MAX_PERIOD, len(recent) // 2) + 1):
+                if nrec < retry[period]:
+                    continue
+                block = recent[-period:]
+                if [r[2] for r in recent[-2 * period:-period]] != [r[2] for r in block]:
+                    continue
+                if any(e[3] == VAR_SIZE for r in block for e in r[3]):
+                    continue
+                start = block[0][0]
+                nrep = self._repeats(start, off - start, [e for r in block for e in r[3]], end)
+                retry[period] = nrec + nrep * period
+                if nrep * period >= MIN_RUN and (best is None or nrep * period > best[0] * best[1]):
+                    best = (nrep, period)
+            if best is not None:
+                nrep, period = best
+                block = recent[-period:]
+                length = off - block[0][0]
+                for i, r in enumerate(block):
+                    for e in r[3]:
+                        if e[3] == VAR_DATA:
+                            self._runs[e[2]].append((nrec + i, period, nrep, e[4] + length, length, self._sizes[e[2]]))
+                nrec += nrep * period
+                off += nrep * length
+                recent = []
+                retry = [0] * (MAX_PERIOD + 1)
+            del recent[:-2 * MAX_PERIOD]
+        return nrec
+
+    # Reading variables
+
+    def _var(self, name: str) -> int:
+        try:
+            return self._index[name]
+        except KeyError:
+            raise KeyError(f"{self.path} has no variable {name!r}") from None
+
+    def _convert(self, name: str, raw: np.ndarray) -> np.ndarray:
+        """Convert (n, nbytes) raw values of a variable to native values."""
+        vtype = self.vartable[name]
+        if vtype == "a":
+            return raw
+        values = np.ascontiguousarray(raw).view(_DTYPES[vtype])
+        return values.astype(values.dtype.newbyteorder("="))
+
+    def updates(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the record numbers where a variable is set, and its values there.
+
+        :param name: Variable name.
+        :returns: (records, values), where values has one row per update (of
+            bytes for text variables), or is a list of rows if the length of the
+            variable changes.
+        """
+        if name not in self._updates:
+            var = self._var(name)
+            runs = self._runs[var]
+            r0, step, count, off0, ostep, size = np.array(runs, dtype=np.int64).reshape(-1, 6).T
+            # Position of each update within its run
+            n = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            recs = np.repeat(r0, count) + np.repeat(step, count) * n
+            offsets = np.repeat(off0, count) + np.repeat(ostep, count) * n
+            order = np.argsort(recs, kind="stable")
+            if len(set(size.tolist())) <= 1:
+                size = int(size[0]) if len(size) else self._sizes.get(var, 0)
+                raw = self._buf[offsets[order, None] + np.arange(size)]
+                values = self._convert(name, raw)
+            else:
+                sizes = np.repeat(size, count)
+                values = [self._convert(name, self._buf[offsets[k]:offsets[k] + sizes[k]][None])[0] for k in order]
+            self._updates[name] = (recs[order], values)
+        return self._updates[name]
+
+    def update_index(self, name: str) -> np.ndarray:
+        """Return, for each record, the index into updates(name) of the value in
+        effect (-1 before the variable is first set).
+        """
+        recs, _ = self.updates(name)
+        return np.searchsorted(recs, np.arange(self.nrec), side="right") - 1
+
+    def __getitem__(self, name: str) -> Any:
+        """Return the value of a variable at the first record, as aipy's UV does
+        for a newly opened file: a str for text, a scalar for single values,
+        otherwise an array.
+        """
+        recs, values = self.updates(name)
+        if len(recs) == 0:
+            raise KeyError(f"{self.path}: variable {name!r} is never set")
+        return self._value(name, values[0])
+
+    def _value(self, name: str, value: np.ndarray) -> Any:
+        if self.vartable[name] == "a":
+            return value.tobytes().decode("ascii", "replace")
+        if len(value) == 1:
+            return value[0].item()
+        return value
+
+    def values(self, name: str, records: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the values of a numeric variable in effect at each record.
+
+        :param name: Variable name.
+        :param records: Record numbers.  Default is all records.
+        :returns: Array with one row per record (1-D for single values).  Rows
+            for records before the variable is first set are zero.
+        """
+        index = self.update_index(name)
+        if records is not None:
+            index = index[records]
+        _, values = self.updates(name)
+        if len(values) == 0:
+            raise KeyError(f"{self.path}: variable {name!r} is never set")
+        if isinstance(values, list):
+            raise ValueError(f"{self.path}: variable {name!r} changes length")
+        out = values[np.maximum(index, 0)]
+        out[index < 0] = 0
+        return out[:, 0] if values.shape[1] == 1 else out
+
+    def preamble(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Return (uvw, t, i, j) for all records, as given by aipy: the ``coord``
+        values, the ``time`` values, and the zero-based antenna numbers decoded
+        from ``baseline``.
+        """
+        uvw = self.values("coord")
+        if uvw.shape[1] == 2:
+            uvw = np.concatenate([uvw, np.zeros((len(uvw), 1))], 1)
+        t = self.values("time")
+        bl = self.values("baseline").astype(np.int64)
+        big = bl > 65536
+        mant = np.where(big, 2048, 256)
+        bl = bl - 65536 * big
+        return uvw, t, bl // mant - 1, bl % mant - 1
+
+    # Reading the correlation data
+
+    def _records(self, records: Optional[np.ndarray]) -> np.ndarray:
+        if records is None:
+            return np.arange(self.nrec)
+        records = np.asarray(records, dtype=np.int64)
+        if len(records) and (np.any(np.diff(records) <= 0) or records[0] < 0 or records[-1] >= self.nrec):
+            raise ValueError("records must be increasing record numbers of this file")
+        return records
+
+    def _per_record(self, name: str, records: np.ndarray) -> np.ndarray:
+        """Return the raw values of a variable that is set in every record, for
+        the given record numbers.
+        """
+        var = self._var(name)
+        if var not in self._offsets:
+            # Offset of the value in each record
+            offsets = np.full(self.nrec, -1, dtype=np.int64)
+            runs = self._runs[var]
+            for r0, step, count, off0, ostep, size in runs:
+                offsets[r0:r0 + (count - 1) * step + 1:step] = off0 + ostep * np.arange(count)
+            if np.any(offsets < 0) or sum(r[2] for r in runs) != self.nrec:
+                raise ValueError(f"{self.path}: {name!r} is not set once in every record")
+            if len({r[5] for r in runs}) > 1:
+                raise ValueError(f"{self.path}: {name!r} changes length")
+            self._offsets[var] = offsets
+        size = self._sizes[var]
+        align = _ALIGNS[self.vartable[name]]
+        # Every aligned offset of the stream, viewed as the start of a row
+        rows = np.lib.stride_tricks.as_strided(
+            self._buf, shape=((len(self._buf) - size) // align + 1, size), strides=(align, 1))
+        return rows[self._offsets[var][records] // align]
+
+    def data(self, records: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the ``corr`` data as complex64, one row per record.
+
+        :param records: Increasing record numbers.  Default is all records.
+        """
+        vtype = self.vartable.get("corr")
+        if vtype not in ("r", "c"):
+            raise ValueError(f"{self.path}: corr of type {vtype!r} is not supported")
+        raw = self._per_record("corr", self._records(records))
+        return raw.view(">f4").astype(np.float32).view(np.complex64)
+
+    def flags(self, records: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the flags, one row per record.  True means good, as in Miriad
+        (and aipy's ``raw_read``).
+
+        :param records: Increasing record numbers.  Default is all records.
+        """
+        records = self._records(records)
+        nchan = self._sizes.get(self._var("corr"), 0) // 8
+        if self._flag_words is None:
+            words = np.fromfile(os.path.join(self.path, "flags"), dtype=">i4", offset=4)
+            if len(words) * 31 < self.nrec * nchan:
+                raise ValueError(f"{self.path}: flags item is shorter than the visibility data")
+            self._flag_words = words.astype(np.int32)
+        # Each 32-bit word holds 31 flags, least significant bit first
+        if len(records) == 0:
+            return np.zeros((0, nchan), dtype=bool)
+        first = records[0] * nchan
+        stop = (records[-1] + 1) * nchan
+        if stop - first <= 4 * len(records) * nchan:
+            # Unpack all of the flags of the span of records
+            w0 = first // 31
+            words = self._flag_words[w0:-(-stop // 31)]
+            bits = np.unpackbits(words.astype("<u4").view(np.uint8), bitorder="little").reshape(-1, 32)[:, :31]
+            bits = bits.reshape(-1)[first - 31 * w0:stop - 31 * w0].reshape(-1, nchan)
+            return bits[records - records[0]].view(bool)
+        bit = records[:, None] * nchan + np.arange(nchan)
+        return ((self._flag_words[bit // 31] >> (bit % 31)) & 1).astype(bool)
@@ -115,6 +115,11 @@
 #    a warning to the screen.
 #  2025-05-22
 #    Changed to work with 16 antennas
+#  2026-10-17  SY
+#    Added the prefetch keyword to udb_corr(), to read the next files ahead in a
+#    background thread while the current one is processed.
+#    udb_corr() concatenates the corrected data of all files in one concatXdata()
+#    call at the end, instead of one call per file.
 #
 
 from . import dbutil as db
@@ -599,7 +604,8 @@ def unrot(data, azeldict=None):
     return cdata
 
 
-def udb_corr(filelist, outpath='./', calibrate=False, new=True, gctime=None, attncal=True, desat=False):
+def udb_corr(filelist, outpath='./', calibrate=False, new=True, gctime=None, attncal=True, desat=False,
+             prefetch=None):
     ''' Complete routine to read in an existing idb or udb file and output
         a new file of the same name in the local directory, with all corrections
         applied.
@@ -621,6 +627,8 @@ def udb_corr(filelist, outpath='./', calibrate=False, new=True, gctime=None, att
                         gctime is only used if parameter new is True.
           attncal   If False, the attenuation correction is skipped - expected to be
                         applied manually in post-processing (e.g. 2017-09-10 X8 flare)          
+          prefetch  If set, this many files are read ahead in a background thread
+                        while the current one is being processed.  Default None.
     '''
     import sys
     import os
@@ -636,7 +644,10 @@ def udb_corr(filelist, outpath='./', calibrate=False, new=True, gctime=None, att
             filelist[idx] = file[:-1]
 
     filecount = 0
-    for filename in filelist:
+    xlist = []
+    from .prefetch import Prefetcher
+    ahead = Prefetcher(filelist, prefetch)
+    for filename in ahead:
         t1 = time.time()
         if desat and filename.find('UDB') != -1:
             print(('File',filename,'appears to be a UDB file, so desat=True will be ignored.'))
@@ -715,10 +726,12 @@ def udb_corr(filelist, outpath='./', calibrate=False, new=True, gctime=None, att
                        Time(calfac['sqltime'], format='lv').iso[:19])
         sys.stdout.flush()
         filecount += 1
-        if filecount == 1:
-            x = coutu
-        else:
-            x = uu.concatXdata(x, coutu)
+        xlist.append(coutu)
+    if prefetch:
+        print('Read-ahead hits:', ahead.hits, 'misses:', ahead.misses)
+    # Concatenate all of the files at once
+    x = uu.concatXdata(xlist)
+    del xlist
     ufilename = outpath + filelist[0].split('/')[-1]
     from os.path import exists
     while exists(ufilename):
@@ -0,0 +1,138 @@
+"""Read-ahead of the next files of a sequential file walk.
+
+The IDB and UDB readers decode one Miriad dataset at a time, so on a network
+file system the reading thread alternates between waiting for the disk and
+decoding.  :class:`Prefetcher` walks the same file list in a background thread
+and reads the next few datasets (every regular file inside a dataset
+directory) ahead of the consumer, so that they are in the operating system's
+page cache by the time the reader opens them.  The data themselves are thrown
+away; only the page cache is warmed, so the readers need no changes beyond
+iterating over the prefetcher instead of the list.
+
+A file that was completely read ahead before the consumer reached it counts as
+a hit, anything else as a miss.  Files that the consumer has already reached
+are not read ahead any more, so a slow disk never makes the same file be read
+twice at once.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+BLOCK_BYTES = 1 << 20
+
+
+def _dataset_files(path: str) -> List[str]:
+    """Return the regular files of a Miriad dataset directory, or the path itself."""
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file())
+    return [path]
+
+
+class Prefetcher:
+    """Iterate over ``files`` while the next ``depth`` of them are read ahead.
+
+    Iterating starts the background thread, and the thread stops when the
+    iteration ends (or the prefetcher is closed or garbage collected).  Errors
+    while reading ahead are ignored; the consumer will meet them itself.
+
+    :param files: File or Miriad dataset names, in the order they will be read.
+    :type files: iterable of str
+    :param depth: Number of files to keep read ahead of the one being consumed.
+        With 0 or None, the files are simply iterated over.
+    :type depth: int, optional
+    :param block_bytes: Size of the reads made by the background thread.
+    :type block_bytes: int
+    """
+
+    def __init__(self, files: Iterable[str], depth: Optional[int] = 2, block_bytes: int = BLOCK_BYTES) -> None:
+        self.files = list(files)
+        self.depth = int(depth or 0)
+        self.block_bytes = block_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self._cond = threading.Condition()
+        self._current = -1
+        self._done = [False] * len(self.files)
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def __iter__(self) -> Iterator[str]:
+        if self.depth <= 0:
+            yield from self.files
+            return
+        self._start()
+        try:
+            for n, name in enumerate(self.files):
+                with self._cond:
+                    if self._done[n]:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                    self._current = n
+                    self._cond.notify_all()
+                yield name
+        finally:
+            self.close()
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counts and the number of bytes read ahead."""
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.bytes_read}
+
+    def close(self) -> None:
+        """Stop the background thread and wait for it to finish."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="eovsapy-prefetch", daemon=True)
+            self._thread.start()
+
+    def _wanted(self, n: int) -> bool:
+        """Called with the lock held: True while file n is still ahead of the consumer."""
+        return not self._closed and n > self._current
+
+    def _run(self) -> None:
+        buf = bytearray(self.block_bytes)
+        for n, name in enumerate(self.files):
+            with self._cond:
+                while not self._closed and n > self._current + self.depth:
+                    self._cond.wait()
+                if not self._wanted(n):
+                    if self._closed:
+                        return
+                    continue
+            if self._warm(n, name, buf):
+                with self._cond:
+                    self._done[n] = True
+
+    def _warm(self, n: int, name: str, buf: bytearray) -> bool:
+        """Read file n through the page cache.  Returns False if abandoned."""
+        try:
+            for path in _dataset_files(name):
+                with open(path, "rb", buffering=0) as handle:
+                    while True:
+                        nbytes = handle.readinto(buf)
+                        if not nbytes:
+                            break
+                        with self._cond:
+                            self.bytes_read += nbytes
+                            if not self._wanted(n):
+                                return False
+        except OSError:
+            return False
+        return True
@@ -136,11 +136,70 @@
 #    Change unrot() to agree with the one in pipeline_cal.py.
 #  2025-05-22  DG
 #    Changed to work for 16 antennas.
+#  2026-10-17  SY
+#    Replaced the record-by-record loop in readXdata() with a block decoder.  Records
+#    are now collected in chunks by _read_blocks() and scattered into the output arrays
+#    with precomputed antenna/baseline lookup tables, instead of calling antlist.index()
+#    and indexing element by element for every record.  The output dictionary is unchanged.
+#    Each block has its own list of the per-time power variables, for at most 64 times (or
+#    the chunk length of read_idb_iter(), if shorter), so they are freed once the block has
+#    been copied to the output.
+#    Also added a workers keyword to read_idb() to decode files concurrently in worker
+#    processes, at most workers + 1 files ahead of the one being copied to the output.
+#    Files that cannot be read are now reported with the reason, rather than being
+#    silently swallowed by a bare except.
+#    read_idb() now sizes its output from the record count in the Miriad header of each
+#    file, allocates the output arrays once, and copies each file's block into its
+#    slice, rather than keeping every file's output and concatenating them (which needed
+#    twice the memory).  The quack interval is now also applied to 'p', and 'meanp' is
+#    kept for all files rather than only the last one.
+#    readXdata() can now use the optional on-disk cache of decoded files in idb_cache.py,
+#    enabled by setting the EOVSA_IDB_CACHE environment variable to a directory.
+#    Added ants, bls, pols and fidx keywords to readXdata() and read_idb(), to read only a
+#    subset of antennas, baselines, polarizations and frequencies.  Only the subset is
+#    allocated, and unneeded records are skipped with uv.select().  With tp_only, only the
+#    XX auto-correlation records are now read, since only their per-time variables are used.
+#    Auto-correlations are now placed (and selected) by the position of their antenna in
+#    antlist, as the cross-correlations are, rather than by the Miriad antenna number.
+#    Added read_idb_iter(), a generator version of read_idb() that yields the data in
+#    chunks of chunk_seconds, so that long time ranges can be processed in bounded memory.
+#    The decoding in readXdata() was moved to the _xdata_chunks() generator for this.
+#    autocorr_desat() now evaluates the eta functions from precomputed tables and applies
+#    the correction to all baselines in one array operation (see desat.py), instead of
+#    looping over baselines and antennas.
+#    get_trange_files() now finds files with the persistent directory index in file_index.py,
+#    instead of globbing the directory and converting every file name with astropy.
+#    read_npz() now unpickles each file once rather than once per key, and also reads the
+#    pickle-free, memory-mappable format of idb_store.py, which has a converter for NPZ files.
+#    unrot() is now vectorized over times, frequencies and baselines, and writes into a single
+#    copy of 'x' (or into data['x'] itself with inplace=True) instead of deep-copying the whole
+#    dictionary.  The input data are no longer modified by the X-Y phase correction.  The
+#    nearest valid parallactic angle of each antenna is now looked up with its own good times
+#    (gd[i], as in pipeline_cal.unrot()), and the X-Y phase calibration record is cached in
+#    memory by its validity time, so it is read from the database only once.
+#    Time averaging (navg) is now done by the streaming accumulator in time_avg.py, which
+#    keeps sums and counts per average instead of reshaping the arrays and calling nanmean,
+#    so it needs much less temporary memory, and no longer overwrites the flagged data of
+#    its input with NaNs.  Added keep_partial to read_idb(), to average the times left over
+#    at the end of a file with those at the start of the next, instead of dropping them.
+#    readXdata() now gets the LST of all times of a chunk with one eovsa_lst_array() call,
+#    instead of building an antenna array for every time with eovsa_lst().
+#    Added the precision keyword to readXdata(), read_idb() and read_idb_iter().  'compact'
+#    allocates float32 power and int32 m arrays instead of float64 and int64, and 'compact16'
+#    also keeps only the auto-correlation amplitudes, as float16.
+#    Added the prefetch keyword to read_idb() and read_idb_iter(), which reads the next
+#    files ahead in a background thread (prefetch.py), so that disk reads overlap with
+#    decoding.
+#    Added the backend keyword to readXdata(), read_idb() and read_idb_iter().  With
+#    backend='native', the Miriad files are parsed in bulk by miriad_native.py instead
+#    of record by record through aipy.
+#    Added the profile keyword to readXdata() and read_idb(), which collects the wall time,
+#    records decoded and bytes read of each stage of the read (read_profile.py).
 #
 
 import aipy
 import os
-from .util import Time, nearest_val_idx, bl2ord, ant_str2list, common_val_idx, lobe, get_idbdir, freq2bdname, extract
+from .util import Time, bl2ord, ant_str2list, common_val_idx, lobe, get_idbdir, freq2bdname, extract
 import glob
 import numpy as np
 import matplotlib.pyplot as plt
@@ -148,6 +207,14 @@ from matplotlib.dates import DateFormatter
 #import spectrogram_fit as sp
 #import pcapture2 as p
 from . import eovsa_lst as el
+from . import idb_cache
+from . import desat
+from . import file_index
+from . import idb_store
+from . import time_avg
+from . import prefetch as prefetch_mod
+from . import miriad_native
+from . import read_profile
 import copy
 #import chan_util_bc as cu
 #import chan_util_52 as cu52
@@ -244,7 +311,468 @@ import copy
     # out = {'a':outa, 'x':outx, 'uvw':uvwarray, 'fghz':freq, 'time':np.array(timearray),'source':src,'ha':ha,'ra':uv['ra'],'dec':uv['dec']}#,'p':outp,'p2':outp2,'m':outm
     # return out
     
-def readXdata(filename, filter=False, tp_only=False, src=None, desat=False, nmax=600):
+def _antlist_lookup(antlist):
+    ''' Returns an array that translates a 1-based antenna number to its
+        position in antlist, i.e. lookup[ant] == antlist.index(ant).
+    '''
+    lookup = np.full(max(antlist)+1, -1, dtype=int)
+    # Reversed so that the first occurrence wins, like list.index()
+    for idx in range(len(antlist)-1, -1, -1):
+        lookup[antlist[idx]] = idx
+    return lookup
+
+def _read_blocks(uv, nf_orig, chunk=8192, snapvars=('xsampler','ysampler'), maxtimes=64):
+    ''' Generator that reads the visibility stream of an open aipy UV object
+        in blocks of up to chunk records.  The per-record work is limited to
+        copying the preamble, polarization, data and flags into preallocated
+        arrays, so that all index arithmetic can be done on the whole block.
+
+        The per-time variables in snapvars are copied whenever the record time
+        changes.  Each yielded block is a dictionary of arrays with keys
+        t, i0, j0, pol, uvw, data, flags (True means good) and sid, the index
+        into the block's own snapshot list snap that holds the per-time variables
+        in effect for that record.  A block holds the records of at most maxtimes
+        times, so that only the snapshots of one block are kept at a time.
+    '''
+    tb = np.zeros(chunk, dtype=np.float64)
+    i0b = np.zeros(chunk, dtype=np.int32)
+    j0b = np.zeros(chunk, dtype=np.int32)
+    polb = np.zeros(chunk, dtype=np.int32)
+    uvwb = np.zeros((chunk,3), dtype=np.float64)
+    datab = np.zeros((chunk,nf_orig), dtype=np.complex64)
+    flagb = np.zeros((chunk,nf_orig), dtype=bool)
+    sidb = np.zeros(chunk, dtype=np.int32)
+    snap = []
+    tlast = None
+    n = 0
+    while True:
+        preamble, data, flags, nread = uv.raw_read(uv.nchan)
+        if nread == 0:
+            break
+        uvw, t, (i0,j0) = preamble
+        if t != tlast:
+            if len(snap) == maxtimes and n > 0:
+                # The block is full of times
+                yield {'t':tb[:n], 'i0':i0b[:n], 'j0':j0b[:n], 'pol':polb[:n], 'uvw':uvwb[:n],
+                       'data':datab[:n], 'flags':flagb[:n], 'sid':sidb[:n]}, snap
+                n = 0
+                snap = []
+            # Time changed, so take a copy of the per-time variables
+            snap.append([uv[name] for name in snapvars])
+            tlast = t
+        tb[n] = t
+        i0b[n] = i0
+        j0b[n] = j0
+        polb[n] = uv['pol']
+        uvwb[n] = uvw
+        datab[n] = data
+        flagb[n] = flags
+        sidb[n] = len(snap) - 1
+        n += 1
+        if n == chunk:
+            yield {'t':tb, 'i0':i0b, 'j0':j0b, 'pol':polb, 'uvw':uvwb, 'data':datab,
+                   'flags':flagb, 'sid':sidb}, snap
+            n = 0
+            # The next block starts with the variables still in effect
+            snap = snap[-1:]
+    if n > 0:
+        yield {'t':tb[:n], 'i0':i0b[:n], 'j0':j0b[:n], 'pol':polb[:n], 'uvw':uvwb[:n],
+               'data':datab[:n], 'flags':flagb[:n], 'sid':sidb[:n]}, snap
+
+def _backend(backend=None):
+    ''' Returns the name of the Miriad reader to use: backend if given, otherwise
+        the EOVSA_MIRIAD_BACKEND environment variable, otherwise 'aipy'.
+    '''
+    if backend is None:
+        backend = os.environ.get('EOVSA_MIRIAD_BACKEND', 'aipy')
+    if backend not in ('aipy', 'native'):
+        raise ValueError("backend must be 'aipy' or 'native', not "+repr(backend))
+    return backend
+
+def _select_records(mf, selects):
+    ''' Returns the numbers of the records of the miriad_native.MiriadFile mf
+        that pass the given uv.select() arguments (all with include=True), or
+        None if there are no selections.  As in the Miriad library, selections of
+        the same kind are combined with "or", and different kinds with "and".
+    '''
+    if len(selects) == 0:
+        return None
+    uvw, t, i0, j0 = mf.preamble()
+    pol = mf.values('pol')
+    keep = np.ones(mf.nrec, dtype=bool)
+    for kind in ('auto', 'antennae', 'polarization'):
+        args = [(a, b) for name, a, b in selects if name == kind]
+        if len(args) == 0:
+            continue
+        if kind == 'auto':
+            keep &= i0 == j0
+        elif kind == 'antennae':
+            pairs = np.array([(min(a,b), max(a,b)) for a, b in args])
+            ij = np.stack([np.minimum(i0,j0), np.maximum(i0,j0)], 1)
+            keep &= (ij[:,None,:] == pairs[None]).all(2).any(1)
+        else:
+            keep &= np.isin(pol, [a for a, b in args])
+    return np.flatnonzero(keep)
+
+def _native_blocks(mf, nf_orig, chunk=8192, snapvars=('xsampler','ysampler'), records=None, maxtimes=64):
+    ''' Version of _read_blocks() for a miriad_native.MiriadFile, which yields
+        the same blocks and snapshot lists.  Only the records with the given
+        numbers (default all) are read.
+    '''
+    if records is None:
+        records = np.arange(mf.nrec)
+    if len(records) == 0:
+        return
+    uvw, t, i0, j0 = mf.preamble()
+    pol = mf.values('pol')
+    # Time index of each record, counting the changes of time
+    tr = t[records]
+    change = np.concatenate(([True], tr[1:] != tr[:-1]))
+    sid = np.cumsum(change) - 1
+    updates = [(mf.updates(name)[1], mf.update_index(name)) for name in snapvars]
+    n = 0
+    while n < len(records):
+        end = min(n + chunk, np.searchsorted(sid, sid[n] + maxtimes))
+        recs = records[n:end]
+        bsid = sid[n:end] - sid[n]
+        # The first record of each time, for the per-time variables in effect
+        first = recs[np.searchsorted(bsid, np.arange(bsid[-1] + 1))]
+        snap = [[mf._value(name, values[index[r]]) for name, (values, index) in zip(snapvars, updates)]
+                for r in first]
+        yield {'t':t[recs], 'i0':i0[recs].astype(np.int32), 'j0':j0[recs].astype(np.int32),
+               'pol':pol[recs].astype(np.int32), 'uvw':uvw[recs], 'data':mf.data(recs),
+               'flags':mf.flags(recs), 'sid':bsid.astype(np.int32)}, snap
+        n = end
+
+def _time_slots(t, tprev, l):
+    ''' Assigns each record of a block to an output time slot, reproducing the
+        record-by-record rules of readXdata(): a zero-filled record (time
+        1970-01-01) or a record whose time jumps back from the latest accepted
+        time is skipped, and any later time starts a new slot.
+
+        Inputs:
+          t      Array of record times (JD) for this block
+          tprev  Latest accepted time from the previous block (0 if none)
+          l      Latest slot index from the previous block (-1 if none)
+
+        Returns (slot, new, tprev, l), where slot is the time index of each
+        record (-1 for skipped records), new is True for the records that
+        start a new slot, and tprev, l are the updated state for the next block.
+    '''
+    tv = np.where(t == 2440587.5, -np.inf, t)
+    prevmax = np.maximum.accumulate(np.concatenate(([tprev], tv)))
+    tmax = prevmax[-1]
+    prevmax = prevmax[:-1]
+    new = tv > prevmax
+    slot = l + np.cumsum(new)
+    slot[tv < prevmax] = -1
+    slot[slot < 0] = -1
+    accepted = slot[slot >= 0]
+    if len(accepted) > 0:
+        l = accepted[-1]
+    return slot, new, tmax, l
+
+def _selection(nants, npol, ants=None, bls=None, pols=None):
+    ''' Converts the ants, bls and pols selections of readXdata() into sorted
+        arrays of antenna indexes, baseline indexes (as in bl2ord) and
+        polarization indexes (0-3 for XX, YY, XY, YX).  Unspecified selections
+        mean everything, except that the default baselines are those between
+        the selected antennas.
+    '''
+    if ants is None:
+        ants = np.arange(nants)
+    elif type(ants) is str:
+        ants = ant_str2list(ants)
+    ants = np.unique(np.asarray(ants, dtype=int))
+    if bls is None:
+        bls = np.array([bl2ord[i,j] for i in ants for j in ants if i < j], dtype=int)
+    bls = np.unique(np.asarray(bls, dtype=int))
+    if pols is None:
+        pols = np.arange(npol)
+    pols = np.unique(np.asarray(pols, dtype=int))
+    return ants, bls, pols
+
+def _index_map(sel, n):
+    ''' Returns an array of length n that maps an index to its position in
+        the selection sel, or to -1 if it is not selected.
+    '''
+    imap = np.full(n, -1, dtype=int)
+    imap[sel] = np.arange(len(sel))
+    return imap
+
+# Output array types for each precision keyword value of readXdata().  The power
+# variables are single precision in the file, and m (a count of accumulations) fits
+# easily in int32, so 'compact' loses nothing when reading.
+_PRECISION = {
+    'full':      {'a':np.complex64, 'x':np.complex64, 'p':np.float64, 'm':np.int64},
+    'compact':   {'a':np.complex64, 'x':np.complex64, 'p':np.float32, 'm':np.int32},
+    'compact16': {'a':np.float16,   'x':np.complex64, 'p':np.float32, 'm':np.int32},
+}
+
+def _dtypes(precision):
+    ''' Returns the output array types for the given precision keyword value.
+    '''
+    try:
+        return _PRECISION[precision]
+    except KeyError:
+        raise ValueError('precision must be one of '+', '.join(_PRECISION)+', not '+repr(precision)) from None
+
+def _cache_params(filter, tp_only, nmax, ants=None, bls=None, pols=None, fidx=None, precision='full'):
+    ''' Returns the readXdata() keywords that identify its cached output.  Selections
+        (and precision) are only included when given, so that full reads keep their
+        cache entries.
+    '''
+    cparams = {'filter':filter, 'tp_only':tp_only, 'nmax':nmax}
+    for key, sel in [('ants',ants), ('bls',bls), ('pols',pols), ('fidx',fidx)]:
+        if sel is not None:
+            cparams[key] = sel if type(sel) is str else [int(i) for i in np.ravel(sel)]
+    if precision != 'full':
+        cparams['precision'] = precision
+    return cparams
+
+def _xdata_chunks(filename, filter=False, tp_only=False, nchunk=600, nmax=None,
+                  ants=None, bls=None, pols=None, fidx=None, precision='full', backend=None):
+    ''' Generator that does the work of readXdata() for a single IDB file.  The
+        first item yielded is the source name in the file (None if there is no
+        source variable), so that the caller can stop before any data are read.
+        After that, the data are yielded as readXdata() output dictionaries of
+        consecutive chunks of up to nchunk times, until the file ends or nmax
+        times (None for no limit) have been read.  Only one chunk of output
+        arrays is held at a time.  The 'source' key of each chunk is the source
+        name in the file.  See readXdata() for the other keywords.
+    '''
+    dtypes = _dtypes(precision)
+    native = _backend(backend) == 'native'
+    # Open uv file for reading
+    if native:
+        uv = miriad_native.MiriadFile(filename)
+    else:
+        uv = aipy.miriad.UV(filename)
+    if read_profile.active():
+        read_profile.count('decode', nbytes=read_profile.dataset_bytes(filename))
+    nf_orig = len(uv['sfreq'])
+    good_idx = np.arange(nf_orig)
+    if filter:
+        good_idx = []
+        # Read a bunch of records to get number of good frequencies, i.e. those with at least 
+        # some non-zero data.  Read 20 records for baseline 1-2, XX pol
+        if native:
+            recs = _select_records(uv, [('antennae',0,2), ('polarization',-5,-5)])
+            if len(recs) < 20:
+                # As the Miriad library does
+                raise IOError('No data read')
+            nonzero = (uv.data(recs[:20]) != 0) & uv.flags(recs[:20])
+        else:
+            uv.select('antennae',0,2,include=True)
+            uv.select('polarization',-5,-5,include=True)
+            nonzero = []
+            for i in range(20):
+                preamble, data = uv.read()
+                nonzero.append(np.ma.filled(data != 0, False))
+            uv.select('clear',0,0)
+            uv.rewind()
+        for row in nonzero:
+            idx, = row.nonzero()
+            if len(idx) > len(good_idx):
+                good_idx = copy.copy(idx)
+
+    source = None
+    if 'source' in uv.vartable:
+        source = uv['source']
+        while source[-1] == '\x00': source = source[:-1]
+    yield source
+
+    # Number of non-zero frequencies that a record must have when filtering
+    nfgood = len(good_idx)
+    fsel = slice(None) if fidx is None else np.asarray(fidx, dtype=int)
+    good_idx = np.asarray(good_idx)[fsel]
+    nf = len(good_idx)
+    freq = uv['sfreq'][good_idx]
+    npol = uv['npol']
+    nants = uv['nants']
+    select = not (ants is None and bls is None and pols is None and fidx is None)
+    ants, bls, pols = _selection(nants, npol, ants, bls, pols)
+    blmap = _index_map(bls, bl2ord.max()+1)
+    pmap = _index_map(pols, 4)
+    # Use antennalist if available
+    if 'antlist' in uv.vartable:
+        antstr = uv['antlist']
+        while antstr[-1] == '\x00': antstr = antstr[:-1]
+        antlist = list(map(int, antstr.split()))
+    else:
+        antlist = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]
+    ant2idx = _antlist_lookup(antlist)
+    # Output index of the auto-correlation of each (0-based) Miriad antenna number,
+    # which like the baselines goes through its position in antlist
+    pos = ant2idx[1:]
+    amap = np.where(pos >= 0, _index_map(ants, max(nants, len(antlist)))[pos], -1)
+    # Have the Miriad library skip the records that are not needed.  The same
+    # selection is applied again to the records that are read, below.
+    selects = []
+    if tp_only:
+        # Only the per-time variables are needed, which come with any record
+        selects += [('auto',0,0), ('polarization',-5,-5)]
+    else:
+        if len(ants) < nants or len(bls) < nants*(nants-1)//2:
+            for a in ants:
+                selects.append(('antennae',antlist[a]-1,antlist[a]-1))
+            for b in bls:
+                i, j = np.argwhere(bl2ord == b)[0]
+                selects.append(('antennae',antlist[i]-1,antlist[j]-1))
+        if len(pols) < npol:
+            for k in pols:
+                selects.append(('polarization',-5-k,-5-k))
+            if len(bls) > 0 and 3 not in pols:
+                # The uvw coordinates are taken from the YX records
+                selects.append(('polarization',-8,-8))
+    snapvars = ['xsampler','ysampler']
+    if filter and 'lst' in uv.vartable:
+        snapvars.append('lst')
+    if native:
+        blocks = _native_blocks(uv, nf_orig, snapvars=snapvars, records=_select_records(uv, selects),
+                                maxtimes=min(nchunk, 64))
+    else:
+        for args in selects:
+            uv.select(*args, include=True)
+        blocks = _read_blocks(uv, nf_orig, snapvars=snapvars, maxtimes=min(nchunk, 64))
+    ra = uv['ra']
+    dec = uv['dec']
+
+    def new_chunk():
+        ''' Allocates the output arrays for one chunk of times.
+        '''
+        chunk = {'timearray':[], 'lstarray':[]}
+        if not tp_only:
+            chunk['a'] = np.zeros((len(ants),len(pols),nf,nchunk),dtype=dtypes['a'])  # Auto-correlations
+            chunk['x'] = np.zeros((len(bls),len(pols),nf,nchunk),dtype=dtypes['x'])  # Cross-correlations
+        else:
+            chunk['a'] = None
+            chunk['x'] = None
+        chunk['p'] = np.zeros((len(ants),2,nf,nchunk),dtype=dtypes['p'])
+        chunk['p2'] = np.zeros((len(ants),2,nf,nchunk),dtype=dtypes['p'])
+        chunk['m'] = np.zeros((len(ants),2,nf,nchunk),dtype=dtypes['m'])
+        chunk['uvw'] = np.zeros((len(bls),nchunk,3),dtype=np.float64)
+        return chunk
+
+    def finish_chunk(chunk):
+        ''' Truncates the arrays of a chunk to the times actually read, and
+            returns the output dictionary.
+        '''
+        timearray = chunk['timearray']
+        lstarray = chunk['lstarray']
+        nt = len(timearray)
+        outp = chunk['p'][:,:,:,:nt]
+        outp2 = chunk['p2'][:,:,:,:nt]
+        outm = chunk['m'][:,:,:,:nt]
+        uvwarray = chunk['uvw'][:,:nt]
+        outa = chunk['a']
+        outx = chunk['x']
+        if not tp_only:
+            outa = outa[:,:,:,:nt]
+            outx = outx[:,:,:,:nt]
+
+        if len(lstarray) == 0:
+            with read_profile.stage('lst'):
+                lstarray = el.eovsa_lst_array(timearray)
+        ha = np.array(lstarray) - ra
+        ha[np.where(ha > np.pi)] -= 2*np.pi
+        ha[np.where(ha < -np.pi)] += 2*np.pi
+        # Find out band name for each frequency
+        bd = freq2bdname(freq, Time(timearray[0],format='jd'))
+        out = {'a':outa, 'x':outx, 'uvw':uvwarray, 'fghz':freq, 'band':bd,'time':np.array(timearray),'source':source,'p':outp,'p2':outp2,'m':outm,'ha':ha,'ra':ra,'dec':dec}
+        if select:
+            out.update({'ants':ants, 'bls':bls, 'pols':pols, 'fidx':np.arange(nfgood)[fsel]})
+        return out
+
+    chunk = new_chunk()
+    c0 = 0        # Time index of the first time in the current chunk
+    nyield = 0
+    tprev = 0
+    l = -1
+    print_warning = True    # Print a warning about imaginary total power data, if found.
+    for blk, snap in blocks:
+        read_profile.count('decode', records=len(blk['t']))
+        if filter:
+            # Keep only records where all of the good frequencies are non-zero, and
+            # compress each record to its non-zero channels
+            nzmask = (blk['data'] != 0) & blk['flags']
+            keep = nzmask.sum(1) == nfgood
+            blk = {key: val[keep] for key, val in blk.items()}
+            data = blk['data'][nzmask[keep]].reshape(-1, nfgood)[:,fsel]
+        else:
+            data = blk['data'][:,fsel]
+            data = np.where(blk['flags'][:,fsel], data, np.complex64(np.nan+np.nan*1j))
+        slot, new, tprev, l = _time_slots(blk['t'], tprev, l)
+        # Records beyond nmax times are dropped, and reading stops
+        done = nmax is not None and np.any(slot >= nmax)
+        if done:
+            slot[slot >= nmax] = -1
+        new &= slot >= 0
+        if not tp_only:
+            i0 = blk['i0']
+            j0 = blk['j0']
+            # Assumes uv['pol'] is one of -5, -6, -7, -8
+            k = -5 - blk['pol']
+            kk = pmap[k]
+            auto = (i0 == j0) & (amap[i0] >= 0)
+            cross = i0 != j0
+            bl = np.full(len(k), -1)
+            bl[cross] = blmap[bl2ord[ant2idx[i0[cross]+1], ant2idx[j0[cross]+1]]]
+            cross &= bl >= 0
+            uvwrec = cross & (k == 3)
+            auto &= kk >= 0
+            cross &= kk >= 0
+        # Accepted slots never decrease, so the block is split into the parts that
+        # fall in successive chunks
+        while True:
+            inchunk = (slot >= c0) & (slot < c0+nchunk)
+            cnew = new & inchunk
+            lnew = slot[cnew] - c0
+            if len(lnew) > 0:
+                sidx = blk['sid'][cnew]
+                chunk['timearray'] += list(blk['t'][cnew])
+                xdata = np.array([snap[s][0] for s in sidx]).reshape(-1,nf_orig,nants,3)[:,good_idx][:,:,ants]
+                ydata = np.array([snap[s][1] for s in sidx]).reshape(-1,nf_orig,nants,3)[:,good_idx][:,:,ants]
+                chunk['p'][:,0][:,:,lnew] = xdata[...,0].transpose(2,1,0)
+                chunk['p'][:,1][:,:,lnew] = ydata[...,0].transpose(2,1,0)
+                chunk['p2'][:,0][:,:,lnew] = xdata[...,1].transpose(2,1,0)
+                chunk['p2'][:,1][:,:,lnew] = ydata[...,1].transpose(2,1,0)
+                chunk['m'][:,0][:,:,lnew] = xdata[...,2].transpose(2,1,0)
+                chunk['m'][:,1][:,:,lnew] = ydata[...,2].transpose(2,1,0)
+                if filter and 'lst' in snapvars:
+                    chunk['lstarray'] += [snap[s][2] for s in sidx]
+            if not tp_only:
+                ca = auto & inchunk
+                cx = cross & inchunk
+                cu = uvwrec & inchunk
+                if np.iscomplexobj(chunk['a']):
+                    chunk['a'][amap[i0[ca]],kk[ca],:,slot[ca]-c0] = data[ca]
+                else:
+                    # Amplitudes only
+                    chunk['a'][amap[i0[ca]],kk[ca],:,slot[ca]-c0] = np.abs(data[ca])
+                if print_warning:
+                    imag = ca & (k < 2) & np.any((data.imag != 0) & ~np.isnan(data.imag), axis=1)
+                    if np.any(imag):
+                        r = np.where(imag)[0][0]
+                        print((blk['uvw'][r], blk['t'][r], (i0[r], j0[r])), blk['pol'][r],
+                              'has imaginary data! Additional warnings suppressed.')
+                        print_warning = False
+                chunk['x'][bl[cx],kk[cx],:,slot[cx]-c0] = data[cx]
+                chunk['uvw'][bl[cu],slot[cu]-c0] = blk['uvw'][cu]
+            if not np.any(slot >= c0+nchunk):
+                break
+            # The current chunk is complete
+            yield finish_chunk(chunk)
+            nyield += 1
+            chunk = new_chunk()
+            c0 += nchunk
+        if done:
+            break
+    if nyield == 0 or len(chunk['timearray']) > 0:
+        yield finish_chunk(chunk)
+
+def readXdata(filename, filter=False, tp_only=False, src=None, desat=False, nmax=600,
+              ants=None, bls=None, pols=None, fidx=None, precision='full', backend=None, profile=None):
     ''' This routine reads the data from a single IDBfile.
         
         Optional Keywords:
@@ -258,34 +786,81 @@ def readXdata(filename, filter=False, tp_only=False, src=None, desat=False, nmax
                     records.  This affects memory usage if it is much larger 
                     than the number of times in the file, but with the new 
                     20-ms files there can be 30000 recs in a 10-min file.
+        ants     antennas to read, as an ant_str (e.g. 'ant1-13') or a list of antenna
+                    indexes (antenna number - 1).  Default is all antennas.
+        bls      cross-correlation baselines to read, as a list of bl2ord indexes.
+                    Default is all baselines between the selected antennas.
+        pols     polarizations to read, as a list of indexes into XX, YY, XY, YX.
+                    Default is all.  Applies to 'a' and 'x' only.
+        fidx     frequency indexes to read, into the frequencies that would be
+                    returned without this keyword.  Default is all.
+        precision  string--types of the output arrays.  'full' (default) gives
+                    complex64 'a' and 'x', float64 'p' and 'p2', and int64 'm'.
+                    'compact' gives float32 'p' and 'p2' and int32 'm' (no loss, since
+                    the sampler data are single precision), for about half the memory
+                    of the power arrays.  'compact16' is 'compact' with 'a' holding only
+                    the auto-correlation amplitudes, as float16 (about 3 significant
+                    digits, and amplitudes above 65504 become inf), for quicklook use.
+                    The arrays are allocated with these types from the start.
+        backend  string--'aipy' to read the records through aipy, or 'native' to
+                    parse the Miriad visibility stream in bulk with numpy (see
+                    miriad_native.py), which gives the same output.  Default is the
+                    EOVSA_MIRIAD_BACKEND environment variable, or 'aipy'.
+        profile  True, a file name or a read_profile.ReadProfile, to collect the time
+                    spent in each stage of the read (see read_profile.py).  If True,
+                    the counters are returned in the 'profile' key; if a file name,
+                    they are appended to it as JSON lines.  Default is None.
+
+        Only the selected subset is allocated and filled, and records that are not
+        needed are skipped by the Miriad library.  If any selection is given, the
+        output 'a', 'p', 'p2' and 'm' hold the selected antennas, 'x' and 'uvw' the
+        selected baselines, and the selections are returned in the keys 'ants',
+        'bls', 'pols' and 'fidx' (all in increasing order).  Correction for
+        saturation (desat) needs all antennas, baselines and polarizations.
+
+        If the EOVSA_IDB_CACHE environment variable names a directory, the decoded
+        file is kept there (see idb_cache.py), and later reads of the same, unchanged
+        file are served from memory-mapped arrays without calling aipy.
     '''
+    with read_profile.profiling(profile) as prof:
+        out = _readXdata(filename, filter, tp_only, src, desat, nmax, ants, bls, pols, fidx, precision, backend)
+    if profile is True and isinstance(out, dict):
+        out['profile'] = prof.as_dict()
+    return out
 
-    # Open uv file for reading
-    uv = aipy.miriad.UV(filename)
-    nf_orig = len(uv['sfreq'])
-    good_idx = np.arange(nf_orig)
-    if filter:
-        good_idx = []
-        # Read a bunch of records to get number of good frequencies, i.e. those with at least 
-        # some non-zero data.  Read 20 records for baseline 1-2, XX pol
-        uv.select('antennae',0,2,include=True)
-        uv.select('polarization',-5,-5,include=True)
-        for i in range(20):
-            preamble, data = uv.read()
-            idx, = data.nonzero()
-            if len(idx) > len(good_idx):
-                good_idx = copy.copy(idx)
-        uv.select('clear',0,0)
-        uv.rewind()
+def _readXdata(filename, filter, tp_only, src, desat, nmax, ants, bls, pols, fidx, precision, backend):
+    ''' Does the work of readXdata().
+    '''
+    if desat and not (ants is None and bls is None and pols is None):
+        raise ValueError('readXdata: desat needs all antennas, baselines and polarizations')
+    _dtypes(precision)   # Check the keywords before anything is read
+    _backend(backend)
+    cache = idb_cache.default_cache()
+    cparams = _cache_params(filter, tp_only, nmax, ants, bls, pols, fidx, precision)
+    if cache is not None:
+        with read_profile.stage('cache'):
+            out = cache.load(filename, 'read_idb.readXdata', cparams, mmap_mode='c')
+        if out is not None:
+            if out['source'] is None:
+                # No source variable in the file
+                out['source'] = src
+            elif src is not None and src != out['source']:
+                return out['source']
+            if desat:
+                out = autocorr_desat(out)
+            return out
 
-    if 'source' in uv.vartable:
-        source = uv['source']
-        while source[-1] == '\x00': source = source[:-1]
+    chunks = _xdata_chunks(filename, filter=filter, tp_only=tp_only, nchunk=nmax, nmax=nmax,
+                           ants=ants, bls=bls, pols=pols, fidx=fidx, precision=precision, backend=backend)
+    with read_profile.stage('decode'):
+        source = next(chunks)
+    if source is not None:
         if src is None:
             # If no source name is given, return the source from the file and keep going
             src = source
         elif src != source:
             # If a specific source name is given, and it does not match the file, stop and return None
+            chunks.close()
             return source
         else:
             # If a source is given, and it matches the file, keep going
@@ -294,142 +869,14 @@ def readXdata(filename, filter=False, tp_only=False, src=None, desat=False, nmax
         if src:
             # If a specific source name is given, and there is no source in the file, stop and return
             pass#return '<no "source" var!>'
-    print_warning = True    # Print a warning about imaginary total power data, if found.
-    nf = len(good_idx)
-    freq = uv['sfreq'][good_idx]
-    npol = uv['npol']
-    nants = uv['nants']
-    nbl = nants*(nants-1)//2
-    if not tp_only:
-        outa = np.zeros((nants,npol,nf,nmax),dtype=np.complex64)  # Auto-correlations
-        outx = np.zeros((nbl,npol,nf,nmax),dtype=np.complex64)  # Cross-correlations
-    outp = np.zeros((nants,2,nf,nmax),dtype=np.float64)
-    outp2 = np.zeros((nants,2,nf,nmax),dtype=np.float64)
-    outm = np.zeros((nants,2,nf,nmax),dtype=np.int64)
-    uvwarray = np.zeros((nbl,nmax,3),dtype=np.float64)
-    timearray = []
-    lstarray = []
-    l = -1
-    tprev = 0
-    tsav = 0
-    # Use antennalist if available
-    if 'antlist' in uv.vartable:
-        ants = uv['antlist']
-        while ants[-1] == '\x00': ants = ants[:-1]
-        antlist = list(map(int, ants.split()))
-    else:
-        antlist = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]
-
-    for preamble, data in uv.all():
-        uvw, t, (i0,j0) = preamble
-        i = antlist.index(i0+1)
-        j = antlist.index(j0+1)
-        if i > j:
-            # Reverse order of indices
-            j = antlist.index(i0+1)
-            i = antlist.index(j0+1)
-        # Assumes uv['pol'] is one of -5, -6, -7, -8
-        k = -5 - uv['pol']
-        if filter:
-            if len(data.nonzero()[0]) == nf:
-                if t != tprev:
-#                    print preamble
-                    if t == 2440587.5:
-                        # Time is 1970-01-01, which means a zero-filled record, so skip
-                        # the entire thing.
-                        continue
-                    if t < tprev:
-                        # Some kind of glitch, so skip the whole thing
-                        continue
-                    # New time 
-                    l += 1
-                    if l == 600:
-                        break
-                    tprev = t
-                    timearray.append(t)
-                    try:
-                        lstarray.append(uv['lst'])
-                    except:
-                        pass
-                    xdata = uv['xsampler'].reshape(nf_orig,nants,3)
-                    ydata = uv['ysampler'].reshape(nf_orig,nants,3)
-                    outp[:,0,:,l] = np.swapaxes(xdata[good_idx,:,0],0,1)
-                    outp[:,1,:,l] = np.swapaxes(ydata[good_idx,:,0],0,1)
-                    outp2[:,0,:,l] = np.swapaxes(xdata[good_idx,:,1],0,1)
-                    outp2[:,1,:,l] = np.swapaxes(ydata[good_idx,:,1],0,1)
-                    outm[:,0,:,l] = np.swapaxes(xdata[good_idx,:,2],0,1)
-                    outm[:,1,:,l] = np.swapaxes(ydata[good_idx,:,2],0,1)
-    
-                if tp_only:
-                    outa = None
-                    outx = None
-                else:
-                    if i0 == j0:
-                        # This is an auto-correlation
-                        outa[i0,k,:,l] = data[data.nonzero()]
-                    else:
-                        outx[bl2ord[i,j],k,:,l] = data[data.nonzero()]
-                        if k == 3: uvwarray[bl2ord[i,j],l] = uvw[data.nonzero()]
-        else:
-            if t != tprev:
-                # New time 
-                if t == 2440587.5:
-                    # Time is 1970-01-01, which means a zero-filled record, so skip
-                    # the entire thing.
-                    continue
-                if t < tprev:
-                    # Some kind of glitch, so skip the whole thing
-                    continue
-                l += 1
-                if l == nmax:
-                    break
-                tprev = t
-                timearray.append(t)
-                xdata = uv['xsampler'].reshape(nf_orig,nants,3)
-                ydata = uv['ysampler'].reshape(nf_orig,nants,3)
-                outp[:,0,:,l] = np.swapaxes(xdata[:,:,0],0,1)
-                outp[:,1,:,l] = np.swapaxes(ydata[:,:,0],0,1)
-                outp2[:,0,:,l] = np.swapaxes(xdata[:,:,1],0,1)
-                outp2[:,1,:,l] = np.swapaxes(ydata[:,:,1],0,1)
-                outm[:,0,:,l] = np.swapaxes(xdata[:,:,2],0,1)
-                outm[:,1,:,l] = np.swapaxes(ydata[:,:,2],0,1)
-
-            if tp_only:
-                outa = None
-                outx = None
-            else:
-                if i0 == j0:
-                    # This is an auto-correlation
-                    outa[i0,k,:,l] = data.filled(fill_value=np.nan+np.nan*1j)
-                    if print_warning and k < 2 and np.sum(data != np.real(data)) > 0:
-                        print(preamble,uv['pol'], 'has imaginary data! Additional warnings suppressed.')
-                        print_warning = False
-                else:
-                    outx[bl2ord[i,j],k,:,l] = data.filled(fill_value=np.nan+np.nan*1j)
-                    if k == 3: uvwarray[bl2ord[i,j],l] = uvw
-
-    # Truncate in case of early end of data
-    nt = len(timearray)
-    outp = outp[:,:,:,:nt]
-    outp2 = outp2[:,:,:,:nt]
-    outm = outm[:,:,:,:nt]
-    uvwarray = uvwarray[:,:nt]
-    if not tp_only:
-        outa = outa[:,:,:,:nt]
-        outx = outx[:,:,:,:nt]
-
-    if len(lstarray) != 0:
-        pass
-    else:
-        tarray = Time(timearray,format='jd')
-        for t in tarray:
-            lstarray.append(el.eovsa_lst(t))
-    ha = np.array(lstarray) - uv['ra']
-    ha[np.where(ha > np.pi)] -= 2*np.pi
-    ha[np.where(ha < -np.pi)] += 2*np.pi
-    # Find out band name for each frequency
-    bd = freq2bdname(freq, Time(timearray[0],format='jd'))
-    out = {'a':outa, 'x':outx, 'uvw':uvwarray, 'fghz':freq, 'band':bd,'time':np.array(timearray),'source':src,'p':outp,'p2':outp2,'m':outm,'ha':ha,'ra':uv['ra'],'dec':uv['dec']}
+    with read_profile.stage('decode'):
+        out = next(chunks)
+    chunks.close()
+    if cache is not None:
+        # Cache the file's own source name, so the entry does not depend on src
+        with read_profile.stage('cache'):
+            cache.store(filename, 'read_idb.readXdata', cparams, out)
+    out['source'] = src
     if desat:
         out = autocorr_desat(out)
     return out
@@ -444,95 +891,39 @@ def autocorr_desat(out):
         
         Applies the function to autocorrelations A_i and cross-correlations xi_ij to obtain
         A'_i = A**eta_i and xi'_ij = xi_ij**[(eta_i + eta_j)/2].
-    '''
-    from scipy.special import erf    
-    def eta_f(x, A):
-        ''' This is the desaturation fuction for data taken with equalizer coefficient 8.0,
-            which is data prior to 5/16/2021.
-        '''
-        a,b,c,d = [1.22552, 1.37369, 2.94536, 2.14838]  # Parameters define the invariant saturation curve
-        eta = (x + d - c)/(a*erf((x-c)/b) + d)
-        bad = np.where(A < 50)
-        eta[bad] = 1.0
-        return eta
-        
-    def eta_2(x, A):
-        ''' This is the desaturation fuction for data taken with equalizer coefficient 2.0,
-            which is data after to 5/16/2021.
-        '''
-        a1,b1,c1,d1 = [0.88025122, 1.0221639 , 4.39845723, 2.38911615]
-        a2,b2,c2,d2 = [2.28517281, 2.64619331, 4.38657476, 2.37753165]
-        hi = np.where(A > 300)
-        low = np.where(A <= 300)
-        eta = np.ones_like(x)
-        eta[hi] = (x[hi] + d1 - c1)/(a1*erf((x[hi]-c1)/b1) + d1)
-        eta[low] = (x[low] + d2 - c2)/(a2*erf((x[low]-c2)/b2) + d2)
-        return eta
-        
-    nant = 16
-    # Determine required "m" value for standardized power level.  The power changes
-    # depending on number of channels averaged, etc., and the SK m value keeps track
-    # of all of that.
-    mjd = Time(out['time'][0],format='jd').mjd
-    if mjd > 58536:
-        m0 = 745472.  # Standard for most recent data (325 MHz bandwidth)
-    else:
-        m0 = 721536.  # Standard for earlier data (ca. 2017)
-    nf, = out['fghz'].shape
-    nt, = out['time'].shape
-    npol = 4
-    # Copy power for each polarization so modification below does not affect
-    # actual data
-    Px = out['p'][:,0]*m0/out['m'][:,0]
-    Py = out['p'][:,1]*m0/out['m'][:,0]
-#    n0 = len(np.where(out['band'] == np.max(out['band']))[0])
-#    # Modify measured power to correct for variable science-channel bandwidth
-#    for i in range(nf):
-#        bnd = out['band'][i]
-#        n = np.float64(len(np.where(out['band'] == bnd)[0]))
-#        Px[:,i] *= n/n0
-#        Py[:,i] *= n/n0
-    x = np.log10(Px)
-    # Calculate correction for X pol (returns size [nant, nf, nt])
-    if mjd < 59350:  # 2021-05-16
-        eta_x = eta_f(x, abs(out['a'][:,0]))
-    else:
-        eta_x = eta_2(x, abs(out['a'][:,0]))
 
-    x = np.log10(Py)
-    # Calculate correction for Y pol (returns size [nant, nf, nt])
-    if mjd < 59350:  # 2021-05-16
-        eta_y = eta_f(x, abs(out['a'][:,1]))
-    else:
-        eta_y = eta_2(x, abs(out['a'][:,1]))
-    eta = np.zeros_like(out['x'])
-    # Loop over baselines for cross-correlation and calculate correction for 
-    # different polarization states.
-    for i in range(nant-1):
-        for j in range(i+1,nant):
-            eta[bl2ord[i,j],0] = eta_x[i]+eta_x[j]
-            eta[bl2ord[i,j],1] = eta_y[i]+eta_y[j]
-            eta[bl2ord[i,j],2] = eta_x[i]+eta_y[j]
-            eta[bl2ord[i,j],3] = eta_x[j]+eta_y[i]
-    eta = eta/2.
-    # Correction is to log of values, so apply by raising amplitudes to eta power,
-    # but preserve the phase
-    amp = abs(out['x'])
-    pha = np.angle(out['x'])
-    amp = amp**eta
-    out['x'] = amp*np.exp(1j*pha)
-    # Repeat for auto-correlation by looping over antennas
-    # This "re-uses" eta to overwrite first nant values
-    for i in range(nant):
-        eta[i,0] = eta_x[i]
-        eta[i,1] = eta_y[i]
-        eta[i,2] = (eta_x[i] + eta_y[i])/2.
-        eta[i,3] = (eta_x[i] + eta_y[i])/2.
-    amp = abs(out['a'])
-    pha = np.angle(out['a'])
-    amp = amp**eta[:nant]
-    out['a'] = amp*np.exp(1j*pha)
-    return out
+        Since 2021-05-16, the correlator equalizer coefficient changed from 8.0 to 2.0,
+        necessitating a different fit function.  The eta functions are evaluated from
+        precomputed tables, and the correction is applied to all baselines at once
+        (see desat.py).
+    '''
+    with read_profile.stage('desat'):
+        if out['a'] is None:
+            # Total power only, so there is nothing to correct
+            return out
+        nant = 16
+        # Determine required "m" value for standardized power level.  The power changes
+        # depending on number of channels averaged, etc., and the SK m value keeps track
+        # of all of that.
+        mjd = Time(out['time'][0],format='jd').mjd
+        if mjd > 58536:
+            m0 = 745472.  # Standard for most recent data (325 MHz bandwidth)
+        else:
+            m0 = 721536.  # Standard for earlier data (ca. 2017)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.log10(out['p'][:,0]*m0/out['m'][:,0])
+            y = np.log10(out['p'][:,1]*m0/out['m'][:,0])
+        # Correction for each pol (size [nant, nf, nt])
+        eta_x = desat.antenna_eta(x, abs(out['a'][:,0]), mjd).astype(np.float32)
+        eta_y = desat.antenna_eta(y, abs(out['a'][:,1]), mjd).astype(np.float32)
+        # Correction for each baseline and polarization state (size [nbl, 4, nf, nt])
+        nbl = out['x'].shape[0]
+        ant1, ant2 = desat.baseline_pairs(bl2ord, nbl)
+        out['x'] = desat.apply_eta(out['x'], desat.pair_eta(eta_x, eta_y, ant1, ant2, 0))
+        # Auto-correlations are the pairs (i, i)
+        ant = np.arange(nant)
+        out['a'] = desat.apply_eta(out['a'], desat.pair_eta(eta_x, eta_y, ant, ant, 0))
+        return out
 
 def readXdatmp(filename):
     # This temporary routine reads the data from a single IDBfile where the
@@ -703,7 +1094,303 @@ def summary_plot_pcal(out,ant_str='ant1-16',ptype='phase',pol='XX-YY'):
             ax[0,j].text(0.5,1.3,polstr[j],ha='center',va='center',transform=ax[0,j].transAxes,fontsize=14)
             
         
-def read_idb(trange,navg=None, nmax=600, quackint=0.,filter=True,srcchk=True,src=None,tp_only=False, desat=False):
+def _read_one(file, navg=None, nmax=600, tp_only=False, src=None, desat=False, **sel):
+    ''' Reads a single file with readXdata() and, if navg is set, averages it in
+        time.  This is the unit of work for read_idb(), and is kept at module
+        level so that it can be sent to a worker process.  Returns the output
+        dictionary, or the file's source name (a string) if it does not match src.
+        Any selection keywords (ants, bls, pols, fidx) are passed to readXdata().
+    '''
+    out = readXdata(file,tp_only=tp_only,src=src, desat=desat, nmax=nmax, **sel)
+    if type(out) is str or not navg:
+        return out
+    return _time_average(out, navg, tp_only)
+
+def _read_one_profiled(file, **kwargs):
+    ''' Calls _read_one(file, **kwargs) in a worker process, and returns its
+        output together with the stage counters of the read.
+    '''
+    with read_profile.ReadProfile() as prof:
+        out = _read_one(file, **kwargs)
+    return out, prof.as_dict()['stages']
+
+def _time_average(out, navg, tp_only=False):
+    ''' Averages the output dictionary of readXdata() (or one chunk of it) over
+        groups of navg times, dropping any times left over at the end, and adds
+        the 'meanp' key.  Returns the averaged dictionary; out is not modified.
+        See time_avg.py for how the averages are formed.
+    '''
+    with read_profile.stage('average'):
+        return time_avg.TimeAverager(navg, keep_partial=False).add(out)
+
+def _drop_times(out, n):
+    ''' Removes the first n times from the time-dependent keys of an output
+        dictionary.
+    '''
+    for key, axis in _TIME_AXIS.items():
+        if out.get(key) is not None:
+            out[key] = out[key][(slice(None),)*axis+(slice(n,None),)]
+
+def read_idb_iter(trange, chunk_seconds=60., navg=None, nmax=None, quackint=0., filter=True, srcchk=True,
+                  src=None, tp_only=False, desat=False, ants=None, bls=None, pols=None, fidx=None,
+                  precision='full', prefetch=None, backend=None):
+    ''' Generator version of read_idb(), for time ranges that are too long to
+        hold in memory.  The files are read in time order, and dictionaries of
+        the same form as the read_idb() output are yielded for consecutive chunks
+        of about chunk_seconds of data (before averaging).  Only one chunk is
+        decoded and held at a time, so memory use depends on chunk_seconds and
+        not on the length of trange.
+
+        Chunks never split a group of navg times, and times left over at the end
+        of a file are dropped, so the concatenated chunks are the same as the
+        output of read_idb() with the same keywords.  The exceptions are that
+        nmax defaults to None (read all times in each file), and that if filter
+        is True, the frequencies without data are found from the first chunk,
+        and the same frequencies are then kept for all chunks.
+
+        Keywords are as in read_idb(), plus:
+          chunk_seconds  float--approximate length of data in each chunk, in
+                    seconds.  Default is 60.
+    '''
+    if type(trange) == Time:
+        with read_profile.stage('discover'):
+            files = get_trange_files(trange)
+    else:
+        # If input type is not Time, assume that it is the list of files to read
+        files = trange
+    sel = {'ants':ants, 'bls':bls, 'pols':pols, 'fidx':fidx, 'precision':precision, 'backend':backend}
+    if desat and not (ants is None and bls is None and pols is None):
+        raise ValueError('read_idb_iter: desat needs all antennas, baselines and polarizations')
+    shape1 = None
+    goodidx = None
+    ahead = prefetch_mod.Prefetcher(files, prefetch)
+    for file in ahead:
+        try:
+            # Size the chunks from the record interval of this file, in whole
+            # groups of navg times
+            with read_profile.stage('sizing'):
+                times = _count_times(file, nmax, tp_only, **sel)
+            dt = np.nanmedian(np.diff(times))*86400. if len(times) > 1 else 1.
+            per = navg if navg else 1
+            nchunk = max(1, int(np.rint(chunk_seconds/dt))//per)*per
+            if navg:
+                nout = len(times)//navg
+                times = np.mean(times[:nout*navg].reshape(nout,navg),1)
+            nq = _nquack(times, quackint)
+            chunks = _xdata_chunks(file, tp_only=tp_only, nchunk=nchunk, nmax=nmax, **sel)
+            with read_profile.stage('decode'):
+                source = next(chunks)
+        except Exception as err:
+            print('The problematic file is:',file,'('+type(err).__name__+': '+str(err)+')')
+            continue
+        if source is None:
+            source = src
+        elif src is not None and source != src:
+            print('Source name:',source,'does not match requested name:',src+'.  Will skip',file)
+            chunks.close()
+            continue
+        if srcchk and src is None:
+            # This is the first file, and we care about the source, so set source name
+            src = source
+        while True:
+            try:
+                with read_profile.stage('decode'):
+                    out = next(chunks, None)
+            except Exception as err:
+                print('The problematic file is:',file,'('+type(err).__name__+': '+str(err)+')')
+                break
+            if out is None:
+                break
+            if shape1 is None:
+                shape1 = out['p'].shape[:-1]
+            elif out['p'].shape[:-1] != shape1:
+                print('File',file,'skipped. Array shape',out['p'].shape[:-1],'does not match shape',shape1,'of first file')
+                break
+            out['source'] = source
+            if desat:
+                out = autocorr_desat(out)
+            if navg:
+                out = _time_average(out, navg, tp_only)
+            if nq > 0:
+                # Quack the first times of the file, which may span several chunks
+                n = min(nq, len(out['time']))
+                _drop_times(out, n)
+                nq -= n
+            if len(out['time']) == 0:
+                continue
+            if filter:
+                if goodidx is None:
+                    # Eliminate frequencies where there is no nonzero value
+                    goodidx, = np.sum(np.sum(np.sum(out['p'],3),1),0).nonzero()
+                for key in ['p','p2','m','meanp','a','x']:
+                    if out.get(key) is not None:
+                        out[key] = out[key][:,:,goodidx]
+                out['fghz'] = out['fghz'][goodidx]
+                out['band'] = out['band'][goodidx]
+            yield out
+        chunks.close()
+    if prefetch:
+        print('READ_IDB_ITER: Read-ahead hits:',ahead.hits,'misses:',ahead.misses)
+
+def _read_files_parallel(files, workers, lookahead=1, **kwargs):
+    ''' Generator that decodes the files in files concurrently in a pool of
+        worker processes, by calling _read_one(file, **kwargs) on each.  Results
+        are yielded in the order of the file list.  If a file could not be read,
+        the exception that was raised is yielded in place of its result.
+
+        At most workers + lookahead files are in flight (being decoded, or done
+        and waiting for their turn), so the results held at any one time do not
+        grow with the number of files.  The next file is submitted only when the
+        caller asks for the next result, i.e. after the previous one has been used.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    prof = read_profile.active()
+    # With profiling, the workers collect their own stage counters, which are added to prof
+    task = _read_one if prof is None else _read_one_profiled
+    todo = iter(files)
+    nworkers = min(workers, len(files))
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        pending = deque()
+        for file in todo:
+            pending.append(pool.submit(task, file, **kwargs))
+            if len(pending) == nworkers + lookahead:
+                break
+        while pending:
+            try:
+                out = pending.popleft().result()
+            except Exception as err:
+                out = err
+            else:
+                if prof is not None:
+                    out, stages = out
+                    prof.merge(stages)
+            yield out
+            # Drop the reference to the result once it has been handed on, and
+            # only then start the next file
+            del out
+            for file in todo:
+                pending.append(pool.submit(task, file, **kwargs))
+                break
+
+# Time axis of each time-dependent key in the read_idb() output dictionary
+_TIME_AXIS = {'a':3, 'x':3, 'p':3, 'p2':3, 'm':3, 'meanp':3, 'uvw':1, 'time':0, 'ha':0}
+
+def _count_times(file, nmax=600, tp_only=False, backend=None, **sel):
+    ''' Sizing pass for read_idb(): returns an estimate of the times that readXdata()
+        will find in file, without a pass over its visibility data.  The number of
+        times is the number of records in the Miriad header (miriad_native.record_count())
+        over the records per time, or, if the header has no record count (a file that
+        is still being written), an upper bound from the size of visdata.  The times
+        are spaced as the first two times of the file, so only their records are read.
+        An overestimate is trimmed after the files have been read, and an
+        underestimate enlarges the output arrays (see _place_output()).  If the
+        decoded file is in the idb_cache, its times are taken from there instead.
+    '''
+    cache = idb_cache.default_cache()
+    if cache is not None:
+        out = cache.load(file, 'read_idb.readXdata', _cache_params(False, tp_only, nmax, **sel))
+        if out is not None:
+            return out['time']
+    uv = aipy.miriad.UV(file)
+    nants = uv['nants']
+    # Auto- and cross-correlation records of all polarizations, per time
+    nper = nants*(nants+1)//2*uv['npol']
+    nchan = uv['nchan']
+    width = {'r':8, 'j':4, 'c':8}[uv.vartable['corr']]
+    # The time step is found from the records of the first two times
+    t0 = None
+    dt = 0.
+    for n, (preamble, data, flags) in enumerate(uv.all(raw=True)):
+        if t0 is None:
+            t0 = preamble[1]
+        elif preamble[1] != t0 or n > nper:
+            dt = preamble[1] - t0
+            break
+    del uv
+    if t0 is None:
+        return np.zeros(0)
+    nrec = miriad_native.record_count(file)
+    if nrec is None:
+        # Each record has at least nchan correlations in visdata
+        nrec = os.path.getsize(os.path.join(file, 'visdata'))//(nchan*width)
+    return (t0 + dt*np.arange(-(-nrec//nper)))[:nmax]
+
+def _nquack(times, quackint):
+    ''' Returns the number of leading times to skip for a quack interval of
+        quackint seconds.
+    '''
+    if quackint <= 0. or len(times) < 2:
+        return 0
+    # time interval between data points in seconds
+    dt = np.nanmedian(np.diff(times))*86400.
+    nt = int(np.rint(quackint/dt))
+    # check if nt is too large
+    if nt < len(times):
+        return nt
+    return 0
+
+def _nout(times, navg=None, quackint=0.):
+    ''' Returns the number of times that read_idb() will keep from a file with
+        the given times, after averaging over navg and skipping quackint seconds.
+    '''
+    if navg:
+        nout = len(times)//navg
+        times = np.mean(times[:nout*navg].reshape(nout,navg),1)
+    return len(times) - _nquack(times, quackint)
+
+def _place_output(final, out, off, nq=0):
+    ''' Copies the time-dependent arrays of one file's output dictionary, less
+        the first nq (quacked) times, into the final arrays starting at time
+        index off.  Returns the time index following the copied block.
+    '''
+    n = len(out['time']) - nq
+    if off + n > len(final['time']):
+        # The sizing pass undercounted (a time with no auto-correlation records?),
+        # so the final arrays have to be enlarged
+        print('READ_IDB: More times than expected, enlarging output arrays.')
+        for key, arr in final.items():
+            shape = list(arr.shape)
+            shape[_TIME_AXIS[key]] = off + n
+            bigger = np.zeros(shape, dtype=arr.dtype)
+            bigger[(slice(None),)*_TIME_AXIS[key]+(slice(0,off),)] = arr[(slice(None),)*_TIME_AXIS[key]+(slice(0,off),)]
+            final[key] = bigger
+    for key, arr in final.items():
+        axis = _TIME_AXIS[key]
+        arr[(slice(None),)*axis+(slice(off,off+n),)] = out[key][(slice(None),)*axis+(slice(nq,None),)]
+    return off + n
+
+def _shrink(arr, axis, keep, minfrac=0.9):
+    ''' Keeps only the (sorted) indices keep along axis of the C-contiguous array arr.
+        If at least minfrac of arr is kept, the data are moved within arr's own buffer
+        instead of being copied to a new array, so no second full-size array is
+        needed, and the smaller array returned is a view into the start of arr's
+        buffer.  Otherwise the kept data are copied to a new array, so that the
+        rest of arr's buffer can be freed.
+    '''
+    keep = np.asarray(keep, dtype=int)
+    shape = arr.shape
+    if len(keep) == shape[axis]:
+        return arr
+    if len(keep) < minfrac*shape[axis]:
+        return np.take(arr, keep, axis=axis)
+    na = int(np.prod(shape[:axis]))
+    nb = int(np.prod(shape[axis+1:]))
+    nk = len(keep)
+    src = arr.reshape(na, shape[axis], nb)
+    dst = arr.reshape(-1)[:na*nk*nb].reshape(na, nk, nb)
+    # A destination row never starts beyond the source rows still to be read,
+    # so blocks of rows can be gathered and written back in order
+    step = max(1, (1 << 26)//max(1, nk*nb*arr.itemsize))
+    for i in range(0, na, step):
+        dst[i:i+step] = src[i:i+step][:,keep]
+    shape = list(shape)
+    shape[axis] = nk
+    return dst.reshape(shape)
+
+def read_idb(trange,navg=None, nmax=600, quackint=0.,filter=True,srcchk=True,src=None,tp_only=False, desat=False,
+             workers=None, ants=None, bls=None, pols=None, fidx=None, keep_partial=False, precision='full',
+             prefetch=None, backend=None, profile=None):
     ''' This finds the IDB files within a given time range and concatenates 
         the times into a single dictionary.  If trange is not a Time() object,
         assume that it is the list of files to read.
@@ -722,157 +1409,165 @@ def read_idb(trange,navg=None, nmax=600, quackint=0.,filter=True,srcchk=True,src
                     auto & cross correlations)
           quackint  float--first time range (in seconds) to skip in the beginning of
                     each file. Default is 0., or no quack.
+          workers  int--if larger than 1, decode (and average) the files concurrently
+                    in this many worker processes.  Results are still combined in
+                    time order.  Default is None, which reads the files one at a time.
+          ants, bls, pols, fidx
+                   selections of antennas, baselines, polarizations and frequency
+                    indexes to read, as in readXdata().  Only the selected subset is
+                    read and kept.  If filter is True, frequencies without data are
+                    still removed from the selected ones.
+          keep_partial  boolean--if True (and navg is set), the times left over at the
+                    end of a file are not dropped.  They are averaged together with the
+                    first times of the next file if it follows without a time gap, and
+                    otherwise form a shorter average of their own.  In this case the
+                    quack interval is skipped before averaging.  Default is False.
+          precision  string--'full' (default), 'compact' or 'compact16', the types of
+                    the output arrays, as in readXdata().  The compact types roughly
+                    halve the working-set size of display pipelines.
+          prefetch  int--if set, a background thread reads this many files ahead of
+                    the one being decoded, so that disk (or NFS) reads overlap with
+                    decoding.  The hit/miss counts of the read-ahead are printed at
+                    the end.  Default is None (no read-ahead).
+          backend  string--'aipy' or 'native', the Miriad reader, as in readXdata().
+          profile  True, a file name or a read_profile.ReadProfile, to collect the time
+                    spent in each stage of the read, as in readXdata().  Stages run in
+                    worker processes are included.  Default is None.
     '''
+    with read_profile.profiling(profile) as prof:
+        out = _read_idb(trange, navg, nmax, quackint, filter, srcchk, src, tp_only, desat, workers,
+                        ants, bls, pols, fidx, keep_partial, precision, prefetch, backend)
+    if profile is True and out:
+        out['profile'] = prof.as_dict()
+    return out
+
+def _read_idb(trange, navg, nmax, quackint, filter, srcchk, src, tp_only, desat, workers,
+              ants, bls, pols, fidx, keep_partial, precision, prefetch, backend):
+    ''' Does the work of read_idb().
+    '''
+    sel = {'ants':ants, 'bls':bls, 'pols':pols, 'fidx':fidx, 'precision':precision, 'backend':backend}
+    # With keep_partial, files are read unaveraged and averaged here, in time order
+    averager = time_avg.TimeAverager(navg) if navg and keep_partial else None
+    fnavg = None if averager is not None else navg
     if type(trange) == Time:
-        files = get_trange_files(trange)
+        with read_profile.stage('discover'):
+            files = get_trange_files(trange)
     else:
         # If input type is not Time, assume that it is the list of files to read
         files = trange
 
-    datalist = []
+    if workers is not None and workers > 1 and len(files) > 1:
+        # The source name of the first file is not known until it has been read, so
+        # in this case the source check against it is done after reading.
+        results = _read_files_parallel(files, workers, navg=fnavg, nmax=nmax, tp_only=tp_only,
+                                       src=src, desat=desat, **sel)
+    else:
+        results = None
+    # Sizing pass, so that the output arrays can be allocated once at (about) their
+    # final size, and each file's block written into its own slice
+    nout = []
+    # Only the headers and first records are read here, so the read-ahead is
+    # kept for the full read below
     for file in files:
-        #This will skip any files that give us errors.
-        #  The names of the bad or unreadable files will
-        #  be printed.
         try:
-            out = readXdata(file,tp_only=tp_only,src=src, desat=desat, nmax=nmax)
-            if type(out) is str:
-                print('Source name:',out,'does not match requested name:',src+'.  Will skip',file)
+            with read_profile.stage('sizing'):
+                times = _count_times(file, nmax, tp_only, **sel)
+            if averager is None:
+                nout.append(_nout(times, navg, quackint))
             else:
-                if srcchk and src is None:
-                    # This is the first file, and we care about the source, so set source name
-                    src = out['source']
-                if navg:
-                    # Perform time average over navg seconds. Note that this does not do the
-                    # right thing over time gaps (yet)        
-                    # First set any time-frequency bins with M value 0 to nan
-                    badidx = np.where(out['m'][0,0] == 0)
-                    out['p'][:,:,badidx[0],badidx[1]] = np.nan
-                    out['p2'][:,:,badidx[0],badidx[1]] = np.nan
-                    if not tp_only:
-                        out['a'][:,:,badidx[0],badidx[1]] = np.nan
-                        out['x'][:,:,badidx[0],badidx[1]] = np.nan
-                        out['uvw'][:,badidx[1],:] = np.nan
-                    # Truncate arrays so that times are evenly divisible by navg
-                    nt = len(out['time'])
-                    nout = nt//navg
-                    ntnew = nout*navg
-                    out['m'] = out['m'][:,:,:,:ntnew]
-                    out['p'] = out['p'][:,:,:,:ntnew]
-                    out['p2'] = out['p2'][:,:,:,:ntnew]
-                    if not tp_only:
-                        out['a'] = out['a'][:,:,:,:ntnew]
-                        out['x'] = out['x'][:,:,:,:ntnew]
-                    out['time'] = out['time'][:ntnew]
-                    out['ha'] = out['ha'][:ntnew]
-                    out['uvw'] = out['uvw'][:,:ntnew,:]
-                    # Recast shape 
-                    out['m'].shape = out['m'].shape[0:3]+(nout,navg)
-                    out['p'].shape = out['p'].shape[0:3]+(nout,navg)
-                    out['p2'].shape = out['p2'].shape[0:3]+(nout,navg)
-                    if not tp_only:
-                        out['a'].shape = out['a'].shape[0:3]+(nout,navg)
-                        out['x'].shape = out['x'].shape[0:3]+(nout,navg)
-                    out['time'].shape = (nout,navg)
-                    out['ha'].shape = (nout,navg)
-                    out['uvw'].shape = (out['uvw'].shape[0],nout,navg,3)
-                    # Perform the average (mean) power and add to out dictionary
-                    out.update({'meanp':np.nanmean(out['p'],4)})
-                    # Perform sum over m, p and p2, to preserve SK
-                    out['m'] = np.nansum(out['m'],4)
-                    out['p'] = np.nansum(out['p'],4)
-                    out['p2'] = np.nansum(out['p2'],4)
-                    if not tp_only:
-                        # Perform the average (mean), over non-nan values
-                        out['a'] = np.nanmean(out['a'],4)
-                        out['x'] = np.nanmean(out['x'],4)
-                    out['time'] = np.mean(out['time'],1)  # Weighted average time
-                    out['uvw'] = np.nanmean(out['uvw'],2)
-                    ha = np.mean(np.unwrap(out['ha']),1)  # Weighted average "unwrapped" ha
-                    # Wrap it again...
-                    ha[np.where(ha > np.pi)] -= 2*np.pi
-                    ha[np.where(ha < -np.pi)] += 2*np.pi
-                    out['ha'] = ha
-
-                datalist.append(out)
-        except:
-            print('The problematic file is:',file)
-            
-    if len(datalist) == 0:
-        return {}
-    # Have to concatenate outa, outx, uvw, time, and ha arrays
-    outa = []
-    outx = []
-    outp = []
-    outp2 = []
-    outm = []
-    uvw = []
-    time = []
-    ha = []
-    # This could be a lot of data, so handle P data first to determine
-    # frequencies to eliminate
-    # Keep track of files whose shape matches the first file
-    shape1 = datalist[0]['p'].shape[:-1]
-    match = []
-    for i,out in enumerate(datalist):
-        shape2 = out['p'].shape[:-1]
-        if shape1 == shape2:
-            match.append(True)
-            outp.append(out['p'])
+                # Averages that start in this file
+                nout.append(-(-(len(times) - _nquack(times, quackint))//navg))
+        except Exception:
+            nout.append(0)
+    final = None
+    nread = 0
+    nused = 0
+    off = 0
+    ahead = prefetch_mod.Prefetcher(files, prefetch if results is None else None)
+    for n, file in enumerate(ahead):
+        #This will skip any files that give us errors.
+        #  The names of the bad or unreadable files will
+        #  be printed, along with the reason.
+        if results is None:
+            try:
+                out = _read_one(file, navg=fnavg, nmax=nmax, tp_only=tp_only, src=src, desat=desat, **sel)
+            except Exception as err:
+                out = err
         else:
-            match.append(False)
-            print('Scan/file',i+1,'skipped. Array shape',shape2,'does not match shape',shape1,'of first scan/file')
-    out['p'] = np.concatenate(outp,3)
-    if filter:
-        # Eliminate frequencies where there is no nonzero value
-        # sums power over every dimension except freq.
-        goodidx, = np.sum(np.sum(np.sum(out['p'],3),1),0).nonzero()
-        # Eliminate frequencies where there is no nonzero value
-        out['p'] = out['p'][:,:,goodidx]
-    for i,out in enumerate(datalist):
-        if match[i]:
-            if filter:
-                # Eliminate frequencies where there is no nonzero value
-                # before concatenation, to reduce memory load
-                out['p2'] = out['p2'][:,:,goodidx]
-                out['m'] = out['m'][:,:,goodidx]
-                if not tp_only:
-                    out['a'] = out['a'][:,:,goodidx]
-                    out['x'] = out['x'][:,:,goodidx]
-                out['fghz'] = out['fghz'][goodidx]
-                out['band'] = out['band'][goodidx]
-            if quackint > 0.:
-                # time interval between data points in seconds
-                dt = np.nanmedian(np.diff(out['time']))*86400.             
-                nt = np.rint(quackint/dt).astype('int')
-                # check if nt is too large
-                if nt < len(out['time']):
-                    out['a']=out['a'][:,:,:,nt:]
-                    out['x']=out['x'][:,:,:,nt:]
-                    out['p2']=out['p2'][:,:,:,nt:]
-                    out['m']=out['m'][:,:,:,nt:]
-                    out['uvw']=out['uvw'][:,nt:]
-                    out['time']=out['time'][nt:]
-                    out['ha']=out['ha'][nt:]
-            outa.append(out['a'])
-            outx.append(out['x'])
-            outp2.append(out['p2'])
-            outm.append(out['m'])
-            uvw.append(out['uvw'])
-            time.append(out['time'])
-            ha.append(out['ha'])
+            out = next(results)
+        if isinstance(out, Exception):
+            print('The problematic file is:',file,'('+type(out).__name__+': '+str(out)+')')
+            continue
+        elif type(out) is str:
+            print('Source name:',out,'does not match requested name:',src+'.  Will skip',file)
+            continue
+        elif src is not None and out['source'] != src:
+            print('Source name:',out['source'],'does not match requested name:',src+'.  Will skip',file)
+            continue
+        if srcchk and src is None:
+            # This is the first file, and we care about the source, so set source name
+            src = out['source']
+        if final is not None and out['p'].shape[:-1] != shape1:
+            print('Scan/file',nread+1,'skipped. Array shape',out['p'].shape[:-1],'does not match shape',shape1,'of first scan/file')
+            nread += 1
+            continue
+        nq = _nquack(out['time'], quackint)
+        if averager is not None:
+            _drop_times(out, nq)
+            with read_profile.stage('average'):
+                out = averager.add(out)
+            nq = 0
+        if final is None:
+            # First good file, so allocate the output arrays for this and all remaining files.
+            # Keep track of files whose shape matches the first file
+            shape1 = out['p'].shape[:-1]
+            final = {}
+            for key, axis in _TIME_AXIS.items():
+                if out.get(key) is not None:
+                    shape = list(out[key].shape)
+                    # With keep_partial, there may be one more average when the last one is flushed
+                    shape[axis] = sum(nout[n:]) + (averager is not None)
+                    final[key] = np.zeros(shape, dtype=out[key].dtype)
+            fghz = out['fghz']
+            band = out['band']
+        with read_profile.stage('concat'):
+            off = _place_output(final, out, off, nq)
+        nread += 1
+        nused += 1
+        # Keep the non-array items of the latest file, and free its arrays
+        meta = {key: val for key, val in out.items() if key not in _TIME_AXIS}
+        del out
+
+    if prefetch:
+        print('READ_IDB: Read-ahead hits:',ahead.hits,'misses:',ahead.misses)
+    if final is None:
+        return {}
+    if averager is not None:
+        with read_profile.stage('average'):
+            out = averager.flush()
+        if out is not None:
+            with read_profile.stage('concat'):
+                off = _place_output(final, out, off)
+    with read_profile.stage('concat'):
+        # Trim the time axis to the number of times actually read
+        for key in final:
+            final[key] = _shrink(final[key], _TIME_AXIS[key], np.arange(off))
+        if filter:
+            # Eliminate frequencies where there is no nonzero value
+            # sums power over every dimension except freq.
+            goodidx, = np.sum(np.sum(np.sum(final['p'],3),1),0).nonzero()
+            for key in ['p','p2','m','meanp','a','x']:
+                if key in final:
+                    final[key] = _shrink(final[key], 2, goodidx)
+            fghz = fghz[goodidx]
+            band = band[goodidx]
+    out = meta
+    out.update(final)
     if tp_only:
-        out['a'] = outa
-        out['x'] = outx
-    else:
-        out['a'] = np.concatenate(outa,3)
-        out['x'] = np.concatenate(outx,3)
-    out['p2'] = np.concatenate(outp2,3)
-    out['m'] = np.concatenate(outm,3)
-    out['uvw'] = np.concatenate(uvw,1)
-    out['time'] = np.concatenate(time)
-    out['ha'] = np.concatenate(ha)
-    out['fghz'] = datalist[0]['fghz']
+        out['a'] = [None]*nused
+        out['x'] = [None]*nused
+    out['fghz'] = fghz
+    out['band'] = band
     return out
     
 def read_npz(files):
@@ -880,39 +1575,26 @@ def read_npz(files):
         in the given file-list, and concatenates the times into a single 
         dictionary.  The result is the same as read_idb() on several files.
         
-        files     A list of npz files.
+        files     A list of npz files, or of files written by idb_store.save(),
+                    which are read without unpickling.
     '''
     # Have to concatenate outa, outx, uvw, time, and ha arrays
-    outa = []
-    outx = []
-    outp = []
-    outp2 = []
-    outm = []
-    uvw = []
-    time = []
-    ha = []
+    keys = {'p':3, 'a':3, 'x':3, 'p2':3, 'm':3, 'uvw':1, 'time':0, 'ha':0}
+    parts = {key: [] for key in keys}
     for file in files:
-        f = open(file,'rb')
-        data = np.load(f, allow_pickle=True, encoding='latin1')
+        if idb_store.is_store(file):
+            item = idb_store.load(file)
+        else:
+            with open(file,'rb') as f:
+                data = np.load(f, allow_pickle=True, encoding='latin1')
+                # Unpickle the dictionary only once per file
+                item = data[list(data.keys())[0]].item()
         if file == files[0]:
-            out = data[list(data.keys())[0]].item()
-        outp.append(data[list(data.keys())[0]].item()['p'])
-        outa.append(data[list(data.keys())[0]].item()['a'])
-        outx.append(data[list(data.keys())[0]].item()['x'])
-        outp2.append(data[list(data.keys())[0]].item()['p2'])
-        outm.append(data[list(data.keys())[0]].item()['m'])
-        uvw.append(data[list(data.keys())[0]].item()['uvw'])
-        time.append(data[list(data.keys())[0]].item()['time'])
-        ha.append(data[list(data.keys())[0]].item()['ha'])
-        f.close()
-    out['p'] = np.concatenate(outp,3)
-    out['a'] = np.concatenate(outa,3)
-    out['x'] = np.concatenate(outx,3)
-    out['p2'] = np.concatenate(outp2,3)
-    out['m'] = np.concatenate(outm,3)
-    out['uvw'] = np.concatenate(uvw,1)
-    out['time'] = np.concatenate(time)
-    out['ha'] = np.concatenate(ha)
+            out = item
+        for key in keys:
+            parts[key].append(item[key])
+    for key, axis in keys.items():
+        out[key] = np.concatenate(parts[key],axis)
     return out
     
 def flag_sk(out):
@@ -984,7 +1666,7 @@ def get_trange_files(trange):
     # Given a timerange, this routine will take all relevant IDBfiles from
     #  that time range, put them in a list, and return that list.
     #  This function is used in get_X_data(data).
-    from .util import get_idbdir, fname2mjd
+    from .util import get_idbdir
 
     t0, t1 = trange
     mjd0, mjd1 = t0.mjd, t1.mjd
@@ -1007,25 +1689,66 @@ def get_trange_files(trange):
             date_str = day.iso.split()[0].replace('-', '')
             datadir = os.path.join(datadir, date_str)
 
-        # make sure the directory exists
-        if not os.path.isdir(datadir):
-            continue
+        # look up the IDB files for this calendar date within the exact mjd window,
+        # using the persistent index of the directory (see file_index.py)
+        files += file_index.find_files(datadir, max(mjd0, mjd_day), min(mjd1, mjd_day + 1), prefix='IDB')
 
-        # glob all IDB files for that calendar date
-        prefix = day.iso.split()[0].replace('-', '')
-        pattern = os.path.join(datadir, f"IDB{prefix}*")
-        day_files = sorted(glob.glob(pattern))
+    return sorted(files)
 
-        # filter by the exact mjd window
-        for fn in day_files:
-            file_mjd = fname2mjd(fn)
-            if mjd0 <= file_mjd < mjd1:
-                files.append(fn)
 
-    return sorted(files)
+_xyphase_cache = []   # X-Y phase calibration records read by _xyphase_cal()
+
+
+def _read_xyphase_record(t):
+    ''' Read the X-Y phase calibration record (type 11) for time t from the SQL database.
+    '''
+    from . import cal_header as ch
+    return ch.read_cal(11, t=t)
+
+
+def _xyphase_cal(t):
+    ''' Return the frequencies (GHz), X-Y phases (nant, nf) and Xi_Rot (nf) of
+        the X-Y phase calibration (type 11) in effect at time t (a Time() object).
+
+        Records are cached in memory, keyed by their validity time (the SQL timestamp
+        of the record).  The record read for time t is the one in effect from its
+        validity time up to t, so later calls for any time in that interval do not
+        query the database again.
+    '''
+    tlv = int(t.lv)
+    for entry in _xyphase_cache:
+        if entry['valid'] <= tlv <= entry['checked']:
+            return entry['cal']
+    xml, buf = _read_xyphase_record(t)
+    if buf is None:
+        raise ValueError('unrot: Could not read the X-Y phase calibration for ' + t.iso[:19])
+    valid = int(extract(buf, xml['SQL_timestamp']))
+    for entry in _xyphase_cache:
+        if entry['valid'] == valid:
+            entry['checked'] = max(entry['checked'], tlv)
+            return entry['cal']
+    fghz = extract(buf, xml['FGHz'])
+    good, = np.where(fghz != 0.)
+    cal = (fghz[good], extract(buf, xml['XYphase'])[:, good], extract(buf, xml['Xi_Rot'])[good])
+    _xyphase_cache.append({'valid': valid, 'checked': tlv, 'cal': cal})
+    return cal
 
 
-def unrot(data, azeldict=None):
+def _nearest_idx(values, grid):
+    ''' Vectorized nearest_val_idx(): index of the nearest value in the sorted array grid
+        to each value, with ties going to the later value.  An empty grid gives index 0.
+    '''
+    values = np.asarray(values, dtype=float)
+    if len(grid) == 0:
+        return np.zeros(len(values), dtype=int)
+    idx = np.searchsorted(grid, values, side='left')
+    lo = np.maximum(idx - 1, 0)
+    hi = np.minimum(idx, len(grid) - 1)
+    use_lo = (idx > 0) & ((idx == len(grid)) | (np.abs(values - grid[lo]) < np.abs(values - grid[hi])))
+    return np.where(use_lo, lo, idx)
+
+
+def unrot(data, azeldict=None, inplace=False):
     ''' Apply the correction to differential feed rotation to data, and return
         the corrected data.  This also applies flags to data whose antennas are
         not tracking.
@@ -1034,18 +1757,17 @@ def unrot(data, azeldict=None):
           data     A dictionary returned by read_idb.py's readXdata().
           azeldict The dictionary returned from get_sql_info(), or if None, the appropriate
                      get_sql_info() call is done internally.
+          inplace  If True, the corrected data are written into data['x'], and data is
+                     returned.  Otherwise (default) data is left unchanged.
 
         Output:
           cdata    A dictionary with the phase-corrected data.  Only the key
-                     x is updated.
+                     x is updated (the other keys share the arrays of data).
     '''
-    import copy
-    from .pipeline_cal import get_sql_info
-    from . import cal_header as ch
-
     trange = Time(data['time'][[0, -1]], format='jd')
 
     if azeldict is None:
+        from .pipeline_cal import get_sql_info
         azeldict = get_sql_info(trange)
     chi = azeldict['ParallacticAngle'] * np.pi / 180.  # (nt, nant)
     # Correct parallactic angle for equatorial mounts, relative to Ant14
@@ -1059,66 +1781,59 @@ def unrot(data, azeldict=None):
     # Which antennas are tracking
     track = azeldict['TrackFlag']  # True if tracking
 
-    # Ensure that nearest valid parallactic angle is used for times in the data
-    good = np.where(azeldict['ActualAzimuth'] != 0)
-    tidx = []  # List of arrays of indexes for each antenna
-    gd = []
+    # Ensure that nearest valid parallactic angle is used for times in the data.  For
+    # each antenna, find its tracking flag and parallactic angle at every data time.
+    nt = len(data['time'])
+    sqljd = azeldict['Time'].jd
+    good = azeldict['ActualAzimuth'] != 0
+    trk = np.zeros((nant, nt), dtype=bool)
+    achi = np.zeros((nant, nt))
+    chiok = np.zeros(nant, dtype=bool)   # False if the antenna has no valid angles
     for i in range(nant):
-        gd.append(good[0][np.where(good[1] == i)])
-        tidx.append(nearest_val_idx(data['time'], azeldict['Time'][gd].jd))
+        gd, = np.where(good[:, i])
+        tidx = _nearest_idx(data['time'], sqljd[gd])
+        trk[i] = track[tidx, i]
+        if len(gd) > 0:
+            achi[i] = chi[gd[tidx], i]
+            chiok[i] = True
 
-    # Read X-Y Delay phase from SQL database and get common frequencies
-    xml, buf = ch.read_cal(11, t=trange[0])
-    fghz = extract(buf, xml['FGHz'])
-    good, = np.where(fghz != 0.)
-    fghz = fghz[good]
-    dph = extract(buf, xml['XYphase'])
-    dph = dph[:, good]
-    xi_rot = extract(buf, xml['Xi_Rot'])
-    xi_rot = xi_rot[good]
+    # Read X-Y Delay phase from SQL database (or the cache) and get common frequencies
+    fghz, dph, xi_rot = _xyphase_cal(trange[0])
     fidx1, fidx2 = common_val_idx(data['fghz'], fghz, precision=4)
-    missing = np.setdiff1d(np.arange(len(data['fghz'])), fidx1)
 
-    nbl, npol, nf, nt = data['x'].shape
-    nf = len(fidx1)
-    # Correct data for X-Y delay phase
-    for i in range(nant-1):
-        for j in range(i + 1, nant):
-            k = bl2ord[i, j]
-            if j == 13:                  # xi_rot was applied for all antennas, but this
-                xi = xi_rot[fidx2]       # is wrong.  Now it is only done for ant14.
-            else:
-                xi = 0.0                 # xi_rot for other antennas is just zero.
-            a1 = lobe(dph[i, fidx2] - dph[j, fidx2])
-            a2 = -dph[j, fidx2] - xi
-            a3 = dph[i, fidx2] - xi + np.pi
-            data['x'][k, 1, fidx1] *= np.repeat(np.exp(1j * a1), nt).reshape(nf, nt)
-            data['x'][k, 2, fidx1] *= np.repeat(np.exp(1j * a2), nt).reshape(nf, nt)
-            data['x'][k, 3, fidx1] *= np.repeat(np.exp(1j * a3), nt).reshape(nf, nt)
-
-    # Correct data for differential feed rotation
-    cdata = copy.deepcopy(data)
-    for n in range(nt):
-        for i in range(nant-1):
-            for j in range(i + 1, nant):
-                k = bl2ord[i, j]
-                ti = tidx[i][n]
-                tj = tidx[j][n]
-                if track[ti, i] and track[tj, j]:
-                    # If something goes wrong with chi difference calculation, just default to chi = 0
-                    try:
-                        dchi = chi[gd[i][ti], i] - chi[gd[j][tj], j]
-#                        dchi = -chi[gd[i][ti], i] + chi[gd[j][tj], j]  # Try opposite sign of rotation *****
-                    except:
-                        dchi = 0.0
-                    cchi = np.cos(dchi)
-                    schi = np.sin(dchi)
-                    cdata['x'][k, 0, :, n] = data['x'][k, 0, :, n] * cchi + data['x'][k, 3, :, n] * schi
-                    cdata['x'][k, 2, :, n] = data['x'][k, 2, :, n] * cchi + data['x'][k, 1, :, n] * schi
-                    cdata['x'][k, 3, :, n] = data['x'][k, 3, :, n] * cchi - data['x'][k, 0, :, n] * schi
-                    cdata['x'][k, 1, :, n] = data['x'][k, 1, :, n] * cchi - data['x'][k, 2, :, n] * schi
-                else:
-                    cdata['x'][k, :, :, n] = np.nan
+    x = data['x']
+    if inplace:
+        cdata = data
+    else:
+        cdata = dict(data)
+        cdata['x'] = x.copy()
+    cx = cdata['x']
+    # Baselines are done one reference antenna at a time, to limit the size of temporaries
+    for i in range(nant - 1):
+        j = np.arange(i + 1, nant)
+        k = bl2ord[i, j]
+        # X-Y delay phase for each polarization product.  xi_rot was applied for all
+        # antennas, but this is wrong.  Now it is only done for ant14.
+        xi = np.where((j == 13)[:, None], xi_rot[fidx2], 0.0)
+        phase = np.zeros((len(j), 4, len(fidx1)))
+        phase[:, 1] = lobe(dph[i, fidx2] - dph[j][:, fidx2])
+        phase[:, 2] = -dph[j][:, fidx2] - xi
+        phase[:, 3] = dph[i, fidx2] - xi + np.pi
+        blk = x[k]
+        blk[:, :, fidx1] *= np.exp(1j * phase)[..., None]
+        # Rotation by the difference of parallactic angles, with chi = 0 where one is unknown
+        dchi = np.where((chiok[i] & chiok[j])[:, None], achi[i] - achi[j], 0.0)[:, None, :]
+        cchi = np.cos(dchi)
+        schi = np.sin(dchi)
+        rot = np.empty_like(blk)
+        rot[:, 0] = blk[:, 0] * cchi + blk[:, 3] * schi
+        rot[:, 2] = blk[:, 2] * cchi + blk[:, 1] * schi
+        rot[:, 3] = blk[:, 3] * cchi - blk[:, 0] * schi
+        rot[:, 1] = blk[:, 1] * cchi - blk[:, 2] * schi
+        # Flag baselines whose antennas are not both tracking
+        tracking = trk[i] & trk[j]
+        np.copyto(rot, np.nan, where=~tracking[:, None, None, :])
+        cx[k] = rot
 
     # Set flags for any missing frequencies (hopefully this also works when "missing" is np.array([]))
     # cdata['x'][missing] = np.ma.masked
@@ -0,0 +1,171 @@
+"""Per-stage profiling counters for the IDB and UDB read paths.
+
+When a read is slow, the time can go to finding files, decoding the Miriad
+records, correcting for saturation, averaging, computing the LST or
+concatenating the output.  The readers mark these stages with :func:`stage`,
+which does nothing unless a :class:`ReadProfile` is active, so the counters
+cost next to nothing when they are not wanted::
+
+    with ReadProfile() as prof:
+        out = read_idb.read_idb(files, navg=60)
+    print(prof.summary())
+
+or, equivalently, ``read_idb.read_idb(files, navg=60, profile=True)`` returns
+the counters in ``out['profile']``.  A file name given as ``profile`` (or as
+``ReadProfile(jsonl=...)``) has one JSON line per stage appended to it.
+
+Each stage gets its wall time, number of calls, records decoded and bytes
+read.  Stage times are exclusive: the time of a stage that runs inside
+another is not counted again in the outer one, so the stage times add up to
+no more than the total.  Times of stages that ran in worker processes are
+added as they are, and can then add up to more than the total.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# Stage counters, in the order they are reported
+FIELDS = ("calls", "seconds", "records", "bytes")
+
+_active: contextvars.ContextVar = contextvars.ContextVar("eovsapy_read_profile", default=None)
+
+
+class ReadProfile:
+    """Counters of the stages of one or more reads.
+
+    :param jsonl: If set, a JSON lines file that the counters are appended to
+        when the profile is closed.
+    :type jsonl: str, optional
+    :param label: Name of the run, written with the JSON lines.
+    :type label: str, optional
+    """
+
+    def __init__(self, jsonl: Optional[str] = None, label: Optional[str] = None) -> None:
+        self.jsonl = jsonl
+        self.label = label
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.total = 0.0
+        self.started: Optional[float] = None
+        self._t0 = 0.0
+        self._depth = 0
+        self._tokens: List[contextvars.Token] = []
+        # Time taken by the inner stages of each open stage
+        self._inner: List[float] = []
+
+    def __enter__(self) -> "ReadProfile":
+        if self._depth == 0:
+            self._t0 = time.perf_counter()
+            if self.started is None:
+                self.started = time.time()
+        self._depth += 1
+        self._tokens.append(_active.set(self))
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        _active.reset(self._tokens.pop())
+        self._depth -= 1
+        if self._depth == 0:
+            self.total += time.perf_counter() - self._t0
+            if self.jsonl:
+                self.write_jsonl(self.jsonl)
+
+    def add(self, name: str, seconds: float = 0.0, records: int = 0, nbytes: int = 0, calls: int = 0) -> None:
+        """Add to the counters of a stage."""
+        counts = self.stages.setdefault(name, dict.fromkeys(FIELDS, 0))
+        counts["calls"] += calls
+        counts["seconds"] += seconds
+        counts["records"] += int(records)
+        counts["bytes"] += int(nbytes)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, records: int = 0, nbytes: int = 0) -> Iterator["ReadProfile"]:
+        """Time the body of the with statement as one call of stage name."""
+        self._inner.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - t0
+            inner = self._inner.pop()
+            if self._inner:
+                self._inner[-1] += elapsed
+            self.add(name, elapsed - inner, records, nbytes, calls=1)
+
+    def merge(self, stages: Dict[str, Dict[str, float]]) -> None:
+        """Add the counters of another profile's as_dict()['stages']."""
+        for name, counts in stages.items():
+            self.add(name, counts["seconds"], counts["records"], counts["bytes"], counts["calls"])
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the total wall time and the counters of each stage."""
+        return {"label": self.label, "total_s": self.total,
+                "stages": {name: dict(counts) for name, counts in self.stages.items()}}
+
+    def summary(self) -> str:
+        """Return the counters as a table, one line per stage."""
+        lines = ["%-12s %6s %10s %12s %14s" % ("stage", "calls", "seconds", "records", "bytes")]
+        for name, counts in self.stages.items():
+            lines.append("%-12s %6d %10.3f %12d %14d" % (name, counts["calls"], counts["seconds"],
+                                                         counts["records"], counts["bytes"]))
+        lines.append("%-12s %6s %10.3f" % ("total", "", self.total))
+        return "\n".join(lines)
+
+    def write_jsonl(self, path: str) -> None:
+        """Append one JSON line per stage to the file path."""
+        started = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.started or time.time()))
+        with open(path, "a") as handle:
+            for name, counts in self.stages.items():
+                record = {"started": started, "label": self.label, "total_s": self.total, "stage": name}
+                record.update(counts)
+                handle.write(json.dumps(record) + "\n")
+
+
+def active() -> Optional[ReadProfile]:
+    """Return the profile that is collecting counters, if any."""
+    return _active.get()
+
+
+def stage(name: str, records: int = 0, nbytes: int = 0):
+    """Time the body of a with statement as stage name of the active profile.
+    Does nothing if no profile is active.
+    """
+    prof = _active.get()
+    if prof is None:
+        return contextlib.nullcontext()
+    return prof.stage(name, records, nbytes)
+
+
+def count(name: str, records: int = 0, nbytes: int = 0) -> None:
+    """Add records decoded or bytes read to stage name of the active profile."""
+    prof = _active.get()
+    if prof is not None:
+        prof.add(name, records=records, nbytes=nbytes)
+
+
+def dataset_bytes(path: str) -> int:
+    """Return the size of the visibility data and flags of a Miriad dataset."""
+    return sum(os.path.getsize(os.path.join(path, item)) for item in ("visdata", "flags")
+               if os.path.isfile(os.path.join(path, item)))
+
+
+def profiling(profile: Union[None, bool, str, ReadProfile]):
+    """Context manager for the profile keyword of the readers.
+
+    :param profile: None or False to leave the active profile (if any) as it
+        is, True for a new profile, a file name for a new profile that is
+        appended to that JSON lines file, or a ReadProfile to collect into.
+    :returns: A context manager whose value is the profile, or None.
+    """
+    if profile is None or profile is False:
+        return contextlib.nullcontext()
+    if profile is True:
+        return ReadProfile()
+    if isinstance(profile, str):
+        return ReadProfile(jsonl=profile)
+    return profile
@@ -0,0 +1,183 @@
+"""Synthetic IDB files with the dimensions of real EOVSA data.
+
+Benchmarks and tests of the IDB readers need files of realistic size, and the
+real ones are only on the ``/data1`` archive.  :func:`write_idb` writes a
+Miriad dataset with the layout of an IDB file: 16 antennas, the 136 baselines
+(autocorrelations included) in 4 polarizations for each time, the science
+channels of the 34-band (before 2019-02-22) or 52-band frequency plan, and
+the per-time ``xsampler``/``ysampler`` total power and ``delay`` variables.
+It also sets the non-record variables that ``udb_util.udbfile_write`` copies
+into UDB files, so that the same files can be run through the UDB pipeline.
+
+The visibilities are random, but reproducible for a given seed, and the
+autocorrelations are real and positive.  :func:`azeldict` and
+:func:`xyphase_cal` make matching stand-ins for the SQL database inputs of
+``read_idb.unrot``.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aipy
+import numpy as np
+
+from . import chan_util_52, chan_util_bc
+from .util import Time
+
+NANT = 16
+NPOL = 4
+CADENCES = {"1s": 1.0, "20ms": 0.02}
+# A daytime start in the era of each frequency plan
+T_START = {34: "2018-06-01 18:00:00", 52: "2023-02-24 18:00:00"}
+# Standard SK m value (column 2 of xsampler) for each frequency plan
+M_VALUE = {34: 721536.0, 52: 745472.0}
+
+
+def band_frequencies(nbands: int = 52) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the center frequencies and widths (GHz) of the science channels of
+    the 34- or 52-band plan.
+    """
+    if nbands == 52:
+        chan = chan_util_52
+    elif nbands == 34:
+        chan = chan_util_bc
+    else:
+        raise ValueError(f"nbands must be 34 or 52, not {nbands!r}")
+    bands = range(1, nbands + 1)
+    start = np.concatenate([chan.start_freq(band) for band in bands])
+    width = np.concatenate([chan.sci_bw(band) for band in bands])
+    return start + width / 2, width
+
+
+def _ut_seconds(jd: float) -> float:
+    return ((jd - 0.5) % 1) * 86400.0
+
+
+def _stamp(jd: float) -> str:
+    return Time(jd, format="jd").strftime("%Y%m%d%H%M%S")
+
+
+def write_idb(path: str, times: Sequence[float], nbands: int = 52, nant: int = NANT,
+              source: str = "Sun", seed: int = 0) -> int:
+    """Write one synthetic IDB file.
+
+    :param path: Name of the Miriad dataset to create.
+    :param times: Julian dates of the records.
+    :param nbands: 34 or 52, the frequency plan.
+    :param nant: Number of antennas.
+    :param source: Source name.
+    :param seed: Seed of the random visibilities.
+    :returns: The number of visibility records written.
+    """
+    rng = np.random.default_rng(seed)
+    fghz, sdf = band_frequencies(nbands)
+    nf = len(fghz)
+    m0 = M_VALUE[nbands]
+    antpos = rng.uniform(-1000.0, 1000.0, size=(nant, 3))
+    antpos[:, 2] = 0.0
+    scanid = _stamp(times[0])
+
+    uv = aipy.miriad.UV(path, "new")
+    header = [
+        ("source", "a", source), ("telescop", "a", "EOVSA"), ("project", "a", "NormalObserving"),
+        ("operator", "a", "synthetic"), ("version", "a", "3.0"), ("scanid", "a", scanid),
+        ("proj", "a", "NormalObserving"), ("antlist", "a", " ".join(str(i + 1) for i in range(nant))),
+        ("obstype", "a", "synthetic"), ("nants", "i", nant), ("npol", "i", NPOL),
+        ("nchan", "i", nf), ("nspect", "i", nf),
+        ("nschan", "i", np.ones(nf, dtype=np.int64)), ("ischan", "i", np.arange(1, nf + 1)),
+        ("vsource", "r", 0.0), ("veldop", "r", 0.0), ("epoch", "r", 2000.0),
+        ("freq", "d", fghz[0]), ("restfreq", "d", 0.0), ("antpos", "d", antpos.T.ravel()),
+        ("sfreq", "d", fghz), ("sdf", "d", sdf),
+        ("ra", "d", 1.0), ("dec", "d", 0.2), ("obsra", "d", 1.0), ("obsdec", "d", 0.2),
+        ("inttime", "r", float(np.median(np.diff(times)) * 86400.0) if len(times) > 1 else 1.0),
+    ]
+    for name, vtype, value in header:
+        uv.add_var(name, vtype)
+        uv[name] = value
+    for name, vtype in [("ut", "d"), ("xsampler", "r"), ("ysampler", "r"), ("delay", "d"), ("pol", "i")]:
+        uv.add_var(name, vtype)
+
+    ij = [(i, j) for i in range(nant) for j in range(i, nant)]
+    auto = np.array([i == j for i, j in ij])
+    uvw = np.array([antpos[j] - antpos[i] for i, j in ij]) / 0.299792458  # ns
+    nrec = 0
+    for t in times:
+        power = rng.uniform(200.0, 2000.0, size=(2, nf, nant))
+        for name, p in zip(("xsampler", "ysampler"), power):
+            sampler = np.empty((nf, nant, 3), dtype=np.float32)
+            sampler[:, :, 0] = p
+            sampler[:, :, 1] = p * p * 1.001
+            sampler[:, :, 2] = m0
+            uv[name] = sampler.ravel()
+        uv["ut"] = _ut_seconds(t)
+        uv["delay"] = rng.uniform(0.0, 4000.0, size=nant)
+        amp = rng.uniform(10.0, 100.0, size=(len(ij), NPOL, nf))
+        phase = rng.uniform(-np.pi, np.pi, size=(len(ij), NPOL, nf))
+        vis = (amp * np.exp(1j * phase)).astype(np.complex64)
+        # Autocorrelations are real in XX and YY
+        vis[auto, :2] = amp[auto, :2] * 20
+        mask = np.zeros(nf, dtype=bool)
+        for n, (i, j) in enumerate(ij):
+            for k in range(NPOL):
+                uv["pol"] = -5 - k
+                uv.write((uvw[n], t, (i, j)), np.ma.array(vis[n, k], mask=mask))
+                nrec += 1
+    del uv
+    return nrec
+
+
+def write_idb_files(outdir: str, nfiles: int = 2, duration: float = 60.0, cadence: float = 1.0,
+                    nbands: int = 52, start: Optional[str] = None, seed: int = 0) -> Tuple[List[str], int]:
+    """Write consecutive synthetic IDB files, named as on the archive.
+
+    :param outdir: Directory for the files, which is created if needed.  Files
+        of the same names in it are replaced.
+    :param nfiles: Number of files.
+    :param duration: Length of each file, in seconds.
+    :param cadence: Time between records, in seconds (1 or 0.02 for real data).
+    :param nbands: 34 or 52, the frequency plan.
+    :param start: Start time (ISO string).  Default is a time in the era of the
+        frequency plan.
+    :param seed: Seed of the random visibilities of the first file.
+    :returns: (file names, total number of visibility records).
+    """
+    os.makedirs(outdir, exist_ok=True)
+    t0 = Time(start or T_START[nbands]).jd
+    ntimes = int(round(duration / cadence))
+    files = []
+    nrec = 0
+    for n in range(nfiles):
+        tfile = t0 + n * ntimes * cadence / 86400.0
+        name = os.path.join(outdir, "IDB" + _stamp(tfile))
+        if os.path.exists(name):
+            shutil.rmtree(name)
+        times = tfile + np.arange(ntimes) * cadence / 86400.0
+        nrec += write_idb(name, times, nbands=nbands, seed=seed + n)
+        files.append(name)
+    return files, nrec
+
+
+def azeldict(times: Sequence[float], nant: int = NANT, seed: int = 0) -> Dict[str, object]:
+    """Return a stand-in for ``pipeline_cal.get_sql_info()`` at the given Julian
+    dates, with all antennas tracking.
+    """
+    rng = np.random.default_rng(seed)
+    nt = len(times)
+    return {
+        "ParallacticAngle": rng.uniform(-90.0, 90.0, size=(nt, nant)),
+        "TrackFlag": np.ones((nt, nant), dtype=bool),
+        "ActualAzimuth": rng.uniform(90.0, 270.0, size=(nt, nant)),
+        "Time": Time(np.asarray(times), format="jd"),
+    }
+
+
+def xyphase_cal(fghz: np.ndarray, nant: int = NANT, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return a stand-in X-Y phase calibration (frequencies, X-Y phases (nant, nf)
+    and Xi_Rot (nf)) on the frequencies fghz, as read by ``read_idb._xyphase_cal``.
+    """
+    rng = np.random.default_rng(seed)
+    nf = len(fghz)
+    return np.asarray(fghz), rng.uniform(-np.pi, np.pi, size=(nant, nf)), rng.uniform(-np.pi, np.pi, size=nf)
@@ -0,0 +1,166 @@
+"""Regression tests for the tabulated saturation correction in desat.py.
+
+The reference functions below are the loop-based corrections that were used
+by ``read_idb.autocorr_desat`` and ``udb_util.autocorr_desat`` before the
+tables were introduced.
+"""
+
+from __future__ import annotations
+
+import copy
+import unittest
+
+import numpy as np
+from scipy.special import erf
+
+from eovsapy import desat, read_idb, udb_util
+from eovsapy.util import Time, bl2ord
+
+# Corrected amplitudes must agree with the reference to this relative tolerance
+RTOL = 2.0e-5
+NANT = 16
+NF = 5
+NT = 3
+
+
+def _eta_f(x, A):
+    a, b, c, d = desat.EQ8_PARAMS
+    eta = (x + d - c) / (a * erf((x - c) / b) + d)
+    eta[np.where(A < 50)] = 1.0
+    return eta
+
+
+def _eta_2(x, A):
+    a1, b1, c1, d1 = desat.EQ2_HI_PARAMS
+    a2, b2, c2, d2 = desat.EQ2_LO_PARAMS
+    hi = np.where(A > 300)
+    low = np.where(A <= 300)
+    eta = np.ones_like(x)
+    eta[hi] = (x[hi] + d1 - c1) / (a1 * erf((x[hi] - c1) / b1) + d1)
+    eta[low] = (x[low] + d2 - c2) / (a2 * erf((x[low] - c2) / b2) + d2)
+    return eta
+
+
+def _reference_read_idb(out):
+    mjd = Time(out["time"][0], format="jd").mjd
+    m0 = 745472.0 if mjd > 58536 else 721536.0
+    eta_fn = _eta_f if mjd < 59350 else _eta_2
+    eta_x = eta_fn(np.log10(out["p"][:, 0] * m0 / out["m"][:, 0]), abs(out["a"][:, 0]))
+    eta_y = eta_fn(np.log10(out["p"][:, 1] * m0 / out["m"][:, 0]), abs(out["a"][:, 1]))
+    eta = np.zeros_like(out["x"])
+    for i in range(NANT - 1):
+        for j in range(i + 1, NANT):
+            eta[bl2ord[i, j], 0] = eta_x[i] + eta_x[j]
+            eta[bl2ord[i, j], 1] = eta_y[i] + eta_y[j]
+            eta[bl2ord[i, j], 2] = eta_x[i] + eta_y[j]
+            eta[bl2ord[i, j], 3] = eta_x[j] + eta_y[i]
+    eta = eta / 2.0
+    out["x"] = abs(out["x"]) ** eta * np.exp(1j * np.angle(out["x"]))
+    for i in range(NANT):
+        eta[i, 0] = eta_x[i]
+        eta[i, 1] = eta_y[i]
+        eta[i, 2] = (eta_x[i] + eta_y[i]) / 2.0
+        eta[i, 3] = (eta_x[i] + eta_y[i]) / 2.0
+    out["a"] = abs(out["a"]) ** eta[:NANT] * np.exp(1j * np.angle(out["a"]))
+    return out
+
+
+def _reference_udb(out):
+    mjd = Time(out["time"][0], format="jd").mjd
+    m0 = 745472.0 if mjd > 58536 else 721536.0
+    eta_fn = _eta_f if mjd < 59350 else _eta_2
+    px = out["px"].reshape(NF, NANT, 3, NT)
+    py = out["py"].reshape(NF, NANT, 3, NT)
+    eta_x = eta_fn(np.log10(px[:, :, 0] * m0 / px[:, :, 2]), abs(out["x"][:, 120:136, 0]))
+    eta_y = eta_fn(np.log10(py[:, :, 0] * m0 / py[:, :, 2]), abs(out["x"][:, 120:136, 1]))
+    eta = np.zeros_like(out["x"])
+    for i in range(NANT):
+        for j in range(i, NANT):
+            eta[:, bl2ord[i, j], 0] = eta_x[:, i] + eta_x[:, j]
+            eta[:, bl2ord[i, j], 1] = eta_y[:, i] + eta_y[:, j]
+            eta[:, bl2ord[i, j], 2] = eta_x[:, i] + eta_y[:, j]
+            eta[:, bl2ord[i, j], 3] = eta_x[:, j] + eta_y[:, i]
+    eta = eta / 2.0
+    out["x"] = abs(out["x"]) ** eta * np.exp(1j * np.angle(out["x"]))
+    return out
+
+
+def _complex(rng, shape):
+    amp = 10 ** rng.uniform(0.5, 4.5, shape)
+    return (amp * np.exp(1j * rng.uniform(-np.pi, np.pi, shape))).astype(np.complex64)
+
+
+def _read_idb_out(rng, jd):
+    """Synthetic readXdata() dictionary with saturated and unsaturated powers."""
+    m = np.full((NANT, 2, NF, NT), 745472, dtype=np.int64)
+    m[0, 0, 0, 0] = 372736
+    out = {
+        "time": np.full(NT, jd),
+        "fghz": np.linspace(2.0, 4.0, NF),
+        "p": 10 ** rng.uniform(1.0, 7.0, (NANT, 2, NF, NT)),
+        "m": m,
+        "a": _complex(rng, (NANT, 4, NF, NT)),
+        "x": _complex(rng, (120, 4, NF, NT)),
+    }
+    out["a"][2, 0, 1, 1] = 0
+    out["x"][5, 1, 2, 0] = np.nan
+    return out
+
+
+def _udb_out(rng, jd):
+    """Synthetic udb_util.readXdata() dictionary."""
+    px = 10 ** rng.uniform(1.0, 7.0, (NF, NANT, 3, NT))
+    px[:, :, 2] = 745472
+    py = 10 ** rng.uniform(1.0, 7.0, (NF, NANT, 3, NT))
+    py[:, :, 2] = 745472
+    return {
+        "time": np.full(NT, jd),
+        "fghz": np.linspace(2.0, 4.0, NF),
+        "pol": np.array([-5, -6, -7, -8]),
+        "px": px.reshape(NF * NANT * 3, NT),
+        "py": py.reshape(NF * NANT * 3, NT),
+        "x": _complex(rng, (NF, 136, 4, NT)),
+    }
+
+
+class EtaTableTests(unittest.TestCase):
+    """The tables must reproduce the exact curves within their tolerance."""
+
+    def test_tables_are_within_tolerance(self):
+        x = np.concatenate([np.linspace(-5.0, 12.0, 100001), [np.inf, -np.inf, np.nan]])
+        for name, params in [("eq8", desat.EQ8_PARAMS), ("eq2_hi", desat.EQ2_HI_PARAMS), ("eq2_lo", desat.EQ2_LO_PARAMS)]:
+            table = desat.eta_tables()[name]
+            self.assertLessEqual(table.max_error, desat.TABLE_TOLERANCE)
+            np.testing.assert_allclose(table(x), desat.eta_exact(x, params), rtol=0, atol=desat.TABLE_TOLERANCE)
+
+
+class AutocorrDesatRegressionTests(unittest.TestCase):
+    """Compare both autocorr_desat() routines with the loop-based originals."""
+
+    def _check(self, new, ref):
+        np.testing.assert_array_equal(np.isnan(new), np.isnan(ref))
+        ok = ~np.isnan(ref)
+        np.testing.assert_allclose(np.abs(new[ok]), np.abs(ref[ok]), rtol=RTOL)
+        np.testing.assert_allclose(new[ok], ref[ok], rtol=RTOL)
+
+    def test_read_idb_matches_reference(self):
+        rng = np.random.default_rng(1)
+        # Before and after the 2021-05-16 equalizer change
+        for jd in (2459000.5, 2460000.5):
+            out = _read_idb_out(rng, jd)
+            ref = _reference_read_idb(copy.deepcopy(out))
+            new = read_idb.autocorr_desat(out)
+            self._check(new["x"], ref["x"])
+            self._check(new["a"], ref["a"])
+
+    def test_udb_util_matches_reference(self):
+        rng = np.random.default_rng(2)
+        for jd in (2459000.5, 2460000.5):
+            out = _udb_out(rng, jd)
+            ref = _reference_udb(copy.deepcopy(out))
+            new = udb_util.autocorr_desat(out)
+            self._check(new["x"], ref["x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
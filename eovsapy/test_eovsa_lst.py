@@ -0,0 +1,30 @@
+"""Tests for the interpolated LST in eovsa_lst.py."""
+
+from __future__ import annotations
+
+import unittest
+
+import numpy as np
+
+from eovsapy import eovsa_lst
+from eovsapy.util import Time
+
+
+class EovsaLstArrayTests(unittest.TestCase):
+    def test_matches_exact_lst(self):
+        jd = 2460000.5 + np.sort(np.random.default_rng(3).uniform(0.0, 2.0, 50))
+        exact = np.array([eovsa_lst.eovsa_lst(t) for t in Time(jd, format="jd")])
+        diff = np.angle(np.exp(1j * (eovsa_lst.eovsa_lst_array(jd) - exact)))
+        # Within the ~1e-8 rad that the reference loses by rounding jd through Time()
+        self.assertLess(np.max(np.abs(diff)), 5e-8)
+
+    def test_result_does_not_depend_on_other_times(self):
+        jd = 2460000.5 + np.arange(100) / 86400.0
+        whole = eovsa_lst.eovsa_lst_array(jd)
+        parts = np.concatenate([eovsa_lst.eovsa_lst_array(jd[:37]), eovsa_lst.eovsa_lst_array(jd[37:])])
+        np.testing.assert_array_equal(parts, whole)
+        self.assertEqual(eovsa_lst.eovsa_lst_array([]).shape, (0,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Tests for the persistent directory index in file_index.py."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from eovsapy import file_index
+from eovsapy.util import Time, fname2mjd
+
+
+def _touch_dataset(directory, name):
+    """Create an empty stand-in for a Miriad dataset."""
+    os.mkdir(os.path.join(directory, name))
+    with open(os.path.join(directory, name, "visdata"), "wb") as handle:
+        handle.write(b"\0" * 16)
+
+
+class FileIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tmpdir, "IDB")
+        self.indexdir = os.path.join(self.tmpdir, "index")
+        os.mkdir(self.datadir)
+        self.names = ["IDB20230224%02d%02d00" % (h, m) for h in (23,) for m in range(0, 60, 10)]
+        self.names += ["IDB20230225000000", "UDB20230224000000"]
+        for name in self.names:
+            _touch_dataset(self.datadir, name)
+        open(os.path.join(self.datadir, "README"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _index(self):
+        return file_index.FileIndex(self.datadir, index_dir=self.indexdir, scan_types=False)
+
+    def test_filename_mjd_matches_fname2mjd(self):
+        for name in ("IDB20230224231000", "UDB20170101000001", "IDB20250522123456"):
+            self.assertAlmostEqual(file_index.filename_mjd("/data/" + name), fname2mjd(name), places=9)
+
+    def test_lookup_matches_name_filter(self):
+        trange = Time(["2023-02-24 23:15", "2023-02-25 00:00"])
+        files = self._index().find_files(trange[0].mjd, trange[1].mjd)
+        expected = sorted(
+            os.path.join(self.datadir, name)
+            for name in self.names
+            if name.startswith("IDB") and trange[0].mjd <= fname2mjd(name) < trange[1].mjd
+        )
+        self.assertEqual(files, expected)
+        self.assertEqual(len(files), 4)
+
+    def test_end_is_next_start(self):
+        entries = self._index().lookup(0, 1e6)
+        self.assertEqual(entries["end"][0], entries["start"][1])
+        self.assertAlmostEqual((entries["end"][-1] - entries["start"][-1]) * 86400.0, 600.0, places=3)
+
+    def test_saved_index_is_reused_and_updated_incrementally(self):
+        self._index().refresh()
+        with mock.patch.object(file_index.os, "listdir", side_effect=AssertionError("rescanned")):
+            self.assertEqual(len(self._index().lookup(0, 1e6)), len(self.names) - 1)
+
+        _touch_dataset(self.datadir, "IDB20230225001000")
+        shutil.rmtree(os.path.join(self.datadir, "IDB20230224230000"))
+        # Make sure the directory mtime differs even on coarse-grained filesystems
+        os.utime(self.datadir, ns=(0, os.stat(self.datadir).st_mtime_ns + 10**9))
+        index = self._index()
+        with mock.patch.object(file_index, "filename_mjd", wraps=file_index.filename_mjd) as parse:
+            names = list(index.lookup(0, 1e6)["name"])
+        self.assertEqual(parse.call_count, 1)
+        self.assertIn("IDB20230225001000", names)
+        self.assertNotIn("IDB20230224230000", names)
+
+    def test_only_the_dates_looked_up_are_examined(self):
+        index = self._index()
+        day = file_index.filename_mjd("IDB20230225000000")
+        with mock.patch.object(file_index, "_dataset_stat", wraps=file_index._dataset_stat) as stat:
+            names = list(index.lookup(day, day + 1)["name"])
+        self.assertEqual(names, ["IDB20230225000000"])
+        # Listed once, and checked again by the lookup
+        self.assertEqual([os.path.basename(c.args[0]) for c in stat.call_args_list], names * 2)
+        self.assertEqual(index.covered, [[int(day), int(day) + 1]])
+
+        # The other date is listed when it is looked up, and the first is not examined again
+        with mock.patch.object(file_index, "_dataset_stat", wraps=file_index._dataset_stat) as stat:
+            self.assertEqual(len(index.lookup(day - 1, day + 1)), 7)
+        # The 7 new files of 2023-02-24 (one is a UDB file), then the 7 IDB files returned
+        self.assertEqual(stat.call_count, 7 + 7)
+        self.assertEqual(index.covered, [[int(day) - 1, int(day) + 1]])
+
+    def test_scan_type_is_read_for_looked_up_files_that_changed(self):
+        index = file_index.FileIndex(self.datadir, index_dir=self.indexdir, scan_types=True)
+        day = file_index.filename_mjd("IDB20230225000000")
+        with mock.patch.object(file_index, "_scan_type", return_value="") as scan:
+            index.lookup(day - 1, day)
+            self.assertEqual(scan.call_count, 6)
+            index.lookup(day - 1, day + 1)
+            self.assertEqual(scan.call_count, 7)
+
+        # A file that was still being written is read again once it has grown
+        path = os.path.join(self.datadir, "IDB20230225000000")
+        with open(os.path.join(path, "visdata"), "ab") as handle:
+            handle.write(b"\0" * 16)
+        os.utime(os.path.join(path, "visdata"), ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        with mock.patch.object(file_index, "_scan_type", return_value="PHASECAL") as scan:
+            entries = file_index.FileIndex(self.datadir, index_dir=self.indexdir).lookup(day - 1, day + 1, scan_types=True)
+        self.assertEqual(scan.call_count, 1)
+        self.assertEqual(list(entries["scantype"]), [""] * 6 + ["PHASECAL"])
+        self.assertEqual(entries["size"][-1], 32)
+
+    def test_only_files_that_may_change_are_checked(self):
+        # Files last modified two hours ago, which are complete
+        old = os.stat(self.datadir).st_mtime_ns - 7200 * 10**9
+        for name in self.names:
+            os.utime(os.path.join(self.datadir, name, "visdata"), ns=(old, old))
+            os.utime(os.path.join(self.datadir, name), ns=(old, old))
+        self._index().refresh()
+        index = self._index()
+        with mock.patch.object(file_index, "_dataset_stat", wraps=file_index._dataset_stat) as stat, \
+                mock.patch.object(file_index, "_scan_type") as scan:
+            files = index.find_files(0, 1e6)
+        # Only the newest IDB file is checked, and no scan type is read
+        self.assertEqual(len(files), 7)
+        self.assertEqual([os.path.basename(c.args[0]) for c in stat.call_args_list], ["IDB20230225000000"])
+        scan.assert_not_called()
+
+        # A file that grows is updated in memory without saving the index
+        with open(os.path.join(self.datadir, "IDB20230225000000", "visdata"), "ab") as handle:
+            handle.write(b"\0" * 16)
+        with mock.patch.object(index, "_save") as save:
+            self.assertEqual(index.lookup(0, 1e6)["size"][-1], 32)
+        save.assert_not_called()
+
+    def test_missing_directory_has_no_files(self):
+        self.assertEqual(file_index.find_files(os.path.join(self.tmpdir, "nope"), 0, 1e6), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Tests for the on-disk cache of decoded IDB/UDB files."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import numpy.ma as ma
+
+from eovsapy import idb_cache, read_idb
+from eovsapy.test_read_idb import DT, T0, _write_idb
+
+
+def _write_dataset(path, nbytes=16):
+    """Create a fake Miriad dataset directory of a given visdata size."""
+    os.makedirs(path, exist_ok=True)
+    for item in ("header", "vartable", "flags"):
+        with open(os.path.join(path, item), "wb") as handle:
+            handle.write(b"x")
+    with open(os.path.join(path, "visdata"), "wb") as handle:
+        handle.write(b"\0" * nbytes)
+
+
+class IDBCacheTests(unittest.TestCase):
+    """Validate storage, invalidation and eviction."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "cache")
+        self.source = os.path.join(self.tmpdir, "IDB20230224000000")
+        _write_dataset(self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip_is_memory_mapped(self):
+        cache = idb_cache.IDBCache(self.root)
+        out = {
+            "x": np.arange(6, dtype=np.complex64).reshape(2, 3),
+            "m": ma.masked_array(np.arange(4.0), mask=[0, 1, 0, 0]),
+            "source": "Sun",
+            "ra": np.float64(1.5),
+            "a": None,
+        }
+        self.assertTrue(cache.store(self.source, "reader", {"nmax": 600}, out))
+        loaded = cache.load(self.source, "reader", {"nmax": 600})
+
+        self.assertIsInstance(loaded["x"], np.memmap)
+        np.testing.assert_array_equal(loaded["x"], out["x"])
+        np.testing.assert_array_equal(ma.getmaskarray(loaded["m"]), [False, True, False, False])
+        self.assertEqual(loaded["source"], "Sun")
+        self.assertEqual(loaded["ra"], 1.5)
+        self.assertIsNone(loaded["a"])
+        self.assertIsNone(cache.load(self.source, "reader", {"nmax": 30000}))
+
+    def test_changed_source_is_a_miss(self):
+        cache = idb_cache.IDBCache(self.root)
+        cache.store(self.source, "reader", {}, {"time": np.zeros(3)})
+        _write_dataset(self.source, nbytes=32)
+
+        self.assertIsNone(cache.load(self.source, "reader", {}))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = idb_cache.IDBCache(self.root, max_bytes=2 * 800)
+        for n in range(2):
+            cache.store(self.source, "reader", {"n": n}, {"time": np.zeros(100)})
+            # Age the entries so that their order of use is unambiguous
+            meta = os.path.join(self.root, cache.entry_key(self.source, "reader", {"n": n}), "meta.json")
+            os.utime(meta, (1000.0 + n, 1000.0 + n))
+        # Using entry 0 makes entry 1 the least recently used
+        self.assertIsNotNone(cache.load(self.source, "reader", {"n": 0}))
+        cache.store(self.source, "reader", {"n": 2}, {"time": np.zeros(100)})
+
+        self.assertEqual(len(cache.entries()), 2)
+        self.assertIsNone(cache.load(self.source, "reader", {"n": 1}))
+        self.assertIsNotNone(cache.load(self.source, "reader", {"n": 0}))
+
+    def test_read_idb_hit_skips_aipy(self):
+        path = os.path.join(self.tmpdir, "IDB20230224001000")
+        _write_idb(path, [T0, T0 + DT])
+        with mock.patch.dict(os.environ, {"EOVSA_IDB_CACHE": self.root}):
+            first = read_idb.readXdata(path)
+            with mock.patch.object(read_idb.aipy.miriad, "UV", side_effect=AssertionError("aipy called")):
+                second = read_idb.readXdata(path)
+                mismatch = read_idb.readXdata(path, src="Moon")
+
+        np.testing.assert_array_equal(second["x"], first["x"])
+        np.testing.assert_array_equal(second["p"], first["p"])
+        self.assertEqual(second["source"], "Sun")
+        self.assertEqual(mismatch, "Sun")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Tests for the pickle-free output dictionary format in idb_store.py."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import numpy.ma as ma
+
+from eovsapy import idb_store, read_idb
+
+
+def _sample_out(nt=3, t0=0.0):
+    rng = np.random.default_rng(int(t0))
+    return {
+        "a": (rng.normal(size=(16, 4, 5, nt)) + 1j).astype(np.complex64),
+        "x": ma.masked_invalid(np.where(rng.random((120, 4, 5, nt)) > 0.9, np.nan, 1.0 + 2j).astype(np.complex64)),
+        "p": rng.random((16, 2, 5, nt)),
+        "p2": rng.random((16, 2, 5, nt)),
+        "m": np.ones((16, 2, 5, nt), dtype=np.int64),
+        "uvw": np.asfortranarray(rng.random((120, nt, 3))),
+        "time": t0 + np.arange(nt, dtype=float),
+        "ha": np.zeros(nt),
+        "fghz": np.linspace(1.0, 2.0, 5),
+        "band": np.arange(5),
+        "source": "Sun",
+        "ra": np.float64(1.5),
+        "dec": 0.25,
+        "empty": np.zeros((0, 4)),
+    }
+
+
+class IDBStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "out.idbz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _assert_same(self, loaded, out):
+        self.assertEqual(set(loaded), set(out))
+        for key, value in out.items():
+            if isinstance(value, np.ndarray):
+                self.assertEqual(loaded[key].dtype, value.dtype, key)
+                np.testing.assert_array_equal(ma.getdata(loaded[key]), ma.getdata(value))
+                self.assertEqual(isinstance(loaded[key], ma.MaskedArray), isinstance(value, ma.MaskedArray))
+            else:
+                self.assertEqual(loaded[key], value)
+        np.testing.assert_array_equal(ma.getmaskarray(loaded["x"]), ma.getmaskarray(out["x"]))
+
+    def test_round_trip_in_memory_and_mapped(self):
+        out = _sample_out()
+        idb_store.save(self.path, out)
+
+        self.assertTrue(idb_store.is_store(self.path))
+        self._assert_same(idb_store.load(self.path), out)
+        mapped = idb_store.load(self.path, mmap_mode="r")
+        self._assert_same(mapped, out)
+        self.assertIsInstance(mapped["p"], np.memmap)
+
+    def test_keys_are_read_lazily(self):
+        idb_store.save(self.path, _sample_out())
+        store = idb_store.IDBStore(self.path)
+        with mock.patch.object(store, "_read", wraps=store._read) as read:
+            self.assertEqual(store["source"], "Sun")
+            np.testing.assert_array_equal(store["time"], [0.0, 1.0, 2.0])
+        self.assertEqual([call.args[0] for call in read.call_args_list], ["time.npy"])
+
+    def test_object_arrays_are_refused(self):
+        with self.assertRaises(TypeError):
+            idb_store.save(self.path, {"bad": np.array([{}, None], dtype=object)})
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_convert_npz_and_read_npz(self):
+        npz = []
+        for n in range(2):
+            npz.append(os.path.join(self.tmpdir, "out%d.npz" % n))
+            np.savez_compressed(npz[-1], out=_sample_out(t0=3.0 * n))
+        converted = idb_store.convert_npz_files(npz)
+
+        self.assertEqual(converted[0], os.path.join(self.tmpdir, "out0.idbz"))
+        legacy = read_idb.read_npz(npz)
+        new = read_idb.read_npz(converted)
+        np.testing.assert_array_equal(new["time"], np.arange(6.0))
+        for key in ("a", "x", "p", "p2", "m", "uvw", "time", "ha", "fghz"):
+            np.testing.assert_array_equal(new[key], legacy[key])
+        self.assertEqual(new["source"], legacy["source"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Parity tests of the numpy Miriad reader in miriad_native.py against aipy."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import aipy
+import numpy as np
+
+from eovsapy import miriad_native
+
+NANT = 5
+NF = 7
+
+
+def _write_uv(path, ntimes=6, seed=0):
+    """Write a Miriad file with flags, irregular record layouts and a text
+    variable that changes length part way through.
+    """
+    rng = np.random.default_rng(seed)
+    uv = aipy.miriad.UV(path, "new")
+    for name, vtype in [("source", "a"), ("nchan", "i"), ("sfreq", "d"), ("xsampler", "r"), ("pol", "i")]:
+        uv.add_var(name, vtype)
+    uv["nchan"] = NF
+    uv["sfreq"] = np.linspace(1.0, 2.0, NF)
+    for n in range(ntimes):
+        uv["source"] = "Sun" if n < 3 else "Cygnus A"
+        uv["xsampler"] = rng.random(3 * NF).astype(np.float32)
+        t = 2460000.5 + n / 86400.0
+        for i in range(NANT):
+            for j in range(i, NANT):
+                # Skip some baselines at some times, so the layout is not regular
+                if (i + j + n) % 7 == 3:
+                    continue
+                for pol in (-5, -6, -7, -8):
+                    uv["pol"] = pol
+                    data = (rng.normal(size=NF) + 1j * rng.normal(size=NF)).astype(np.complex64)
+                    mask = rng.random(NF) < 0.2
+                    uvw = np.array([1.0, -2.0, 0.5]) * (j - i) * (n + 1)
+                    uv.write((uvw, t, (i, j)), np.ma.array(data, mask=mask))
+    del uv
+
+
+def _aipy_records(path, names=("pol", "source", "xsampler")):
+    uv = aipy.miriad.UV(path)
+    recs = {"uvw": [], "t": [], "i": [], "j": [], "data": [], "flags": []}
+    recs.update({name: [] for name in names})
+    while True:
+        preamble, data, flags, nread = uv.raw_read(uv.nchan)
+        if nread == 0:
+            break
+        uvw, t, (i, j) = preamble
+        for key, value in zip(("uvw", "t", "i", "j", "data", "flags"), (uvw, t, i, j, data, flags)):
+            recs[key].append(np.copy(value))
+        for name in names:
+            recs[name].append(np.copy(uv[name]))
+    return recs
+
+
+class MiriadFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "IDB20230224000000")
+        _write_uv(self.path)
+        self.ref = _aipy_records(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_records_match_aipy(self):
+        with miriad_native.MiriadFile(self.path) as mf:
+            self.assertEqual(mf.nrec, len(self.ref["t"]))
+            uvw, t, i, j = mf.preamble()
+            np.testing.assert_array_equal(uvw, self.ref["uvw"])
+            np.testing.assert_array_equal(t, self.ref["t"])
+            np.testing.assert_array_equal(i, self.ref["i"])
+            np.testing.assert_array_equal(j, self.ref["j"])
+            np.testing.assert_array_equal(mf.values("pol"), self.ref["pol"])
+            np.testing.assert_array_equal(mf.values("xsampler"), self.ref["xsampler"])
+            np.testing.assert_array_equal(mf.data(), self.ref["data"])
+            np.testing.assert_array_equal(mf.flags(), np.array(self.ref["flags"]).astype(bool))
+            self.assertEqual(mf.vartable["corr"], "r")
+            self.assertEqual(mf["source"], "Sun\x00")
+            np.testing.assert_array_equal(mf["sfreq"], np.linspace(1.0, 2.0, NF))
+            # The text variable changes length within the file
+            recs, values = mf.updates("source")
+            self.assertEqual([mf._value("source", v) for v in values], ["Sun\x00", "Cygnus A\x00"])
+
+    def test_record_count_from_the_header(self):
+        self.assertEqual(miriad_native.record_count(self.path), len(self.ref["t"]))
+
+    def test_subsets_of_records(self):
+        with miriad_native.MiriadFile(self.path) as mf:
+            for records in (np.arange(3, 40), np.arange(1, mf.nrec, 5), np.array([0, mf.nrec - 1])):
+                np.testing.assert_array_equal(mf.data(records), np.array(self.ref["data"])[records])
+                np.testing.assert_array_equal(mf.flags(records), np.array(self.ref["flags"]).astype(bool)[records])
+            with self.assertRaises(ValueError):
+                mf.data([5, 4])
+
+    def test_truncated_stream_stops_at_last_full_record(self):
+        vis = os.path.join(self.path, "visdata")
+        with open(vis, "r+b") as handle:
+            handle.truncate(os.path.getsize(vis) - 20)
+        with miriad_native.MiriadFile(self.path) as mf:
+            self.assertEqual(mf.nrec, len(self.ref["t"]) - 1)
+            np.testing.assert_array_equal(mf.data(), self.ref["data"][:-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests for the read-ahead of file lists in prefetch.py."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from eovsapy import prefetch
+
+NFILE = 5
+SIZE = 3000
+
+
+class PrefetcherTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for n in range(NFILE):
+            # Miriad datasets are directories of several files
+            name = os.path.join(self.tmpdir, "IDB%02d" % n)
+            os.mkdir(name)
+            for part in ("header", "visdata"):
+                with open(os.path.join(name, part), "wb") as handle:
+                    handle.write(os.urandom(SIZE))
+            self.files.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_files_are_read_ahead_of_a_slow_consumer(self):
+        ahead = prefetch.Prefetcher(self.files, depth=2, block_bytes=1024)
+        seen = []
+        for name in ahead:
+            seen.append(name)
+            time.sleep(0.05)
+
+        self.assertEqual(seen, self.files)
+        # Only the first file can have been requested before it was read ahead
+        self.assertGreaterEqual(ahead.hits, NFILE - 1)
+        self.assertEqual(ahead.hits + ahead.misses, NFILE)
+        self.assertGreaterEqual(ahead.stats()["bytes"], ahead.hits * 2 * SIZE)
+        self.assertFalse(ahead._thread.is_alive())
+
+    def test_read_ahead_stays_within_depth(self):
+        ahead = prefetch.Prefetcher(self.files, depth=1)
+        names = iter(ahead)
+        self.assertEqual(next(names), self.files[0])
+        time.sleep(0.1)
+        ahead.close()
+
+        self.assertFalse(ahead._thread.is_alive())
+        self.assertLessEqual(ahead.bytes_read, 2 * 2 * SIZE)
+        self.assertFalse(any(ahead._done[2:]))
+
+    def test_missing_files_and_no_depth(self):
+        files = self.files[:1] + [os.path.join(self.tmpdir, "missing")] + self.files[1:2]
+        self.assertEqual(list(prefetch.Prefetcher(files, depth=None)), files)
+        ahead = prefetch.Prefetcher(files, depth=3)
+        self.assertEqual(list(ahead), files)
+        self.assertFalse(ahead._done[1])
+        self.assertEqual(ahead.hits + ahead.misses, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
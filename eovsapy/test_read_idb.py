@@ -0,0 +1,521 @@
+"""Tests for the IDB reader in read_idb.py, using small synthetic Miriad files."""
+
+from __future__ import annotations
+
+import copy
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import aipy
+import numpy as np
+
+from eovsapy import read_idb, read_profile
+from eovsapy.util import Time, bl2ord, common_val_idx, lobe, nearest_val_idx
+
+NANT = 16
+NF = 6
+T0 = 2460000.5
+DT = 1.0 / 86400.0
+
+
+def _vis_value(t, i, j, k):
+    """Deterministic visibility spectrum for one record."""
+    return ((t - T0) * 86400.0 + 1000 * i + 100 * j + 10 * k + np.arange(NF) * 1j).astype(np.complex64)
+
+
+def _write_idb(path, times, flagged=None, antlist=None):
+    """Write a minimal 16-antenna IDB-like Miriad file with one record per
+    baseline and polarization for each entry of ``times``.
+
+    ``flagged`` is an optional set of (time index, i, j, k) records whose
+    first channel is written as flagged.  ``antlist`` is the list of antenna
+    numbers written to the file, by default 1 to 16.
+    """
+    flagged = flagged or set()
+    uv = aipy.miriad.UV(path, "new")
+    for name, vtype in [
+        ("source", "a"), ("antlist", "a"), ("nants", "i"), ("npol", "i"), ("nchan", "i"),
+        ("sfreq", "d"), ("ra", "d"), ("dec", "d"), ("ut", "d"),
+        ("xsampler", "r"), ("ysampler", "r"), ("pol", "i"),
+    ]:
+        uv.add_var(name, vtype)
+    uv["source"] = "Sun"
+    uv["antlist"] = " ".join(str(a) for a in (antlist or range(1, NANT + 1)))
+    uv["nants"] = NANT
+    uv["npol"] = 4
+    uv["nchan"] = NF
+    uv["sfreq"] = np.linspace(2.0, 4.0, NF)
+    uv["ra"] = 1.0
+    uv["dec"] = 0.2
+    for n, t in enumerate(times):
+        uv["ut"] = (t % 1) * 86400.0
+        power = np.ones((NF, NANT, 3), dtype=np.float32) * (n + 1)
+        power[:, :, 2] = 745472.0
+        uv["xsampler"] = power.ravel()
+        uv["ysampler"] = (2 * power).ravel()
+        for i in range(NANT):
+            for j in range(i, NANT):
+                for k in range(4):
+                    uv["pol"] = -5 - k
+                    mask = np.zeros(NF, dtype=bool)
+                    mask[0] = (n, i, j, k) in flagged
+                    uvw = np.array([1.0, 2.0, 3.0]) * (j - i)
+                    uv.write((uvw, t, (i, j)), np.ma.array(_vis_value(t, i, j, k), mask=mask))
+    del uv
+
+
+class ReadXdataTests(unittest.TestCase):
+    """Validate the block decoder against the record-by-record contract."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "IDB20230224000000")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scatter_matches_written_records(self):
+        times = [T0 + n * DT for n in range(4)]
+        _write_idb(self.path, times, flagged={(2, 3, 7, 1), (1, 5, 5, 0)})
+        out = read_idb.readXdata(self.path)
+
+        self.assertEqual(out["x"].shape, (120, 4, NF, 4))
+        self.assertEqual(out["a"].shape, (NANT, 4, NF, 4))
+        self.assertEqual(out["x"].dtype, np.complex64)
+        np.testing.assert_array_equal(out["time"], times)
+        np.testing.assert_array_equal(out["x"][bl2ord[2, 9], 3, :, 1], _vis_value(times[1], 2, 9, 3))
+        np.testing.assert_array_equal(out["a"][4, 2, :, 3], _vis_value(times[3], 4, 4, 2))
+        np.testing.assert_array_equal(out["uvw"][bl2ord[0, 15], 2], [15.0, 30.0, 45.0])
+        self.assertTrue(np.isnan(out["x"][bl2ord[3, 7], 1, 0, 2]))
+        self.assertTrue(np.isnan(out["a"][5, 0, 0, 1]))
+        self.assertFalse(np.isnan(out["x"][bl2ord[3, 7], 1, 1, 2]))
+        np.testing.assert_array_equal(out["p"][:, 0, :, 2], 3.0)
+        np.testing.assert_array_equal(out["p"][:, 1, :, 2], 6.0)
+        np.testing.assert_array_equal(out["m"][:, 0, :, 0], 745472)
+
+    def test_zero_filled_and_backward_times_are_skipped(self):
+        times = [T0, T0 + DT, 2440587.5, T0 + 0.5 * DT, T0 + 2 * DT]
+        _write_idb(self.path, times)
+        out = read_idb.readXdata(self.path)
+
+        np.testing.assert_array_equal(out["time"], [T0, T0 + DT, T0 + 2 * DT])
+        np.testing.assert_array_equal(out["x"][bl2ord[0, 1], 0, :, 2], _vis_value(times[4], 0, 1, 0))
+        np.testing.assert_array_equal(out["p"][:, 0, :, 2], 5.0)
+
+    def test_blocks_keep_the_snapshots_of_few_times(self):
+        times = [T0 + n * DT for n in range(10)]
+        _write_idb(self.path, times)
+        uv = aipy.miriad.UV(self.path)
+        # The XX auto-correlations only, so that a block of records would span all times
+        uv.select("auto", 0, 0, include=True)
+        uv.select("polarization", -5, -5, include=True)
+        mf = read_idb.miriad_native.MiriadFile(self.path)
+        records = read_idb._select_records(mf, [("auto", 0, 0), ("polarization", -5, -5)])
+        for blocks in (read_idb._read_blocks(uv, NF, maxtimes=3),
+                       read_idb._native_blocks(mf, NF, records=records, maxtimes=3)):
+            snaps = []
+            for blk, snap in blocks:
+                self.assertLessEqual(len(snap), 3)
+                snaps += [snap[s][0][0] for s in blk["sid"]]
+            # The power of time n is n + 1, in each of its NANT records
+            np.testing.assert_array_equal(snaps, np.repeat(np.arange(1, 11), NANT))
+        mf.close()
+
+    def test_nmax_truncates_times(self):
+        times = [T0 + n * DT for n in range(5)]
+        _write_idb(self.path, times)
+        out = read_idb.readXdata(self.path, nmax=3)
+
+        self.assertEqual(out["x"].shape[-1], 3)
+        np.testing.assert_array_equal(out["time"], times[:3])
+
+    def test_dataset_is_stat_only_while_profiling(self):
+        _write_idb(self.path, [T0, T0 + DT])
+        with mock.patch.object(read_profile, "dataset_bytes", return_value=0) as sizes:
+            read_idb.readXdata(self.path)
+            sizes.assert_not_called()
+            with read_profile.ReadProfile():
+                read_idb.readXdata(self.path)
+            sizes.assert_called_once_with(self.path)
+
+    def test_tp_only_skips_correlations(self):
+        _write_idb(self.path, [T0, T0 + DT])
+        out = read_idb.readXdata(self.path, tp_only=True)
+
+        self.assertIsNone(out["a"])
+        self.assertIsNone(out["x"])
+        self.assertEqual(out["p"].shape, (NANT, 2, NF, 2))
+
+    def test_selection_matches_slice_of_full_read(self):
+        _write_idb(self.path, [T0 + n * DT for n in range(3)])
+        full = read_idb.readXdata(self.path)
+        out = read_idb.readXdata(self.path, ants="ant2-4", pols=[1, 2], fidx=[0, 4])
+
+        np.testing.assert_array_equal(out["ants"], [1, 2, 3])
+        bls = [bl2ord[1, 2], bl2ord[1, 3], bl2ord[2, 3]]
+        np.testing.assert_array_equal(out["bls"], bls)
+        self.assertEqual(out["x"].shape, (3, 2, 2, 3))
+        np.testing.assert_array_equal(out["x"], full["x"][bls][:, [1, 2]][:, :, [0, 4]])
+        np.testing.assert_array_equal(out["a"], full["a"][1:4][:, [1, 2]][:, :, [0, 4]])
+        np.testing.assert_array_equal(out["uvw"], full["uvw"][bls])
+        np.testing.assert_array_equal(out["p"], full["p"][1:4][:, :, [0, 4]])
+        np.testing.assert_array_equal(out["fghz"], full["fghz"][[0, 4]])
+        self.assertNotIn("ants", full)
+
+    def test_selection_follows_antlist(self):
+        # Miriad antennas 0 and 1 are the second and first in antlist
+        antlist = [2, 1] + list(range(3, NANT + 1))
+        _write_idb(self.path, [T0 + n * DT for n in range(2)], antlist=antlist)
+        full = read_idb.readXdata(self.path)
+        np.testing.assert_array_equal(full["a"][0, 0, :, 0], _vis_value(T0, 1, 1, 0))
+        np.testing.assert_array_equal(full["a"][1, 0, :, 0], _vis_value(T0, 0, 0, 0))
+        np.testing.assert_array_equal(full["x"][bl2ord[0, 2], 0, :, 0], _vis_value(T0, 1, 2, 0))
+
+        for backend in ("aipy", "native"):
+            out = read_idb.readXdata(self.path, ants=[0, 2], backend=backend)
+            np.testing.assert_array_equal(out["a"], full["a"][[0, 2]])
+            np.testing.assert_array_equal(out["x"], full["x"][[bl2ord[0, 2]]])
+            np.testing.assert_array_equal(out["p"], full["p"][[0, 2]])
+
+    def test_compact_precision_holds_the_same_values(self):
+        _write_idb(self.path, [T0 + n * DT for n in range(3)], flagged={(1, 5, 5, 0)})
+        full = read_idb.readXdata(self.path)
+        compact = read_idb.readXdata(self.path, precision="compact")
+        small = read_idb.readXdata(self.path, precision="compact16")
+
+        for out in (compact, small):
+            self.assertEqual(out["p"].dtype, np.float32)
+            self.assertEqual(out["m"].dtype, np.int32)
+            for key in ("p", "p2", "m", "x"):
+                np.testing.assert_array_equal(out[key], full[key])
+        np.testing.assert_array_equal(compact["a"], full["a"])
+        self.assertEqual(small["a"].dtype, np.float16)
+        np.testing.assert_allclose(small["a"], np.abs(full["a"]), rtol=1e-3)
+        self.assertTrue(np.isnan(small["a"][5, 0, 0, 1]))
+        with self.assertRaises(ValueError):
+            read_idb.readXdata(self.path, precision="half")
+
+    def test_native_backend_matches_aipy(self):
+        times = [T0, T0 + DT, 2440587.5, T0 + 2 * DT, T0 + 3 * DT]
+        _write_idb(self.path, times, flagged={(3, 3, 7, 1), (1, 5, 5, 0)})
+        for kwargs in ({}, {"tp_only": True}, {"nmax": 2}, {"ants": "ant2-4", "pols": [1, 2]},
+                       {"bls": [bl2ord[0, 5]], "pols": [0]}):
+            ref = read_idb.readXdata(self.path, **kwargs)
+            out = read_idb.readXdata(self.path, backend="native", **kwargs)
+            self.assertEqual(sorted(out), sorted(ref))
+            for key, value in ref.items():
+                if isinstance(value, np.ndarray):
+                    np.testing.assert_array_equal(out[key], value, err_msg=key)
+                else:
+                    self.assertEqual(out[key], value, key)
+        with mock.patch.dict(os.environ, {"EOVSA_MIRIAD_BACKEND": "fast"}):
+            with self.assertRaises(ValueError):
+                read_idb.readXdata(self.path)
+
+    def test_desat_rejects_partial_selection(self):
+        _write_idb(self.path, [T0])
+        with self.assertRaises(ValueError):
+            read_idb.readXdata(self.path, pols=[0], desat=True)
+
+
+class ReadIdbTests(unittest.TestCase):
+    """Validate multi-file reads, sequential and in worker processes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for n in range(3):
+            path = os.path.join(self.tmpdir, "IDB2023022400%02d00" % n)
+            _write_idb(path, [T0 + (4 * n + m) * DT for m in range(4)])
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parallel_read_matches_sequential(self):
+        serial = read_idb.read_idb(self.files, navg=2)
+        parallel = read_idb.read_idb(self.files, navg=2, workers=2)
+
+        self.assertEqual(serial["time"].shape, (6,))
+        for key in ("x", "a", "p", "p2", "m", "uvw", "time", "ha", "fghz"):
+            np.testing.assert_array_equal(parallel[key], serial[key])
+
+    def test_parallel_read_keeps_few_files_in_flight(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        submitted = []
+        with mock.patch("concurrent.futures.ProcessPoolExecutor", ThreadPoolExecutor), \
+                mock.patch.object(read_idb, "_read_one", side_effect=lambda file, **kw: submitted.append(file) or file):
+            results = read_idb._read_files_parallel(self.files * 4, 2)
+            for n, out in enumerate(results):
+                self.assertEqual(out, self.files[n % 3])
+                # Files decoded (or being decoded) but not yet used
+                self.assertLessEqual(len(submitted) - n, 3)
+        self.assertEqual(len(submitted), 12)
+
+    def test_shrink_frees_what_is_not_kept(self):
+        arr = np.arange(4 * 20 * 3, dtype=np.float64).reshape(4, 20, 3)
+        keep = np.arange(0, 20, 2)
+        ref = arr[:, keep]
+        out = read_idb._shrink(arr.copy(), 1, keep)
+        np.testing.assert_array_equal(out, ref)
+        self.assertTrue(out.flags.owndata)
+        self.assertEqual(out.nbytes, ref.nbytes)
+
+        # Nearly all kept: compacted in place
+        buf = arr.copy()
+        out = read_idb._shrink(buf, 1, np.arange(19))
+        np.testing.assert_array_equal(out, arr[:, :19])
+        self.assertTrue(np.shares_memory(out, buf))
+
+    def test_output_is_sized_from_the_record_count(self):
+        with mock.patch.object(read_idb.miriad_native, "record_count", wraps=read_idb.miriad_native.record_count) as count:
+            out = read_idb.read_idb(self.files, navg=2)
+        self.assertEqual(count.call_count, 3)
+        self.assertEqual(out["time"].shape, (6,))
+        np.testing.assert_array_equal(read_idb._count_times(self.files[0]), T0 + np.arange(4) * DT)
+
+        # Without a record count, visdata gives an upper bound that is trimmed after reading
+        with mock.patch.object(read_idb.miriad_native, "record_count", return_value=None):
+            self.assertGreaterEqual(len(read_idb._count_times(self.files[0])), 4)
+            np.testing.assert_array_equal(read_idb.read_idb(self.files, navg=2)["x"], out["x"])
+
+    def test_time_keys_share_one_time_axis(self):
+        out = read_idb.read_idb(self.files, navg=2, quackint=2.0)
+
+        nt = len(out["time"])
+        self.assertEqual(nt, 3)
+        for key in ("x", "a", "p", "p2", "m", "meanp"):
+            self.assertEqual(out[key].shape[-1], nt)
+        self.assertEqual(out["uvw"].shape[1], nt)
+        self.assertEqual(len(out["ha"]), nt)
+        np.testing.assert_allclose(out["time"], T0 + np.array([2.5, 6.5, 10.5]) * DT)
+
+    def test_unreadable_file_is_skipped_and_reported(self):
+        files = self.files[:1] + [os.path.join(self.tmpdir, "IDB20230224009900")] + self.files[1:]
+        out = read_idb.read_idb(files, workers=2)
+
+        self.assertEqual(out["time"].shape, (12,))
+
+    def test_prefetch_gives_the_same_output(self):
+        ref = read_idb.read_idb(self.files, navg=2)
+        out = read_idb.read_idb(self.files, navg=2, prefetch=2)
+
+        for key in read_idb._TIME_AXIS:
+            np.testing.assert_array_equal(out[key], ref[key])
+
+        # The files are read ahead once, for the full read only
+        with mock.patch.object(read_idb.prefetch_mod, "Prefetcher", wraps=read_idb.prefetch_mod.Prefetcher) as ahead:
+            read_idb.read_idb(self.files, navg=2, prefetch=2)
+        self.assertEqual(ahead.call_count, 1)
+
+    def test_native_backend_gives_the_same_output(self):
+        ref = read_idb.read_idb(self.files, navg=2)
+        with mock.patch.dict(os.environ, {"EOVSA_MIRIAD_BACKEND": "native"}):
+            out = read_idb.read_idb(self.files, navg=2, workers=2)
+
+        for key in read_idb._TIME_AXIS:
+            np.testing.assert_array_equal(out[key], ref[key])
+
+    def test_profile_counts_the_records_of_every_file(self):
+        ref = read_idb.read_idb(self.files, navg=2)
+        for workers in (None, 2):
+            out = read_idb.read_idb(self.files, navg=2, desat=True, workers=workers, profile=True)
+            stages = out.pop("profile")["stages"]
+            self.assertEqual(stages["decode"]["records"], 3 * 4 * 136 * 4)
+            self.assertEqual(stages["decode"]["bytes"], sum(read_profile.dataset_bytes(f) for f in self.files))
+            self.assertEqual(stages["desat"]["calls"], 3)
+            self.assertEqual(stages["average"]["calls"], 3)
+            self.assertIn("sizing", stages)
+            self.assertEqual(out["x"].shape, ref["x"].shape)
+        self.assertNotIn("profile", ref)
+
+    def test_selection_is_passed_to_each_file(self):
+        out = read_idb.read_idb(self.files, bls=[bl2ord[0, 5]], pols=[0], workers=2)
+
+        self.assertEqual(out["x"].shape, (1, 1, NF, 12))
+        self.assertEqual(out["a"].shape, (NANT, 1, NF, 12))
+        np.testing.assert_array_equal(out["x"][0, 0, :, 5], _vis_value(T0 + 5 * DT, 0, 5, 0))
+
+    def test_iter_chunks_concatenate_to_read_idb(self):
+        ref = read_idb.read_idb(self.files, navg=2, quackint=2.0, filter=False)
+        chunks = list(read_idb.read_idb_iter(self.files, chunk_seconds=3.0, navg=2, quackint=2.0, filter=False))
+
+        self.assertEqual([len(out["time"]) for out in chunks], [1, 1, 1])
+        for key, axis in read_idb._TIME_AXIS.items():
+            joined = np.concatenate([out[key] for out in chunks], axis)
+            np.testing.assert_array_equal(joined, ref[key])
+
+    def test_iter_keeps_the_snapshots_of_one_chunk(self):
+        held = []
+        read_blocks = read_idb._read_blocks
+
+        def blocks(*args, **kwargs):
+            for blk, snap in read_blocks(*args, **kwargs):
+                held.append(len(snap))
+                yield blk, snap
+
+        # Not a Mock, which would keep the open UV objects in its call list
+        with mock.patch.object(read_idb, "_read_blocks", new=blocks):
+            chunks = list(read_idb.read_idb_iter(self.files, chunk_seconds=2.0, filter=False))
+        self.assertEqual([len(out["time"]) for out in chunks], [2] * 6)
+        self.assertLessEqual(max(held), 2)
+
+    def test_compact_precision_is_kept_through_averaging(self):
+        out = read_idb.read_idb(self.files, navg=2, precision="compact16")
+
+        self.assertEqual(out["p"].dtype, np.float32)
+        self.assertEqual(out["meanp"].dtype, np.float32)
+        self.assertEqual(out["m"].dtype, np.int32)
+        self.assertEqual(out["a"].dtype, np.float16)
+        # Amplitudes are averaged, rather than the complex autocorrelations
+        raw = np.abs(read_idb.read_idb(self.files, filter=False)["a"])
+        ref = raw.reshape(raw.shape[:3] + (6, 2)).mean(4)
+        np.testing.assert_allclose(out["a"], ref, rtol=2e-3)
+
+    def test_keep_partial_averages_across_files(self):
+        raw = read_idb.read_idb(self.files, filter=False)
+        out = read_idb.read_idb(self.files, navg=3, filter=False, keep_partial=True)
+
+        # The 12 contiguous times make 4 averages, 2 of which span two files
+        np.testing.assert_allclose(out["time"], raw["time"].reshape(4, 3).mean(1))
+        np.testing.assert_allclose(out["x"], raw["x"].reshape(raw["x"].shape[:3] + (4, 3)).mean(4), rtol=1e-6)
+        np.testing.assert_array_equal(out["m"], raw["m"].reshape(raw["m"].shape[:3] + (4, 3)).sum(4))
+        self.assertEqual(len(read_idb.read_idb(self.files, navg=3, filter=False)["time"]), 3)
+
+        # A time gap before the last file closes the open average early
+        shutil.rmtree(self.files[2])
+        _write_idb(self.files[2], [T0 + (20 + m) * DT for m in range(4)])
+        out = read_idb.read_idb(self.files, navg=3, filter=False, keep_partial=True)
+        np.testing.assert_allclose(out["time"], T0 + np.array([1, 4, 6.5, 21, 23]) * DT)
+
+
+def _unrot_reference(data, azeldict, fghz, dph, xi_rot):
+    """The loop-based unrot() as it was before vectorization, with the per-antenna
+    good-time index gd[i] used where gd was used by mistake."""
+    trange = Time(data["time"][[0, -1]], format="jd")
+    chi = azeldict["ParallacticAngle"] * np.pi / 180.0
+    if trange[0] < Time("2025-05-22"):
+        chi[:, [8, 9, 10, 12, 13]] = 0
+        nant = 15
+    else:
+        chi[:, 15] = 0
+        nant = 16
+    track = azeldict["TrackFlag"]
+    good = np.where(azeldict["ActualAzimuth"] != 0)
+    tidx, gd = [], []
+    for i in range(nant):
+        gd.append(good[0][np.where(good[1] == i)])
+        tidx.append(nearest_val_idx(data["time"], azeldict["Time"][gd[i]].jd))
+    fidx1, fidx2 = common_val_idx(data["fghz"], fghz, precision=4)
+    nbl, npol, nf, nt = data["x"].shape
+    nf = len(fidx1)
+    for i in range(nant - 1):
+        for j in range(i + 1, nant):
+            k = bl2ord[i, j]
+            xi = xi_rot[fidx2] if j == 13 else 0.0
+            a1 = lobe(dph[i, fidx2] - dph[j, fidx2])
+            a2 = -dph[j, fidx2] - xi
+            a3 = dph[i, fidx2] - xi + np.pi
+            data["x"][k, 1, fidx1] *= np.repeat(np.exp(1j * a1), nt).reshape(nf, nt)
+            data["x"][k, 2, fidx1] *= np.repeat(np.exp(1j * a2), nt).reshape(nf, nt)
+            data["x"][k, 3, fidx1] *= np.repeat(np.exp(1j * a3), nt).reshape(nf, nt)
+    cdata = copy.deepcopy(data)
+    for n in range(nt):
+        for i in range(nant - 1):
+            for j in range(i + 1, nant):
+                k = bl2ord[i, j]
+                ti = tidx[i][n]
+                tj = tidx[j][n]
+                if track[ti, i] and track[tj, j]:
+                    try:
+                        dchi = chi[gd[i][ti], i] - chi[gd[j][tj], j]
+                    except IndexError:
+                        dchi = 0.0
+                    cchi = np.cos(dchi)
+                    schi = np.sin(dchi)
+                    cdata["x"][k, 0, :, n] = data["x"][k, 0, :, n] * cchi + data["x"][k, 3, :, n] * schi
+                    cdata["x"][k, 2, :, n] = data["x"][k, 2, :, n] * cchi + data["x"][k, 1, :, n] * schi
+                    cdata["x"][k, 3, :, n] = data["x"][k, 3, :, n] * cchi - data["x"][k, 0, :, n] * schi
+                    cdata["x"][k, 1, :, n] = data["x"][k, 1, :, n] * cchi - data["x"][k, 2, :, n] * schi
+                else:
+                    cdata["x"][k, :, :, n] = np.nan
+    return cdata
+
+
+class UnrotTests(unittest.TestCase):
+    NT = 8
+    NSQL = 12
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        nbl = bl2ord.max() + 1
+        self.data = {
+            "x": (rng.normal(size=(nbl, 4, NF, self.NT)) + 1j * rng.normal(size=(nbl, 4, NF, self.NT))).astype(np.complex64),
+            "time": T0 + np.arange(self.NT) * 4 * DT,
+            "fghz": np.linspace(2.0, 4.0, NF),
+        }
+        azimuth = rng.uniform(1.0, 300.0, size=(self.NSQL, NANT))
+        azimuth[rng.random((self.NSQL, NANT)) > 0.8] = 0.0
+        azimuth[:, 4] = 0.0  # An antenna without any valid angles
+        self.azeldict = {
+            "ParallacticAngle": rng.uniform(-90.0, 90.0, size=(self.NSQL, NANT)),
+            "TrackFlag": rng.random((self.NSQL, NANT)) > 0.1,
+            "ActualAzimuth": azimuth,
+            "Time": Time(T0 + np.arange(self.NSQL) * 3 * DT, format="jd"),
+        }
+        # Calibration record on a frequency grid that includes all but one data frequency
+        self.fghz = np.concatenate([self.data["fghz"][1:], [5.0, 0.0]])
+        self.dph = rng.uniform(-np.pi, np.pi, size=(NANT, len(self.fghz)))
+        self.xi_rot = rng.uniform(-np.pi, np.pi, size=len(self.fghz))
+        read_idb._xyphase_cache.clear()
+        self.addCleanup(read_idb._xyphase_cache.clear)
+
+    def _read_cal(self, t):
+        nfc = len(self.fghz)
+        xml = {
+            "FGHz": ["%dd" % nfc, 0, [nfc]],
+            "XYphase": ["%dd" % (NANT * nfc), 8 * nfc, [nfc, NANT]],
+            "Xi_Rot": ["%dd" % nfc, 8 * nfc * (NANT + 1), [nfc]],
+            "SQL_timestamp": ["d", 8 * nfc * (NANT + 2)],
+        }
+        buf = struct.pack("%dd" % nfc, *self.fghz) + struct.pack("%dd" % (NANT * nfc), *self.dph.ravel())
+        buf += struct.pack("%dd" % nfc, *self.xi_rot) + struct.pack("d", Time(T0 - 10, format="jd").lv)
+        return xml, buf
+
+    def test_matches_loop_reference(self):
+        good = self.fghz != 0
+        ref = _unrot_reference(copy.deepcopy(self.data), copy.deepcopy(self.azeldict),
+                               self.fghz[good], self.dph[:, good], self.xi_rot[good])
+        original = self.data["x"].copy()
+        with mock.patch.object(read_idb, "_read_xyphase_record", side_effect=self._read_cal):
+            out = read_idb.unrot(self.data, copy.deepcopy(self.azeldict))
+        np.testing.assert_array_equal(self.data["x"], original)
+        np.testing.assert_allclose(out["x"], ref["x"], rtol=1e-5, atol=1e-5)
+        np.testing.assert_array_equal(np.isnan(out["x"]), np.isnan(ref["x"]))
+        self.assertTrue(np.isnan(out["x"]).any())
+
+        with mock.patch.object(read_idb, "_read_xyphase_record", side_effect=self._read_cal):
+            inplace = read_idb.unrot(self.data, copy.deepcopy(self.azeldict), inplace=True)
+        self.assertIs(inplace, self.data)
+        np.testing.assert_array_equal(self.data["x"], out["x"])
+
+    def test_calibration_is_cached_by_validity_time(self):
+        with mock.patch.object(read_idb, "_read_xyphase_record", side_effect=self._read_cal) as read_cal:
+            read_idb._xyphase_cal(Time(T0, format="jd"))
+            read_idb._xyphase_cal(Time(T0 - 5, format="jd"))
+            self.assertEqual(read_cal.call_count, 1)
+            # Not known to be in effect before its validity time, or after the time read
+            read_idb._xyphase_cal(Time(T0 - 11, format="jd"))
+            read_idb._xyphase_cal(Time(T0 + 1, format="jd"))
+            read_idb._xyphase_cal(Time(T0 + 0.5, format="jd"))
+            self.assertEqual(read_cal.call_count, 3)
+        self.assertEqual(len(read_idb._xyphase_cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Tests for the stage counters of read_profile.py."""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from eovsapy import read_profile
+
+
+class ReadProfileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stages_do_nothing_without_an_active_profile(self):
+        self.assertIsNone(read_profile.active())
+        with read_profile.stage("decode"):
+            read_profile.count("decode", records=5)
+        with read_profile.profiling(None) as prof:
+            self.assertIsNone(prof)
+            self.assertIsNone(read_profile.active())
+
+    def test_inner_stages_are_not_counted_in_outer_ones(self):
+        with read_profile.ReadProfile() as prof:
+            with read_profile.stage("decode", nbytes=100):
+                time.sleep(0.02)
+                with read_profile.stage("lst"):
+                    time.sleep(0.05)
+                read_profile.count("decode", records=7)
+            with read_profile.stage("decode"):
+                pass
+
+        decode = prof.stages["decode"]
+        self.assertEqual((decode["calls"], decode["records"], decode["bytes"]), (2, 7, 100))
+        self.assertGreaterEqual(prof.stages["lst"]["seconds"], 0.05)
+        self.assertLess(decode["seconds"], 0.05)
+        self.assertGreaterEqual(prof.total, decode["seconds"] + prof.stages["lst"]["seconds"])
+        self.assertIsNone(read_profile.active())
+
+    def test_nested_use_of_one_profile_and_merge(self):
+        prof = read_profile.ReadProfile()
+        with read_profile.profiling(prof):
+            with read_profile.profiling(prof):
+                read_profile.count("decode", records=1)
+            self.assertIs(read_profile.active(), prof)
+        prof.merge({"decode": {"calls": 2, "seconds": 1.0, "records": 3, "bytes": 4}})
+
+        self.assertEqual(prof.stages["decode"], {"calls": 2, "seconds": 1.0, "records": 4, "bytes": 4})
+        self.assertIn("decode", prof.summary())
+
+    def test_json_lines_are_appended_for_each_run(self):
+        path = os.path.join(self.tmpdir, "profile.jsonl")
+        for n in range(2):
+            with read_profile.profiling(path):
+                with read_profile.stage("decode", records=10):
+                    pass
+                with read_profile.stage("average"):
+                    pass
+
+        with open(path) as handle:
+            records = [json.loads(line) for line in handle]
+        self.assertEqual([r["stage"] for r in records], ["decode", "average"] * 2)
+        self.assertEqual(records[0]["records"], 10)
+        self.assertEqual(set(records[0]), {"started", "label", "total_s", "stage"} | set(read_profile.FIELDS))
+
+
+if __name__ == "__main__":
+    unittest.main()
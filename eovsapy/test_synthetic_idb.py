@@ -0,0 +1,70 @@
+"""Tests for the synthetic IDB files of synthetic_idb.py and the benchmark that uses them."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from eovsapy import benchmark_read_idb, read_idb, synthetic_idb, udb_util
+
+
+class SyntheticIdbTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_files_have_the_layout_of_real_data(self):
+        files, nrec = synthetic_idb.write_idb_files(self.tmpdir, nfiles=2, duration=3, nbands=34)
+
+        self.assertEqual([os.path.basename(name) for name in files], ["IDB20180601180000", "IDB20180601180003"])
+        self.assertEqual(nrec, 2 * 3 * 136 * 4)
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            out = read_idb.read_idb(files)
+        self.assertNotIn("not found in any band", log.getvalue())
+        self.assertEqual(out["x"].shape, (120, 4, 448, 6))
+        self.assertEqual(out["a"].shape, (16, 4, 448, 6))
+        np.testing.assert_array_equal(np.unique(out["band"]), np.arange(1, 35))
+        np.testing.assert_allclose(np.diff(out["time"]) * 86400.0, 1.0, atol=1e-4)
+        np.testing.assert_array_equal(out["m"], 721536)
+        self.assertTrue(np.all(out["a"][:, :2].real > 0))
+
+    def test_20ms_files_can_be_made_into_a_udb_file(self):
+        files, _ = synthetic_idb.write_idb_files(self.tmpdir, nfiles=1, duration=0.5, cadence=0.02)
+        ufile = os.path.join(self.tmpdir, "UDB20230224180000")
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = read_idb.readXdata(files[0])
+            ufile_out, bad = udb_util.udbfile_create(files, ufile)
+        self.assertEqual(len(out["time"]), 25)
+        self.assertEqual(len(out["fghz"]), 486)
+        self.assertEqual(ufile_out, ufile)
+        self.assertEqual(bad, [])
+
+    def test_benchmark_reports_every_case(self):
+        output = os.path.join(self.tmpdir, "bench.json")
+        args = ["--nbands", "34", "--duration", "2", "--runs", "1", "--navg", "2", "--no-isolate",
+                "--outdir", os.path.join(self.tmpdir, "files"), "--output", output]
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmark_read_idb.main(args)
+        with open(output) as handle:
+            results = json.load(handle)["results"]
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            benchmark_read_idb.main(args + ["--cases", "unrot", "--baseline", output])
+
+        self.assertEqual([item["name"] for item in results], list(benchmark_read_idb.CASES))
+        for item in results:
+            self.assertGreater(item["records_per_s"], 0)
+            self.assertGreater(item["rss_peak_mb"], 0)
+        self.assertIn("| unrot | 1920 |", log.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
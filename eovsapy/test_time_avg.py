@@ -0,0 +1,149 @@
+"""Tests for the streaming time averager in time_avg.py.
+
+``_reshape_average`` is the reshape-and-nanmean averaging that
+``read_idb._time_average`` used before the accumulator was introduced.
+"""
+
+from __future__ import annotations
+
+import copy
+import unittest
+import warnings
+
+import numpy as np
+
+from eovsapy import time_avg
+
+NANT = 4
+NBL = 10
+NF = 5
+NT = 37
+T0 = 2460000.5
+DT = 1.0 / 86400.0
+KEYS = ("a", "x", "p", "p2", "m", "meanp", "uvw", "time", "ha")
+
+
+def _block(nt=NT, t0=T0, seed=0):
+    rng = np.random.default_rng(seed)
+    m = rng.integers(1, 3, (NANT, 2, NF, nt))
+    m[0, 0][rng.random((NF, nt)) < 0.3] = 0
+    x = (rng.normal(size=(NBL, 4, NF, nt)) + 1j * rng.normal(size=(NBL, 4, NF, nt))).astype(np.complex64)
+    x[rng.random(x.shape) < 0.1] = np.nan
+    return {
+        "a": rng.normal(size=(NANT, 4, NF, nt)).astype(np.complex64),
+        "x": x,
+        "p": rng.random((NANT, 2, NF, nt)),
+        "p2": rng.random((NANT, 2, NF, nt)),
+        "m": m,
+        "uvw": rng.random((NBL, nt, 3)),
+        "time": t0 + np.arange(nt) * DT,
+        # Crosses +pi, so the hour angle has to be unwrapped
+        "ha": np.mod(np.linspace(3.0, 3.4, nt) + np.pi, 2 * np.pi) - np.pi,
+        "source": "Sun",
+        "fghz": np.linspace(1.0, 2.0, NF),
+    }
+
+
+def _reshape_average(out, navg):
+    badidx = np.where(out["m"][0, 0] == 0)
+    for key in ("p", "p2", "a", "x"):
+        out[key][:, :, badidx[0], badidx[1]] = np.nan
+    out["uvw"][:, badidx[1], :] = np.nan
+    nout = len(out["time"]) // navg
+    res = {}
+    for key, axis in time_avg.TIME_AXIS.items():
+        arr = out[key][(slice(None),) * axis + (slice(0, nout * navg),)]
+        res[key] = arr.reshape(arr.shape[:axis] + (nout, navg) + arr.shape[axis + 1:])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        res["meanp"] = np.nanmean(res["p"], 4)
+        for key in ("m", "p", "p2"):
+            res[key] = np.nansum(res[key], 4)
+        for key in ("a", "x"):
+            res[key] = np.nanmean(res[key], 4)
+        res["uvw"] = np.nanmean(res["uvw"], 2)
+    res["time"] = np.mean(res["time"], 1)
+    ha = np.mean(np.unwrap(res["ha"]), 1)
+    ha[ha > np.pi] -= 2 * np.pi
+    ha[ha < -np.pi] += 2 * np.pi
+    res["ha"] = ha
+    return res
+
+
+def _slice(out, start, stop):
+    return {
+        key: val[(slice(None),) * time_avg.TIME_AXIS[key] + (slice(start, stop),)] if key in time_avg.TIME_AXIS else val
+        for key, val in out.items()
+    }
+
+
+def _join(parts):
+    axes = dict(time_avg.TIME_AXIS, meanp=3)
+    return {key: np.concatenate([part[key] for part in parts], axes[key]) for key in KEYS}
+
+
+class TimeAveragerTests(unittest.TestCase):
+    def _assert_close(self, new, ref):
+        for key in KEYS:
+            self.assertEqual(new[key].dtype, ref[key].dtype, key)
+            np.testing.assert_allclose(new[key], ref[key], rtol=1e-6, atol=1e-7, err_msg=key)
+
+    def test_matches_reshape_average(self):
+        block = _block()
+        for navg in (1, 3, 10):
+            new = time_avg.TimeAverager(navg, keep_partial=False).add(block)
+            self._assert_close(new, _reshape_average(copy.deepcopy(block), navg))
+            self.assertEqual(new["source"], "Sun")
+        self.assertTrue(np.isnan(block["x"]).any())
+        self.assertFalse(np.isnan(block["p"]).any())
+
+    def test_blocks_continue_open_bins(self):
+        block = _block()
+        averager = time_avg.TimeAverager(4, keep_partial=False)
+        parts = [averager.add(_slice(block, start, stop)) for start, stop in [(0, 5), (5, 6), (6, 6), (6, 20), (20, NT)]]
+
+        self.assertEqual([len(part["time"]) for part in parts], [1, 0, 0, 4, 4])
+        self._assert_close(_join(parts), _reshape_average(copy.deepcopy(block), 4))
+        self.assertIsNone(averager.flush())
+
+    def test_partial_bins_are_kept_and_closed_by_gaps(self):
+        first = _block(nt=5)
+        second = _block(nt=5, t0=T0 + 5 * DT, seed=1)
+        gapped = _block(nt=2, t0=T0 + 30 * DT, seed=2)
+        averager = time_avg.TimeAverager(3)
+        parts = [averager.add(first), averager.add(second), averager.add(gapped), averager.flush()]
+
+        self.assertEqual([len(part["time"]) for part in parts], [1, 2, 1, 1])
+        times = _join(parts)["time"]
+        np.testing.assert_allclose((times - T0) / DT, [1, 4, 7, 9, 30.5], atol=1e-3)
+        self.assertIsNone(averager.flush())
+
+    def test_compact_sums_do_not_overflow_or_lose_precision(self):
+        nt = 3000
+        block = _block(nt=nt)
+        block["m"] = np.full((NANT, 2, NF, nt), 745472, dtype=np.int32)
+        for key in ("p", "p2"):
+            block[key] = block[key].astype(np.float32)
+        new = time_avg.TimeAverager(nt, keep_partial=False).add(block)
+
+        # 3000 samples of m overflow int32, so m is kept in int64
+        self.assertEqual(new["m"].dtype, np.int64)
+        np.testing.assert_array_equal(new["m"], 745472 * nt)
+        for key in ("p", "p2"):
+            self.assertEqual(new[key].dtype, np.float32)
+            ref = block[key].astype(np.float64).sum(3, keepdims=True)
+            # Within the rounding of the float32 result
+            np.testing.assert_allclose(new[key], ref, rtol=1.2e-7)
+        self.assertEqual(time_avg.TimeAverager(10, keep_partial=False).add(block)["m"].dtype, np.int32)
+
+    def test_mismatched_block_is_refused(self):
+        averager = time_avg.TimeAverager(3)
+        averager.add(_block(nt=4))
+        later = _slice(_block(nt=4, t0=T0 + 4 * DT), 0, 4)
+        later["p"] = later["p"][:, :, :2]
+        with self.assertRaises(ValueError):
+            averager.add(later)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+"""Tests of the reading, concatenation, time averaging and writing of UDB data in udb_util.py."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+from unittest import mock
+
+import aipy
+import numpy as np
+import numpy.ma as ma
+
+from eovsapy import miriad_native, read_profile, synthetic_idb, udb_util, util
+
+ONE_DAY = 86400.0
+
+
+def _xdata(times, nf=6, nbl=10, nant=4, seed=0):
+    """Return a readXdata-like dictionary at the Julian dates times."""
+    rng = np.random.default_rng(seed)
+    nt = len(times)
+    shape = (nf, nbl, 4, nt)
+    data = (rng.normal(size=shape) + 1j * rng.normal(size=shape)).astype(np.complex64)
+    mask = rng.random(shape) < 0.3
+    # A channel and baseline that are flagged at all times
+    mask[0, 0] = True
+    return {"x": ma.masked_array(data, mask=mask), "time": np.asarray(times),
+            "uvw": rng.normal(size=(3, nbl, nt)), "px": rng.random((nant * nf * 3, nt)).astype(np.float32),
+            "py": rng.random((nant * nf * 3, nt)).astype(np.float32), "i0": 0, "j0": 0,
+            "lst": rng.random(nt), "ut": rng.random(nt), "delay": rng.random((nant, nt)).astype(np.float32),
+            "pol": np.array([-5, -6, -7, -8]), "file0": "IDB20230224000000", "fghz": np.linspace(1, 18, nf)}
+
+
+def _reference(x, nsec):
+    """Average bin by bin, as avXdata did before it was vectorized."""
+    t = x["time"]
+    tsec = np.round((t - t[0]) * ONE_DAY)
+    edges = np.arange(0, (2 + int(np.max(tsec)) / nsec) * nsec, nsec)
+    mid = (edges[1:] + edges[:-1]) * 0.5
+    nf, nbl, npol, nt = x["x"].shape
+    outx = ma.masked_array(np.zeros((nf, nbl, npol, len(mid)), dtype=np.complex64), mask=False)
+    px = np.zeros((x["px"].shape[0], len(mid)), dtype=np.float32)
+    nsamples = np.zeros(len(mid), dtype=np.int32)
+    for j in range(len(mid)):
+        inbin, = np.where((tsec >= edges[j]) & (tsec < edges[j + 1]))
+        nsamples[j] = len(inbin)
+        if len(inbin) > 0:
+            outx[..., j] = ma.average(x["x"][..., inbin], axis=3)
+            px[:, j] = np.sum(x["px"][:, inbin], axis=1)
+    uvw = np.array([[np.interp(mid, tsec, row) for row in k] for k in x["uvw"]])
+    delay = np.array([np.interp(mid, tsec, row) for row in x["delay"]])
+    return {"x": outx, "px": px, "nsamples": nsamples, "uvw": uvw, "delay": delay,
+            "lst": np.interp(mid, tsec, x["lst"]), "time": t[0] + mid / ONE_DAY}
+
+
+class AvXdataTests(unittest.TestCase):
+    def check(self, x, nsec):
+        out = udb_util.avXdata(x, nsec=nsec)
+        ref = _reference(x, nsec)
+        np.testing.assert_array_equal(out["nsamples"], ref["nsamples"])
+        np.testing.assert_array_equal(ma.getmaskarray(out["x"]), ma.getmaskarray(ref["x"]))
+        self.assertEqual(out["x"].dtype, np.complex64)
+        np.testing.assert_allclose(out["x"].filled(0), ref["x"].filled(0), rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(out["px"], ref["px"], rtol=1e-6)
+        self.assertEqual(out["delay"].dtype, np.float32)
+        for key in ("uvw", "delay", "lst", "time"):
+            np.testing.assert_array_equal(out[key], ref[key].astype(out[key].dtype))
+        return out
+
+    def test_one_second_data_in_one_minute_bins(self):
+        t0 = 2460000.25
+        out = self.check(_xdata(t0 + np.arange(150) / ONE_DAY), 60)
+        self.assertEqual(list(out["nsamples"]), [60, 60, 30, 0])
+
+    def test_gaps_leave_empty_unmasked_bins(self):
+        t0 = 2460000.25
+        times = t0 + np.concatenate([np.arange(20), np.arange(70, 90)]) / ONE_DAY
+        out = self.check(_xdata(times, seed=1), 10)
+        empty = out["nsamples"] == 0
+        self.assertTrue(np.any(empty))
+        self.assertFalse(np.any(ma.getmaskarray(out["x"])[..., empty]))
+
+    def test_20ms_data_in_one_second_bins(self):
+        t0 = 2460000.25
+        self.check(_xdata(t0 + np.arange(250) * 0.02 / ONE_DAY, seed=2), 1)
+
+    def test_interp_rows_is_np_interp(self):
+        rng = np.random.default_rng(3)
+        xp = np.cumsum(rng.integers(0, 3, size=40)).astype(float)
+        fp = rng.normal(size=(5, 40))
+        fp[1, 10] = np.inf
+        xnew = np.linspace(-5, xp[-1] + 5, 97)
+        expected = np.array([np.interp(xnew, xp, row) for row in fp])
+        np.testing.assert_array_equal(udb_util._interp_rows(xnew, xp, fp), expected)
+
+
+def _write_sparse_idb(path, ntimes=10, nf=3, nant=16):
+    """Write an IDB-like file with records for only baselines 1-1 and 1-2, so
+    that the file is much smaller than its number of times suggests.
+    """
+    uv = aipy.miriad.UV(path, "new")
+    for name, vtype, value in [("nants", "i", nant), ("npol", "i", 4), ("sfreq", "d", np.linspace(1, 2, nf)),
+                               ("antlist", "a", " ".join(str(i + 1) for i in range(nant)))]:
+        uv.add_var(name, vtype)
+        uv[name] = value
+    for name, vtype in [("ut", "d"), ("xsampler", "r"), ("ysampler", "r"), ("delay", "d"), ("pol", "i")]:
+        uv.add_var(name, vtype)
+    for n in range(ntimes):
+        t = 2460000.25 + n / ONE_DAY
+        uv["ut"] = n * 1.0
+        uv["xsampler"] = np.full(3 * nf * nant, n, dtype=np.float32)
+        uv["ysampler"] = np.full(3 * nf * nant, -n, dtype=np.float32)
+        uv["delay"] = np.full(nant, n * 10.0)
+        for j in (0, 1):
+            for k in range(4):
+                uv["pol"] = -5 - k
+                data = np.full(nf, n + 1j * k, dtype=np.complex64)
+                uv.write((np.array([j, 0.0, 0.0]), t, (0, j)), ma.array(data, mask=[False, n % 2 == 1, False]))
+    del uv
+
+
+class ReadXdataTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_arrays_grow_past_the_size_estimate(self):
+        path = os.path.join(self.tmpdir, "IDB20230224000000")
+        _write_sparse_idb(path)
+        bl2ord = util.bl2ord.copy()
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = udb_util.readXdata(path)
+        np.testing.assert_array_equal(util.bl2ord, bl2ord)
+        self.assertEqual(out["x"].shape, (3, 136, 4, 10))
+        self.assertEqual(len(out["time"]), 10)
+        auto, cross = bl2ord[0, 0], bl2ord[0, 1]
+        for bl in (auto, cross):
+            np.testing.assert_array_equal(out["x"].data[0, bl, :, :], np.arange(10) + 1j * np.arange(4)[:, None])
+            np.testing.assert_array_equal(out["x"].mask[1, bl, 0, :], np.arange(10) % 2 == 1)
+        np.testing.assert_array_equal(out["uvw"][0, cross], 1.0)
+        self.assertEqual((out["i0"][cross], out["j0"][cross]), (0, 1))
+        # Baselines without records are zero and not masked
+        self.assertFalse(np.any(out["x"].mask[:, 5]))
+        self.assertFalse(np.any(out["x"].data[:, 5]))
+        np.testing.assert_array_equal(out["px"][:, 7], 7)
+        np.testing.assert_array_equal(out["delay"][:, 9], 90)
+
+    def test_dataset_is_stat_only_while_profiling(self):
+        path = os.path.join(self.tmpdir, "IDB20230224000000")
+        _write_sparse_idb(path)
+        with mock.patch.object(read_profile, "dataset_bytes", return_value=0) as sizes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                udb_util.readXdata(path)
+                sizes.assert_not_called()
+                with read_profile.ReadProfile():
+                    udb_util.readXdata(path)
+            sizes.assert_called_once_with(path)
+
+    def test_udb_files_read_back_as_written(self):
+        files, _ = synthetic_idb.write_idb_files(self.tmpdir, nfiles=1, duration=3, nbands=34)
+        ufile = os.path.join(self.tmpdir, "UDB20180601180000")
+        with contextlib.redirect_stdout(io.StringIO()):
+            y = udb_util.readXdata(files[0])
+            udb_util.udbfile_write(y, files[0], ufile)
+            out = udb_util.readXdata(ufile)
+        for key in ("time", "uvw", "i0", "j0", "px", "py", "fghz"):
+            np.testing.assert_array_equal(out[key], y[key])
+        np.testing.assert_array_equal(out["x"].data, y["x"].data)
+        np.testing.assert_array_equal(ma.getmaskarray(out["x"]), ma.getmaskarray(y["x"]))
+
+
+class ConcatXdataTests(unittest.TestCase):
+    def setUp(self):
+        t0 = 2460000.25
+        self.xs = [_xdata(t0 + (10 * n + np.arange(10)) / ONE_DAY, seed=n) for n in range(4)]
+
+    def check(self, out, xs):
+        np.testing.assert_array_equal(out["x"].data, np.concatenate([x["x"].data for x in xs], axis=3))
+        np.testing.assert_array_equal(out["x"].mask, np.concatenate([x["x"].mask for x in xs], axis=3))
+        np.testing.assert_array_equal(out["uvw"], np.concatenate([x["uvw"] for x in xs], axis=2))
+        for key in ("px", "py", "delay"):
+            np.testing.assert_array_equal(out[key], np.concatenate([x[key] for x in xs], axis=1))
+            self.assertEqual(out[key].dtype, xs[0][key].dtype)
+        for key in ("time", "lst", "ut"):
+            np.testing.assert_array_equal(out[key], np.concatenate([x[key] for x in xs]))
+        self.assertEqual(out["file0"], xs[0]["file0"])
+
+    def test_list_gives_the_same_as_pairs(self):
+        out = udb_util.concatXdata(self.xs)
+        self.check(out, self.xs)
+        pairs = self.xs[0]
+        for x in self.xs[1:]:
+            pairs = udb_util.concatXdata(pairs, x)
+        self.assertEqual(sorted(pairs), sorted(out))
+        self.check(pairs, self.xs)
+
+    def test_frequency_mismatch_drops_the_data_before_it(self):
+        self.xs[2] = _xdata(self.xs[2]["time"], nf=5, seed=2)
+        self.xs[3] = _xdata(self.xs[3]["time"], nf=5, seed=3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = udb_util.concatXdata(self.xs)
+        self.check(out, self.xs[2:])
+
+    def test_memory_mapped_output(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            out = udb_util.concatXdata(self.xs, mmap_dir=tmpdir)
+            self.check(out, self.xs)
+            self.assertIsInstance(out["x"].data, np.memmap)
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+            del out
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class UdbfileWriteTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_records_are_written_in_time_polarization_baseline_order(self):
+        files, _ = synthetic_idb.write_idb_files(self.tmpdir, nfiles=1, duration=3, nbands=34)
+        with contextlib.redirect_stdout(io.StringIO()):
+            y = udb_util.readXdata(files[0])
+        # Flag some channels, to check that the flags go with their records
+        y["x"][5:9, 3, 1, 2] = ma.masked
+        ufile = os.path.join(self.tmpdir, "UDB20180601180000")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(udb_util.udbfile_write(y, files[0], ufile), ufile)
+
+        nf, nbl, npol, nt = y["x"].shape
+        with miriad_native.MiriadFile(ufile) as mf:
+            self.assertEqual(mf.nrec, nt * npol * nbl)
+            uvw, t, i, j = mf.preamble()
+            np.testing.assert_array_equal(t, np.repeat(y["time"], npol * nbl))
+            np.testing.assert_array_equal(i, np.tile(y["i0"], nt * npol))
+            np.testing.assert_array_equal(j, np.tile(y["j0"], nt * npol))
+            np.testing.assert_array_equal(uvw, y["uvw"].transpose(2, 1, 0)[:, None].repeat(npol, 1).reshape(-1, 3))
+            np.testing.assert_array_equal(mf.values("pol"), np.tile(np.repeat(y["pol"], nbl), nt))
+            # Records are (time, polarization, baseline), y['x'] is (channel, baseline, polarization, time)
+            order = (3, 2, 1, 0)
+            np.testing.assert_array_equal(mf.data().reshape(nt, npol, nbl, nf), ma.getdata(y["x"]).transpose(order))
+            np.testing.assert_array_equal(mf.flags().reshape(nt, npol, nbl, nf), ~ma.getmaskarray(y["x"]).transpose(order))
+
+
+class UdbfileCreateAllTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files, _ = synthetic_idb.write_idb_files(os.path.join(self.tmpdir, "IDB"), nfiles=3, duration=2, nbands=34)
+        self.groups = [([name], os.path.join(self.tmpdir, "UDB" + os.path.basename(name)[3:])) for name in self.files]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_all(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return udb_util.udbfile_create_all(self.groups, nsec=1, **kwargs)
+
+    def test_up_to_date_files_are_skipped(self):
+        result = self.create_all(workers=2)
+        udbs = [ufile for _, ufile in self.groups]
+        self.assertEqual(sorted(result["created"]), udbs)
+        self.assertEqual(result["failed"], [])
+        # Only the UDB files and the manifest, no temporary files
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted(["IDB", udb_util.UDB_MANIFEST] + [os.path.basename(u) for u in udbs]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = udb_util.readXdata(udbs[0])
+        self.assertEqual(out["x"].shape[-1], 2)
+
+        self.assertEqual(self.create_all()["skipped"], udbs)
+        # A changed input file makes its UDB file again
+        later = time.time() + 10
+        os.utime(os.path.join(self.files[1], "visdata"), (later, later))
+        result = self.create_all()
+        self.assertEqual(result["created"], [udbs[1]])
+        self.assertEqual(result["skipped"], [udbs[0], udbs[2]])
+        self.assertEqual(self.create_all(force=True)["created"], udbs)
+
+    def test_missing_input_is_reported(self):
+        shutil.rmtree(self.files[2])
+        result = self.create_all()
+        self.assertEqual(result["failed"], [self.groups[2][1]])
+        self.assertEqual(len(result["created"]), 2)
+
+
+class ProbeMiriadDatasetTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files, self.nrec = synthetic_idb.write_idb_files(self.tmpdir, nfiles=2, duration=2, nbands=34)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_probe_gives_validity_and_record_count(self):
+        probe = udb_util.probe_miriad_dataset(self.files[0])
+        self.assertTrue(probe["valid"])
+        self.assertEqual(probe["nrec"], self.nrec // 2)
+        self.assertEqual(probe["size"], sum(os.path.getsize(os.path.join(self.files[0], item))
+                                            for item in ("flags", "header", "vartable", "visdata")))
+        # Unchanged files are not looked into again
+        with mock.patch.object(miriad_native, "record_count") as count:
+            self.assertEqual(udb_util.probe_miriad_dataset(self.files[0]), probe)
+            count.assert_not_called()
+            with open(os.path.join(self.files[0], "visdata"), "ab") as handle:
+                handle.write(bytes(8))
+            udb_util.probe_miriad_dataset(self.files[0])
+            count.assert_called_once()
+
+    def test_missing_or_empty_items_are_invalid(self):
+        os.remove(os.path.join(self.files[0], "vartable"))
+        open(os.path.join(self.files[1], "flags"), "w").close()
+        names = self.files + [os.path.join(self.tmpdir, "IDB20180601000000")]
+        otp, ok, bad = udb_util.valid_miriad_dataset(names)
+        self.assertEqual(otp, [False, False, False])
+        self.assertEqual(bad, names)
+        self.assertIsNone(udb_util.probe_miriad_dataset(self.files[1])["nrec"])
+
+
+class XpxCompTests(unittest.TestCase):
+    def test_ratios_are_those_of_the_loop(self):
+        nf, nt = 5, 7
+        x = _xdata(2460000.25 + np.arange(nt) / ONE_DAY, nf=nf, nbl=136, nant=16, seed=3)
+        x["px"][4, 2] = 0
+        px0 = x["px"].copy()
+        xfactor = 64
+        px = x["px"].reshape(nf, 16, 3, nt)
+        py = x["py"].reshape(nf, 16, 3, nt)
+        M = px[:, 0, 2, 0] / 1792.0
+        ref = {"xcfrac": np.zeros((nf, 16, nt)), "ycfrac": np.zeros((nf, 16, nt))}
+        with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", np.ComplexWarning)
+            for kk in range(16):
+                for n in range(nt):
+                    ref["xcfrac"][:, kk, n] = x["x"][:, kk + 120, 0, n] * M / (xfactor * px[:, kk, 0, n])
+                    ref["ycfrac"][:, kk, n] = x["x"][:, kk + 120, 1, n] * M / (xfactor * py[:, kk, 0, n])
+            out = udb_util.xpx_comp(x)
+            only_y = udb_util.xpx_comp(x, pols=("y",))
+        self.assertEqual(sorted(out), ["xcfrac", "ycfrac"])
+        for key in out:
+            np.testing.assert_array_equal(out[key], ref[key])
+        self.assertEqual(list(only_y), ["ycfrac"])
+        np.testing.assert_array_equal(only_y["ycfrac"], ref["ycfrac"])
+        np.testing.assert_array_equal(x["px"], px0)
+
+
+if __name__ == "__main__":
+    unittest.main()
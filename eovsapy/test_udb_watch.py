@@ -0,0 +1,108 @@
+"""Tests for the incremental UDB builder of udb_watch.py."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from eovsapy import synthetic_idb, udb_util, udb_watch
+from eovsapy.util import Time
+
+
+class UDBWatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.idb_dir = os.path.join(self.tmpdir, "IDB")
+        self.udb_dir = os.path.join(self.tmpdir, "UDB")
+        self.files, _ = synthetic_idb.write_idb_files(self.idb_dir, nfiles=2, duration=4, nbands=34)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_new_files_are_made_once_they_are_quiet(self):
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=30)
+        # Just written, so not yet complete
+        self.assertEqual(watcher.poll(), [])
+        later = time.time() + 60
+        made = watcher.poll(now=later)
+        names = [os.path.basename(f) for f in self.files]
+        self.assertEqual(made, [os.path.join(self.udb_dir, "UDB" + name[3:]) for name in names])
+        self.assertEqual(watcher.last, names[-1])
+
+        # The same as the batch production of the file
+        ufile = os.path.join(self.tmpdir, "batch")
+        with contextlib.redirect_stdout(io.StringIO()):
+            udb_util.udbfile_create([self.files[0]], ufile, nsec=2)
+            ref = udb_util.readXdata(ufile)
+            out = udb_util.readXdata(made[0])
+        np.testing.assert_array_equal(out["x"].data, ref["x"].data)
+        np.testing.assert_array_equal(out["time"], ref["time"])
+
+        # A restarted watcher only makes the file that is new
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=30)
+        self.assertEqual(watcher.pending(), [])
+        new = os.path.join(self.idb_dir, "IDB20180601180008")
+        synthetic_idb.write_idb(new, Time("2018-06-01 18:00:08").jd + np.arange(4) / 86400.0, nbands=34)
+        self.assertEqual(watcher.poll(now=later), [os.path.join(self.udb_dir, "UDB20180601180008")])
+
+    def test_incomplete_file_holds_back_last(self):
+        # An IDB file that is still missing its data
+        os.remove(os.path.join(self.files[0], "visdata"))
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=0)
+        made = watcher.poll()
+        self.assertEqual(made, [watcher.udb_name(os.path.basename(self.files[1]))])
+        self.assertEqual(watcher.last, "")
+        self.assertEqual(watcher.pending(), [os.path.basename(self.files[0])])
+
+
+    def test_failed_file_is_retried(self):
+        names = [os.path.basename(f) for f in self.files]
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=0, retries=2)
+        process = watcher.process
+
+        def first_fails(name):
+            if name == names[0]:
+                raise OSError("transient")
+            return process(name)
+
+        with mock.patch.object(watcher, "process", side_effect=first_fails):
+            with contextlib.redirect_stdout(io.StringIO()):
+                made = watcher.poll()
+        self.assertEqual(made, [watcher.udb_name(names[1])])
+        self.assertEqual(watcher.failed, {names[0]: 1})
+        self.assertEqual(watcher.last, "")
+        self.assertEqual(watcher.pending(), [names[0]])
+
+        # A restarted watcher retries it, and the files up to last are dropped from done
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=0, retries=2)
+        self.assertEqual(watcher.failed, {names[0]: 1})
+        self.assertEqual(watcher.poll(), [watcher.udb_name(names[0])])
+        self.assertEqual(watcher.failed, {})
+        self.assertEqual(watcher.done, {names[1]: watcher.udb_name(names[1])})
+        new = os.path.join(self.idb_dir, "IDB20180601180008")
+        synthetic_idb.write_idb(new, Time("2018-06-01 18:00:08").jd + np.arange(4) / 86400.0, nbands=34)
+        watcher.poll()
+        self.assertEqual((watcher.last, watcher.done), ("IDB20180601180008", {}))
+
+    def test_file_that_keeps_failing_is_given_up(self):
+        watcher = udb_watch.UDBWatcher(self.idb_dir, self.udb_dir, nsec=2, quiet=0, retries=2)
+        with mock.patch.object(watcher, "process", return_value=None), contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(watcher.poll(), [])
+            self.assertEqual(watcher.last, "")
+            self.assertEqual(watcher.poll(), [])
+        names = [os.path.basename(f) for f in self.files]
+        self.assertEqual(watcher.failed, {name: 2 for name in names})
+        self.assertEqual(watcher.last, names[-1])
+        self.assertEqual(watcher.pending(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
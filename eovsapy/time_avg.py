@@ -0,0 +1,296 @@
+"""Streaming time averaging of ``read_idb`` output dictionaries.
+
+``read_idb`` used to average each file by reshaping its arrays to
+``(..., nt//navg, navg)`` and calling ``nanmean``/``nansum``.  That needs
+several temporaries the size of the whole file, drops the times left over at
+the end of each file, and cannot form an average from the times of two files.
+
+:class:`TimeAverager` instead keeps running sums and counts for each output
+bin of ``navg`` consecutive times.  Blocks of times (a whole file, or a chunk
+of one) are added in time order.  A bin that is still open at the end of one
+block is continued by the next block, unless there is a time gap between them,
+and each bin is divided once, when it is complete.  Temporaries are the size of
+the output bins rather than of the input block.
+
+The averages are the same as those of the reshape method: the power keys
+``m``, ``p`` and ``p2`` are summed (to preserve the spectral kurtosis), ``meanp``
+is the mean of ``p``, ``a``, ``x`` and ``uvw`` are means over the values that are
+not NaN, and ``time`` and ``ha`` (unwrapped) are plain means.  Time-frequency
+bins whose ``m`` is zero for the first antenna and polarization are left out of
+all but the ``m``, ``time`` and ``ha`` averages.
+
+Integer sums are kept in int64 and real floating-point sums in float64, as the
+reshape method's ``nansum`` did for the full-precision arrays, and are cast
+back to the type of the input only when a bin is complete.  Integer sums that
+do not fit that type (``m`` of the compact precisions, for several thousand
+times) are returned as int64.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+TIME_AXIS = {"a": 3, "x": 3, "p": 3, "p2": 3, "m": 3, "uvw": 1, "time": 0, "ha": 0}
+"""Time axis of each time-dependent key of a ``readXdata`` output dictionary."""
+SUM_KEYS = ("m", "p", "p2")
+MEAN_KEYS = ("a", "x", "uvw")
+GAP_FACTOR = 1.5
+"""A bin is closed when the next time is more than this many record intervals later."""
+CHUNK_BYTES = 1 << 25
+"""Approximate size of the input slices that are summed at one time."""
+
+
+def _take(arr: np.ndarray, axis: int, index: slice) -> np.ndarray:
+    return arr[(slice(None),) * axis + (index,)]
+
+
+def _sum_dtype(dtype: np.dtype) -> np.dtype:
+    """Type in which values of type ``dtype`` are summed."""
+    if np.issubdtype(dtype, np.integer):
+        return np.dtype(np.int64)
+    if np.issubdtype(dtype, np.floating):
+        return np.dtype(np.float64)
+    return dtype
+
+
+def _cast(total: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Cast sums back to ``dtype``, unless they are integers that do not fit it."""
+    if np.issubdtype(dtype, np.integer) and total.size > 0:
+        info = np.iinfo(dtype)
+        if total.max() > info.max or total.min() < info.min:
+            return total
+    return total.astype(dtype, copy=False)
+
+
+def _axis(key: str) -> int:
+    """Time axis of an accumulator key (a data key, or ``n_`` and a data key for counts)."""
+    return TIME_AXIS[key[2:] if key.startswith("n_") else key]
+
+
+class TimeAverager:
+    """Accumulator that averages ``readXdata`` output dictionaries in time.
+
+    :param navg: Number of consecutive times in each average.
+    :type navg: int
+    :param keep_partial: If True, a bin with fewer than navg times is averaged
+        when it is closed by a time gap or by :meth:`flush`.  If False, such
+        bins are dropped.
+    :type keep_partial: bool
+    :param max_gap: Largest time step (in days) that may occur within a bin.
+        The default is ``GAP_FACTOR`` times the median record interval of the
+        first block with more than one time.
+    :type max_gap: float, optional
+    :raises ValueError: If navg is less than 1.
+    """
+
+    def __init__(self, navg: int, keep_partial: bool = True, max_gap: Optional[float] = None) -> None:
+        if navg < 1:
+            raise ValueError(f"TimeAverager: navg must be at least 1, not {navg}")
+        self.navg = int(navg)
+        self.keep_partial = keep_partial
+        self.max_gap = max_gap
+        self._cdtype = np.uint16 if self.navg < 2**16 else np.uint32
+        self._open: Optional[Dict[str, np.ndarray]] = None
+        self._nopen = 0
+        self._last_time = 0.0
+        self._last_ha = 0.0
+        self._ha_corr = 0.0
+        self._meta: Dict[str, Any] = {}
+        self._dtypes: Dict[str, np.dtype] = {}
+
+    def add(self, out: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a block of times and return the bins that it completes.
+
+        :param out: ``readXdata`` output dictionary, or a chunk of one.  It is
+            not modified.  Keys whose value is None are passed through.
+        :type out: dict
+        :raises ValueError: If the arrays of out do not have the same shape as
+            those of the open bin (apart from the time axis).
+        :returns: Output dictionary of the averaged bins completed by this
+            block (possibly none, i.e. of zero length in time), including the
+            ``meanp`` key and the non-time keys of the block.
+        :rtype: dict
+        """
+        keys = [key for key in TIME_AXIS if out.get(key) is not None]
+        meta = {key: val for key, val in out.items() if key not in keys}
+        times = np.asarray(out["time"])
+        nt = len(times)
+        closed = None
+        if self._open is not None and nt > 0 and not self._continues(out, keys):
+            closed = self._close()
+        if self.max_gap is None and nt > 1:
+            self.max_gap = GAP_FACTOR * float(np.median(np.diff(times)))
+        self._meta = meta
+        if nt == 0:
+            done = self._empty(out, keys)
+        else:
+            done = self._accumulate(out, keys, times)
+        if closed is not None:
+            done = {key: np.concatenate([closed[key], done[key]], axis=TIME_AXIS.get(key, 3)) for key in done}
+        done.update(meta)
+        return done
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """Close the open bin.
+
+        :returns: Output dictionary of the one open bin, or None if there is no
+            open bin or it is dropped (keep_partial False).
+        :rtype: dict or None
+        """
+        if self._open is None:
+            return None
+        closed = self._close()
+        if closed is None:
+            return None
+        closed.update(self._meta)
+        return closed
+
+    def _continues(self, out: Dict[str, Any], keys: list) -> bool:
+        """True if the block follows the open bin without a time gap.
+
+        :raises ValueError: If the block's arrays do not match those of the open bin.
+        """
+        for key in keys:
+            shape = list(np.shape(out[key]))
+            shape[TIME_AXIS[key]] = 1
+            if key not in self._open or tuple(shape) != self._open[key].shape:
+                raise ValueError(f"TimeAverager: shape of {key!r} does not match the open bin; call flush() first")
+        step = out["time"][0] - self._last_time
+        return step > 0 and (self.max_gap is None or step <= self.max_gap)
+
+    def _close(self) -> Optional[Dict[str, Any]]:
+        """Average (or drop) the open bin, and clear it."""
+        acc, nfill = self._open, self._nopen
+        self._open = None
+        self._nopen = 0
+        if not self.keep_partial:
+            return None
+        return self._divide(acc, np.array([nfill]))
+
+    def _empty(self, out: Dict[str, Any], keys: list) -> Dict[str, np.ndarray]:
+        done = {key: _take(out[key], TIME_AXIS[key], slice(0, 0)) for key in keys}
+        if "p" in done:
+            done["meanp"] = done["p"].copy()
+        return done
+
+    def _accumulate(self, out: Dict[str, Any], keys: list, times: np.ndarray) -> Dict[str, np.ndarray]:
+        navg = self.navg
+        c = self._nopen
+        nt = len(times)
+        # Index of the first sample of each bin that this block adds to
+        starts = np.r_[0, np.arange((navg - c) % navg or navg, nt, navg)]
+        nb = len(starts)
+        acc: Dict[str, np.ndarray] = {}
+        for key in keys:
+            shape = list(np.shape(out[key]))
+            shape[TIME_AXIS[key]] = nb
+            self._dtypes[key] = out[key].dtype
+            acc[key] = np.zeros(shape, dtype=_sum_dtype(out[key].dtype))
+            if key in MEAN_KEYS or key == "p":
+                acc["n_" + key] = np.zeros(shape, dtype=self._cdtype)
+        if c > 0:
+            for key, arr in self._open.items():
+                _take(acc[key], _axis(key), slice(0, 1))[...] = arr
+        # Time-frequency bins to leave out, from the first antenna and polarization
+        good_ft = out["m"][0, 0] != 0 if "m" in keys else np.ones((1, nt), dtype=bool)
+        good_t = good_ft.all(axis=0) if "x" in keys else np.ones(nt, dtype=bool)
+        # Sum a few whole bins at a time, so that temporaries stay small.  Each piece is
+        # (first sample, number of bins, samples per bin, first bin).
+        per_time = max(out[key][..., :1].nbytes if TIME_AXIS[key] == 3 else 0 for key in keys)
+        group = max(1, CHUNK_BYTES // max(1, per_time * navg))
+        pieces = []
+        s0, b0 = 0, 0
+        if c > 0:
+            pieces.append((0, 1, min(nt, navg - c), 0))
+            s0, b0 = pieces[0][2], 1
+        nfull = (nt - s0) // navg
+        for g in range(0, nfull, group):
+            pieces.append((s0 + g * navg, min(group, nfull - g), navg, b0 + g))
+        if s0 + nfull * navg < nt:
+            pieces.append((s0 + nfull * navg, 1, nt - s0 - nfull * navg, b0 + nfull))
+        for first, nbin, width, bin0 in pieces:
+            ts = slice(first, first + nbin * width)
+            bs = slice(bin0, bin0 + nbin)
+            for key in keys:
+                if key in ("time", "ha"):
+                    continue
+                axis = TIME_AXIS[key]
+                val = _take(out[key], axis, ts)
+                shape = val.shape[:axis] + (nbin, width) + val.shape[axis + 1:]
+                total = _take(acc[key], axis, bs)
+                if key == "m":
+                    total += val.reshape(shape).sum(axis + 1)
+                    continue
+                valid = good_t[None, ts, None] if key == "uvw" else good_ft[None, None, :, ts]
+                nan = np.isnan(val)
+                if nan.any():
+                    valid = valid & ~nan
+                elif valid.all():
+                    valid = None
+                if valid is None:
+                    total += val.reshape(shape).sum(axis + 1)
+                else:
+                    total += np.where(valid, val, 0).reshape(shape).sum(axis + 1)
+                if key in MEAN_KEYS or key == "p":
+                    # Without NaNs, the counts come from the (small) array of good times
+                    count = _take(acc["n_" + key], axis, bs)
+                    if valid is None:
+                        count += width
+                    else:
+                        count += valid.reshape(valid.shape[:axis] + (nbin, width) + valid.shape[axis + 1:]).sum(axis + 1, dtype=self._cdtype)
+        acc["time"] += np.add.reduceat(times, starts)
+        if "ha" in acc:
+            # Unwrap the hour angle within each bin, as numpy.unwrap() does.  The block is
+            # unwrapped as a whole (continuing from the open bin), and the unwrapped value
+            # of the first sample of each new bin is then reset to its wrapped value.
+            ha = np.asarray(out["ha"], dtype=float)
+            if c > 0:
+                unwrapped = np.unwrap(np.r_[self._last_ha, ha])
+                offset = np.full(nb, unwrapped[0] - (self._last_ha + self._ha_corr))
+                unwrapped = unwrapped[1:]
+                offset[1:] = unwrapped[starts[1:]] - ha[starts[1:]]
+            else:
+                unwrapped = np.unwrap(ha)
+                offset = unwrapped[starts] - ha[starts]
+            local = unwrapped - np.repeat(offset, np.diff(np.r_[starts, nt]))
+            acc["ha"] += np.add.reduceat(local, starts)
+            self._last_ha = ha[-1]
+            self._ha_corr = local[-1] - ha[-1]
+        nfill = np.full(nb, navg)
+        nfill[-1] = c + nt - (nb - 1) * navg
+        ndone = nb if nfill[-1] == navg else nb - 1
+        self._last_time = times[-1]
+        if ndone < nb:
+            self._open = {key: _take(arr, _axis(key), slice(nb - 1, nb)).copy() for key, arr in acc.items()}
+            self._nopen = int(nfill[-1])
+        else:
+            self._open = None
+            self._nopen = 0
+        for key in list(acc):
+            acc[key] = _take(acc[key], _axis(key), slice(0, ndone))
+        return self._divide(acc, nfill[:ndone])
+
+    def _divide(self, acc: Dict[str, np.ndarray], nfill: np.ndarray) -> Dict[str, np.ndarray]:
+        """Turn sums and counts into averages."""
+        done = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for key in TIME_AXIS:
+                if key not in acc:
+                    continue
+                if key in SUM_KEYS:
+                    done[key] = _cast(acc[key], self._dtypes[key])
+                    if key == "p":
+                        done["meanp"] = (acc["p"] / acc["n_p"]).astype(self._dtypes["p"], copy=False)
+                elif key in MEAN_KEYS:
+                    done[key] = (acc[key] / acc["n_" + key]).astype(self._dtypes[key], copy=False)
+                elif key == "time":
+                    done[key] = acc[key] / nfill
+                else:
+                    # Wrap the mean hour angle again
+                    ha = acc[key] / nfill
+                    ha[ha > np.pi] -= 2 * np.pi
+                    ha[ha < -np.pi] += 2 * np.pi
+                    done[key] = ha
+        return done
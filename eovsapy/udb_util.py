@@ -21,9 +21,49 @@ ysampler) rather than (xtyys, ytsys)'''
 #                   to 2.0, necessitating a change in the saturation correction
 #                   factor in autocorr_desat().  This is applied to all data
 #                   after 2021-05-16, when the change was made.
+# sy, 2026-10-17 -- readXdata() can now use the optional on-disk cache of decoded
+#                   files in idb_cache.py, enabled by the EOVSA_IDB_CACHE variable.
+# sy, 2026-10-17 -- autocorr_desat() now uses the tabulated eta functions in desat.py,
+#                   and applies the correction to all baselines in one array operation.
+# sy, 2026-10-17 -- readXdata() gets the LST of all times with one eovsa_lst_array() call.
+# sy, 2026-10-17 -- Added the prefetch keyword to udbfile_create(), to read the next
+#                   IDB files ahead in a background thread while one is decoded.
+# sy, 2026-10-17 -- udbfile_write() writes the averaged (float32) delays as the double
+#                   precision values that the delay variable is declared with.
+# sy, 2026-10-17 -- Added the profile keyword to readXdata() and udbfile_create(), to
+#                   collect the time spent in each stage (see read_profile.py).
+# sy, 2026-10-17 -- avXdata() assigns each time to its bin with np.searchsorted and
+#                   averages all channels, baselines and polarizations of the bins at
+#                   once with np.add.reduceat, instead of searching all times for
+#                   each bin and averaging bin by bin.  The interpolation of lst, ut,
+#                   delay and uvw is done for all rows at once.
+# sy, 2026-10-17 -- udbfile_write() prepares the data, flags and preambles of each time
+#                   step as contiguous arrays and writes the records with raw_write,
+#                   instead of slicing the masked array for each record.
+# sy, 2026-10-17 -- readXdata() reads the file once.  The time axis is sized from the
+#                   ntimes variable of UDB files or from the size of IDB files, and
+#                   doubled if that is too short.  Each time step is filled in plain
+#                   data and boolean mask buffers, and it works on a copy of
+#                   util.bl2ord instead of changing the module table.
+# sy, 2026-10-17 -- concatXdata() also takes a list of readXdata outputs, which are
+#                   all concatenated at once, copying each one once, and can put the
+#                   visibilities in memory-mapped files (mmap_dir keyword).
+#                   udbfile_create() concatenates all of its files in one call.
+# sy, 2026-10-17 -- udbfile_write() writes to a temporary name and renames the file
+#                   when it is complete, and can replace an existing file (overwrite
+#                   keyword).  Added udbfile_create_all(), which makes many UDB files
+#                   in a pool of processes and keeps a manifest of their inputs, so
+#                   that a run again skips the files that are up to date.
+# sy, 2026-10-17 -- valid_miriad_dataset() checks the items of each dataset with one
+#                   directory scan, through the new probe_miriad_dataset(), which
+#                   caches its results by item size and mtime and can also give the
+#                   number of records from the header.
+# sy, 2026-10-17 -- xpx_comp() works out the ratios for all antennas and times at
+#                   once, can make only the XX or YY ones (pols keyword), and no
+#                   longer reshapes x['px'] and x['py'] in place.
 
 #needed for file creation
-import time, os
+import time, os, tempfile, shutil, json
 import aipy
 from astropy.io import fits
 from .util import Time
@@ -34,6 +74,16 @@ import numpy as np
 import numpy.ma as ma
 #eovsa_lst gives LST if it isn't present in the file
 from . import eovsa_lst as el
+#idb_cache keeps decoded files on disk, if enabled
+from . import idb_cache
+#desat has the tabulated saturation correction
+from . import desat
+#prefetch reads the next files ahead, if asked to
+from . import prefetch as prefetch_mod
+#read_profile keeps per-stage counters, if asked to
+from . import read_profile
+
+from . import miriad_native
 #copy is used for filter option in idb_read
 import copy
 #to strip non-printable characters from antenna list
@@ -45,8 +95,35 @@ def strip_non_printable(string_in):
     return ''.join(stripped)
 #End strip_non_printable
 
+def _interp_rows(xnew, xp, fp):
+    '''np.interp(xnew, xp, row) for every row of fp (time on the last axis),
+    in one operation.  The same formula as np.interp is used, so the results
+    are identical to calling it row by row.'''
+    fp = np.asarray(fp, dtype=np.float64)
+    n = len(xp)
+    # Interval of each new time, xp[j] <= xnew < xp[j+1]
+    j = np.clip(np.searchsorted(xp, xnew, side='right') - 1, 0, max(n-2, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if n > 1:
+            slope = (fp[..., j+1] - fp[..., j])/(xp[j+1] - xp[j])
+            out = slope*(xnew - xp[j]) + fp[..., j]
+            # As np.interp does, if nan try from the other end of the interval
+            bad = np.isnan(out)
+            if np.any(bad):
+                other = slope*(xnew - xp[j+1]) + fp[..., j+1]
+                same = np.broadcast_to(fp[..., j] == fp[..., j+1], out.shape)
+                out = np.where(bad, np.where(np.isnan(other) & same, fp[..., j], other), out)
+        else:
+            out = fp[..., j].copy()
+    # Outside of xp, the end values
+    out[..., xnew < xp[0]] = fp[..., :1]
+    out[..., xnew >= xp[-1]] = fp[..., -1:]
+    return out
+
 def avXdata(x, nsec=60):
-    '''Averages UDB data over nsec seconds. '''
+    '''Averages UDB data over nsec seconds.  Each time is assigned to its
+    nsec bin, and the sums and unmasked counts of all bins are formed at once
+    for all channels, baselines and polarizations.'''
     # The input should be output from read_udb.readXdata
     one_day = 24.0*3600.0
     t = x['time']
@@ -57,82 +134,61 @@ def avXdata(x, nsec=60):
         print('avXdata: Averaging time is too short, returning')
         return x
     #endif
-    #time in seconds from the start
-    #need a loop for some python reason
-    tsec = t-t[0]
-    for j in range(ntimes):
-        tsec[j] = int(round(tsec[j]*one_day))
-    #endfor
+    #time in whole seconds from the start
+    tsec = np.round((t-t[0])*one_day)
     #we'll create time bin edges here
     dtsec_all = int(np.max(tsec))
     nnew = 2+dtsec_all/nsec
     tsec_new = np.arange(0, nnew*nsec, nsec)
     #one less time than the bin edges
     ntnew = len(tsec_new)-1
+    #bin of each time, tsec_new[j] <= tsec < tsec_new[j+1], and the times
+    #that fall in a bin, in bin order
+    jbin = np.searchsorted(tsec_new, tsec, side='right')-1
+    use, = np.where((jbin >= 0) & (jbin < ntnew))
+    use = use[np.argsort(jbin[use], kind='stable')]
+    nsjarray = np.bincount(jbin[use], minlength=ntnew).astype(np.int32)
+    full, = np.where(nsjarray > 0)
+    starts = np.cumsum(nsjarray[full]) - nsjarray[full]
+    inorder = np.array_equal(use, np.arange(ntimes))
     #define the output
-    xx_shape = np.shape(x['x'])
-    nf = xx_shape[0]
-    nblc = xx_shape[1]
-    npol = xx_shape[2]
-    ntimes1 = xx_shape[3]
-    #nf = np.size(x['x'][:,0,0,0])
-    #nblc = np.size(x['x'][0,:,0,0])
-    #npol = np.size(x['x'][0,0,:,0])
+    xx = x['x']
+    nf, nblc, npol, ntimes1 = np.shape(xx)
     outx0 = np.zeros((nf, nblc, npol, ntnew),dtype=np.complex64)
     omask = np.zeros((nf, nblc, npol, ntnew),dtype=np.int32)
     outx = ma.masked_array(outx0, mask = omask)
+    data = ma.getdata(xx)
+    mask = ma.getmask(xx)
+    if len(full) > 0:
+        #masked average of each bin, a few channels at a time to keep the
+        #temporaries small
+        step = max(1, (1 << 25)//max(1, nblc*npol*ntimes*16))
+        for f in range(0, nf, step):
+            fs = slice(f, f+step)
+            d = data[fs] if inorder else data[fs][..., use]
+            if mask is ma.nomask:
+                total = np.add.reduceat(d, starts, axis=3, dtype=np.complex128)
+                count = nsjarray[full]
+            else:
+                good = ~mask[fs] if inorder else ~mask[fs][..., use]
+                total = np.add.reduceat(np.where(good, d, 0), starts, axis=3, dtype=np.complex128)
+                count = np.add.reduceat(good, starts, axis=3, dtype=np.int32)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                outx0[fs][..., full] = np.where(count > 0, total/count, 0)
+            omask[fs][..., full] = count == 0
+        outx.mask = omask
     nantsnf3 = np.size(x['px'][:,0])
     outpx = np.zeros((nantsnf3, ntnew), dtype=np.float32)
     outpy = np.zeros((nantsnf3, ntnew), dtype=np.float32)
-    uvwarray = np.zeros((3, nblc, ntnew), dtype=np.float64)
-    lstarray = np.zeros(ntnew, dtype=np.float64)
-    nants = np.size(x['delay'][:,0])
-    delayarray = np.zeros((nants, ntnew), dtype=np.float32)
-    utarray = np.zeros(ntnew, dtype=np.float64)
-    nsjarray = np.zeros(ntnew, dtype=np.int32)
-    #step through and average, jc is the time bin that we're working
-    #on, njc is the number of shorter intervals inside of this interval
-    jc = 0
-    njc = 0
-    for j in range(ntnew):
-        tj = tsec_new[j]
-        tj1 = tsec_new[j+1]
-        ssj = []
-        ssj0 = []
-        for i in range(ntimes):
-            if tsec[i] == tj:
-                ssj0.append(i)
-            if tsec[i] >= tj and tsec[i] < tj1:
-                ssj.append(i)
-            #endif
-        #endfor
-#        print j, ssj0
-#        print ssj
-        if len(ssj) > 0:
-            nsj = float(len(ssj))
-            nsjarray[j] = nsj
-            xxj = x['x'][:,:,:,ssj]
-            outx[:,:,:,j]=ma.average(xxj, axis=3)
-            pxj = x['px'][:,ssj]
-            outpx[:,j]=np.sum(pxj, axis=1)
-            pyj = x['py'][:,ssj]
-            outpy[:,j]=np.sum(pyj, axis=1)
-        #endif
-    #endfor
+    if len(full) > 0:
+        outpx[:, full] = np.add.reduceat(x['px'][:, use], starts, axis=1)
+        outpy[:, full] = np.add.reduceat(x['py'][:, use], starts, axis=1)
     #time arrays, delays and uvw are interpolated: to interval center times
     tsec_mid = (tsec_new[1::]+tsec_new[0:ntnew])*0.5
-    lstarray = np.interp(tsec_mid, tsec, x['lst'])
-    utarray = np.interp(tsec_mid, tsec, x['ut'])
-    for k in range(nants):
-        delayk = x['delay'][k,:]
-        delayarray[k, :] = np.interp(tsec_mid, tsec, delayk)
-    #endfor
-    for k in range(3):
-        for i in range(nblc):
-            uvwki = x['uvw'][k,i,:]
-            uvwarray[k,i,:] = np.interp(tsec_mid, tsec, uvwki)
-        #endfor
-    #endfor
+    lstarray = _interp_rows(tsec_mid, tsec, x['lst'])
+    utarray = _interp_rows(tsec_mid, tsec, x['ut'])
+    delayarray = _interp_rows(tsec_mid, tsec, x['delay']).astype(np.float32)
+    uvwarray = _interp_rows(tsec_mid, tsec, x['uvw'])
     tnew = t[0]+tsec_mid/one_day
     out = {'x':outx,'uvw':uvwarray,'time':tnew,'px':outpx,'py':outpy,'i0':x['i0'],
            'j0':x['j0'],'lst':lstarray,'pol':x['pol'],'delay':delayarray,'ut':utarray, 
@@ -140,12 +196,16 @@ def avXdata(x, nsec=60):
     return out
 #END of avXdata
 
-def udbfile_write(y, ufile_in, ufilename):
+def udbfile_write(y, ufile_in, ufilename, overwrite=False):
     '''Read in a UDB dataset average in time and write out the file. Y is
     the output from avXdata or readXdata, ufile_in is the input
     filename (needed for source, scan, etc...), ufilename is the
     output filename.
 
+    The file is written under a temporary name in the same directory
+    and renamed to ufilename when it is complete, so that a partly
+    written file is never seen under ufilename.  If overwrite is True,
+    an existing ufilename is replaced, otherwise it is an error.
     '''
 
     if len(y) == 0:
@@ -160,7 +220,40 @@ def udbfile_write(y, ufile_in, ufilename):
         print('udbfile_write: No output file')
         return []
     #endif
+    if os.path.exists(ufilename) and not overwrite:
+        print('udbfile_write: Output file exists: '+ufilename)
+        raise RuntimeError('udbfile_write: '+ufilename+' exists')
+    #endif
 
+    udir, uname = os.path.split(ufilename)
+    tmpname = os.path.join(udir, '.'+uname+'.tmp'+str(os.getpid()))
+    if os.path.exists(tmpname):
+        shutil.rmtree(tmpname)
+    #endif
+    try:
+        _udbfile_write(y, ufile_in, ufilename, tmpname)
+    except:
+        if os.path.exists(tmpname):
+            shutil.rmtree(tmpname)
+        raise
+    #endexcept
+    _replace_dataset(tmpname, ufilename)
+    return ufilename
+
+def _replace_dataset(tmpname, filename):
+    '''Renames the Miriad dataset tmpname to filename, replacing filename if
+    it exists.'''
+    if os.path.exists(filename):
+        oldname = tmpname+'.old'
+        os.rename(filename, oldname)
+        os.rename(tmpname, filename)
+        shutil.rmtree(oldname)
+    else:
+        os.rename(tmpname, filename)
+    #endif
+
+def _udbfile_write(y, ufile_in, ufilename, tmpname):
+    '''Does the work of udbfile_write(), writing the file to tmpname.'''
     # Ready to output
     # Open the file and use that to replicate the NRV
     # (non-record-variable) variables
@@ -175,7 +268,7 @@ def udbfile_write(y, ufile_in, ufilename):
     nants = uv['nants']
     # The assumption here is that all the variables are going to be
     # there since it's already been processed
-    uvout = aipy.miriad.UV(ufilename, 'new')
+    uvout = aipy.miriad.UV(tmpname, 'new')
 
     uvout.add_var('name', 'a')
     uvout['name'] = strip_non_printable(ufilename)
@@ -255,24 +348,32 @@ def udbfile_write(y, ufile_in, ufilename):
     #Need version info here
     version = "3.0"
 
-    #Loop through times and add the other variables
+    #Write one time step at a time: the data and flags of all baselines and
+    #polarizations are made contiguous, in record order, and the preambles
+    #are made once, so only raw_write is left for each record
     yy_shape = np.shape(y['x'])
     nf = yy_shape[0]
     nblc = yy_shape[1]
     npol = yy_shape[2]
     ntimes1 = yy_shape[3]
+    xmask = ma.getmask(y['x'])
+    ij = list(zip(np.asarray(y['i0'])[:nblc].tolist(), np.asarray(y['j0'])[:nblc].tolist()))
     for j in range(ntimes):
-        tj = y['time'][j]
+        tj = float(y['time'][j])
         utj = y['ut'][j]
         lstj = y['lst'][j]
         #odd things happen to xsampler, ysampler
-        pxj = np.zeros(3*nants*nf, dtype = np.float32)
-        pyj = np.zeros(3*nants*nf, dtype = np.float32)
-        for k in range(3*nants*nf):
-            pxj[k] = y['px'][k,j]
-            pyj[k] = y['py'][k,j]
-        #endfor
-        dj = y['delay'][:,j]
+        pxj = np.ascontiguousarray(y['px'][:3*nants*nf,j], dtype=np.float32)
+        pyj = np.ascontiguousarray(y['py'][:3*nants*nf,j], dtype=np.float32)
+        dj = y['delay'][:,j].astype(np.float64)
+        #data and flags as (npol, nblc, nf)
+        dataj = np.ascontiguousarray(ma.getdata(y['x'])[...,j].transpose(2, 1, 0), dtype=np.complex64)
+        if xmask is ma.nomask:
+            flagsj = np.ones(dataj.shape, dtype=np.int32)
+        else:
+            flagsj = np.ascontiguousarray(np.logical_not(xmask[...,j]).transpose(2, 1, 0), dtype=np.int32)
+        uvwj = np.ascontiguousarray(y['uvw'][:,:,j].T, dtype=np.float64)
+        preambles = [(uvwj[i], tj, ij[i]) for i in range(nblc)]
         #xsampler
         uvout['ut'] = utj
         uvout['lst'] = lstj
@@ -288,25 +389,21 @@ def udbfile_write(y, ufile_in, ufilename):
             uvout['pol'] = y['pol'][k]
             uvout['ut'] = utj
             uvout['lst'] = lstj
+            datak = dataj[k]
+            flagsk = flagsj[k]
             #for each baseline
             for i in range(nblc):
-                uvwij = y['uvw'][:,i,j]
-                i0i = y['i0'][i]
-                j0i = y['j0'][i]
-                #this may work
-                preamble = uvwij, tj, (i0i, j0i)
-                data = y['x'][:,i,k,j]
-                uvout.write(preamble, data)
+                uvout.raw_write(preambles[i], datak[i], flagsk[i])
             #endfor (baseline)
         #endfor (polarization)
     #endfor (time)
 
     del(uv) #done
-    return ufilename
+    del(uvout) #closes the file
 
 #End of udbfile_write
 
-def readXdata(filename, filter=False, desat=False):
+def readXdata(filename, filter=False, desat=False, profile=None):
     '''This routine reads the data from a single IDB or UDB file.
        Optional Keywords: filter boolean--if True, returns only
        non-zero frequencies if False (default), returns all
@@ -315,36 +412,43 @@ def readXdata(filename, filter=False, desat=False):
        outputs that are not in the UDB files.
        
        Added desat keyword so that saturation can be applied or not as desired.
+
+       If EOVSA_IDB_CACHE is set, decoded files are cached on disk (see
+       idb_cache.py) and unchanged files are not decoded again.
+
+       If profile is True, a file name or a read_profile.ReadProfile, the
+       time spent in each stage is collected (see read_profile.py).  If
+       True, the counters are returned in the 'profile' key.
     '''
+    with read_profile.profiling(profile) as prof:
+        out = _readXdata(filename, filter, desat)
+    if profile is True and isinstance(out, dict):
+        out['profile'] = prof.as_dict()
+    return out
+
+def _readXdata(filename, filter, desat):
+    '''Does the work of readXdata().'''
 
     # Open uv file for reading
     print('Processing: ', filename)
+    cache = idb_cache.default_cache()
+    if cache is not None:
+        with read_profile.stage('cache'):
+            out = cache.load(filename, 'udb_util.readXdata', {'filter':filter}, mmap_mode='c')
+        if out is not None:
+            out['file0'] = filename
+            if desat:
+                with read_profile.stage('desat'):
+                    out = autocorr_desat(out)
+            return out
+        #endif
+    #endif
     try:
         uv = aipy.miriad.UV(filename)
     except:
         print("UDB_UTIL.READXDATA: Bad File at initialzation: "+filename)
         return []
     #endexcept
-    # Read all to get a time array
-    utcount = 0
-    ut = 0.0
-    try:
-        for preamble, data in uv.all():
-            # Look for time change
-            if preamble[1] != ut:
-                ut = preamble[1]
-                utcount = utcount+1
-            #endif
-        #endfor
-        uv.rewind()
-    except:
-        utcount = 0
-        print("UDB_UTIL.READXDATA: Bad File: "+filename)
-    #endexcept
-    if utcount == 0:
-        print('Returning: ')
-        return uv #done to fool the program to avoid segmentation fault -  core dump, jmm, 2019-08-08
-    #endif
     nf_orig = len(uv['sfreq'])
     good_idx = np.arange(nf_orig)
     if filter:
@@ -376,23 +480,34 @@ def readXdata(filename, filter=False, desat=False):
         nsamples = None
     nbl = nants*(nants-1)//2
     nblc = nbl+nants
-    # all-correlations, add a mask for the output vis array
-    outx0 = np.zeros((nf, nblc, npol, utcount),dtype=np.complex64)
-    omask = np.zeros((nf, nblc, npol, utcount),dtype=np.int32)
-    outx = ma.masked_array(outx0, mask = omask)
-    i0array = np.zeros((nblc, utcount), dtype = np.int32)
-    j0array = np.zeros((nblc, utcount), dtype = np.int32)
-    outpx = np.zeros((3*nf*nants, utcount), dtype=np.float64)
-    outpy = np.zeros((3*nf*nants, utcount), dtype=np.float64)
-    uvwarray = np.zeros((3, nblc, utcount), dtype=np.float64)
-    delayarray = np.zeros((nants, utcount), dtype=np.float64)
+    # The file is read once, so the number of times is taken from the
+    # header of a UDB file, or is at most the number of full time steps
+    # that fit in the file, and the arrays grow if that is too few
+    if 'ntimes' in uv.vartable:
+        ntmax = max(int(uv['ntimes']), 1)
+    else:
+        nbytes = 4 if uv.vartable.get('corr') == 'j' else 8
+        ntmax = 1 + os.path.getsize(os.path.join(filename, 'visdata'))//(nblc*npol*nf_orig*nbytes)
+    #endif
+    # all-correlations, data and mask are filled one time step at a time
+    # from (npol, nblc, nf) buffers
+    outx0 = np.zeros((nf, nblc, npol, ntmax),dtype=np.complex64)
+    omask = np.zeros((nf, nblc, npol, ntmax),dtype=bool)
+    xbuf = np.zeros((npol, nblc, nf),dtype=np.complex64)
+    mbuf = np.zeros((npol, nblc, nf),dtype=bool)
+    i0array = np.zeros(nblc, dtype = np.int32)
+    j0array = np.zeros(nblc, dtype = np.int32)
+    outpx = np.zeros((3*nf*nants, ntmax), dtype=np.float64)
+    outpy = np.zeros((3*nf*nants, ntmax), dtype=np.float64)
+    uvwarray = np.zeros((3, nblc, ntmax), dtype=np.float64)
+    delayarray = np.zeros((nants, ntmax), dtype=np.float64)
     #lists for time arrays
     utarray = []
     timearray = []
     lstarray = []
     l = -1
     tprev = 0
-    tsav = 0
+    nrec = 0
     # Use antennalist if available
     if 'antlist' in uv.vartable:
         ants = strip_non_printable(uv['antlist'])
@@ -400,68 +515,66 @@ def readXdata(filename, filter=False, desat=False):
     else:
         antlist = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]
     #endelse
-    #keep autocorrelations in the array
-    bl2ord = util.bl2ord
+    #keep autocorrelations in the array, in a copy of util.bl2ord so that
+    #the module table is not changed
+    bl2ord = util.bl2ord.copy()
     for ij in range(len(antlist)):
         bl2ord[ij, ij] = nbl+ij
     #endfor
-    for preamble, data in uv.all():
-        uvw, t, (i0,j0) = preamble
-        i = antlist.index(i0+1)
-        j = antlist.index(j0+1)
-        if i > j:
-            # Reverse order of indices
-            j = antlist.index(i0+1)
-            i = antlist.index(j0+1)
-        #endif
-        # Assumes uv['pol'] is one of -5, -6, -7, -8
-        k = -5 - uv['pol']
-        if filter:
-            if len(data.nonzero()[0]) == nf:
-                if t != tprev:
-                    # New time 
-                    if t == 2440587.5:
-                        # Time is 1970-01-01, which means a zero-filled record, so skip
-                        # the entire thing.
-                        continue
-                    l += 1
-                    if l == utcount:
-                        break
-                    #endif
-                    tprev = t
-                    timearray.append(t)
-                    utarray.append(uv['ut'])
-                    try:
-                        lstarray.append(uv['lst'])
-                    except:
-                        pass
-                    #endexcept
-                    xdata0 = uv['xsampler'].reshape(nf_orig,nants,3)
-                    xdata = xdata0[good_idx, :, :]
-                    outpx[:,l] = xdata.reshape(nf*nants*3)
-                    ydata0 = uv['ysampler'].reshape(nf_orig,nants,3)
-                    ydata = ydata0[good_idx, :, :]
-                    outpy[:,l] = ydata.reshape(nf*nants*3)
-                    delayarray[:,l] = uv['delay']
-                #endif
-                outx[:, bl2ord[i,j],k,l] = data[data.nonzero()]
-                if k == 3:
-                    uvwarray[:, bl2ord[i,j],l] = uvw
-                    i0array[bl2ord[i,j],l] = i0
-                    j0array[bl2ord[i,j],l] = j0
+    #output baseline of each antenna pair, as it is met
+    blmap = {}
+
+    def grow(arr):
+        # Double the time axis (the last) of arr
+        new = np.zeros(arr.shape[:-1]+(2*arr.shape[-1],), dtype=arr.dtype)
+        new[..., :arr.shape[-1]] = arr
+        return new
+
+    #Only stat the dataset when a profile is collecting
+    nbytes = read_profile.dataset_bytes(filename) if read_profile.active() else 0
+    with read_profile.stage('decode', nbytes=nbytes):
+        while True:
+            try:
+                preamble, data, mask = uv.read(raw=True)
+            except IOError:
+                break
+            except:
+                print("UDB_UTIL.READXDATA: Bad File: "+filename)
+                return uv
+            #endexcept
+            nrec += 1
+            uvw, t, (i0,j0) = preamble
+            try:
+                bl = blmap[i0, j0]
+            except KeyError:
+                i = antlist.index(i0+1)
+                j = antlist.index(j0+1)
+                bl = blmap[i0, j0] = bl2ord[min(i, j), max(i, j)]
+            #endexcept
+            # Assumes uv['pol'] is one of -5, -6, -7, -8
+            k = -5 - uv['pol']
+            if filter:
+                idx, = np.nonzero((data != 0) & ~mask)
+                if len(idx) != nf:
+                    continue
                 #endif
-            #endif, for len(data.nonzero()) == nf and uv['ut'] > 0
-        else:
-#            if uv['ut'] > 0:
+            #endif
             if t != tprev:
                 # New time 
                 if t == 2440587.5:
                     # Time is 1970-01-01, which means a zero-filled record, so skip
                     # the entire thing.
                     continue
+                if l >= 0:
+                    outx0[..., l] = xbuf.T
+                    omask[..., l] = mbuf.T
+                    xbuf[:] = 0
+                    mbuf[:] = False
+                #endif
                 l += 1
-                if l == utcount:
-                    break
+                if l == outx0.shape[-1]:
+                    outx0, omask, outpx, outpy, uvwarray, delayarray = map(grow,
+                        (outx0, omask, outpx, outpy, uvwarray, delayarray))
                 #endif
                 tprev = t
                 timearray.append(t)
@@ -470,22 +583,40 @@ def readXdata(filename, filter=False, desat=False):
                     lstarray.append(uv['lst'])
                 except:
                     pass
-                    #endexcept
-                xdata = uv['xsampler']
-                outpx[:,l] = xdata
-                ydata = uv['ysampler']
-                outpy[:,l] = ydata
+                #endexcept
+                if filter:
+                    outpx[:,l] = uv['xsampler'].reshape(nf_orig,nants,3)[good_idx].reshape(nf*nants*3)
+                    outpy[:,l] = uv['ysampler'].reshape(nf_orig,nants,3)[good_idx].reshape(nf*nants*3)
+                else:
+                    outpx[:,l] = uv['xsampler']
+                    outpy[:,l] = uv['ysampler']
+                #endif
                 delayarray[:,l] = uv['delay']
             #endif
-            outx[:,bl2ord[i,j],k,l] = data
+            if filter:
+                xbuf[k, bl] = data[idx]
+            else:
+                xbuf[k, bl] = data
+                mbuf[k, bl] = mask
+            #endif
             if k == 3:
-                uvwarray[:,bl2ord[i,j],l] = uvw
-                i0array[bl2ord[i,j],l] = i0
-                j0array[bl2ord[i,j],l] = j0
-            #endif 
-#            #endif (uv['ut'] > 0)
-        #endelse (not filter)
-    #endfor
+                uvwarray[:, bl, l] = uvw
+                #i0 and j0 should always be the same, so keep the first
+                if l == 0:
+                    i0array[bl] = i0
+                    j0array[bl] = j0
+                #endif
+            #endif
+        #endwhile
+        if l >= 0:
+            outx0[..., l] = xbuf.T
+            omask[..., l] = mbuf.T
+        #endif
+    read_profile.count('decode', records=nrec)
+    if nrec == 0:
+        print('Returning: ')
+        return uv #done to fool the program to avoid segmentation fault -  core dump, jmm, 2019-08-08
+    #endif
     # Truncate in case of early end of data, return if there is no good data
     nt = len(timearray)
     if nt == 0:
@@ -493,20 +624,12 @@ def readXdata(filename, filter=False, desat=False):
     else:
         outpx = outpx[:,:nt]
         outpy = outpy[:,:nt]
-        outx = outx[:,:,:,:nt]
+        outx = ma.masked_array(outx0[:,:,:,:nt], mask = omask[:,:,:,:nt])
         uvwarray = uvwarray[:, :, :nt]
         delayarray = delayarray[:, :nt]
-        if len(lstarray) != 0:
-            pass
-        else:
-            tarray = Time(timearray,format='jd')
-            for t in tarray:
-                lstarray.append(el.eovsa_lst(t))
-            #endfor
-        #endelse
-        #i0 and j0 should always be the same
-        i0array = i0array[:,0]
-        j0array = j0array[:,0]
+        if len(lstarray) == 0:
+            with read_profile.stage('lst'):
+                lstarray = el.eovsa_lst_array(timearray)
         bd = util.freq2bdname(freq, Time(timearray[0],format='jd'))
         #timearray, lstarray and utarray are lists
         out = {'x':outx,'uvw':uvwarray,'time':np.array(timearray),'px':outpx,'py':outpy,
@@ -516,9 +639,14 @@ def readXdata(filename, filter=False, desat=False):
             pass
         else:
             out.update({'nsamples':nsamples})
+        if cache is not None:
+            with read_profile.stage('cache'):
+                cache.store(filename, 'udb_util.readXdata', {'filter':filter}, out)
+        #endif
     #endelse
     if desat:
-        out = autocorr_desat(out)
+        with read_profile.stage('desat'):
+            out = autocorr_desat(out)
     return out
 #end of readXdata
 
@@ -536,28 +664,10 @@ def autocorr_desat(out):
         Since 2021-05-16, the correlator equalizer coefficient changed from 8.0 to 2.0,
         necessitating a different fit function.  This one combines two fits, one for
         auto-correlation amplitudes < 300 and another for > 300.
+
+        The eta functions are evaluated from precomputed tables, and the correction
+        is applied to all baselines at once (see desat.py).
     '''
-    from scipy.special import erf
-    def eta_f(x, A):
-        a,b,c,d = [1.22552, 1.37369, 2.94536, 2.14838]  # Parameters define the invariant saturation curve
-        eta = (x + d - c)/(a*erf((x-c)/b) + d)
-        bad = np.where(A < 50)
-        eta[bad] = 1.0
-        return eta
-
-    def eta_2(x, A):
-        ''' This is the desaturation fuction for data taken with equalizer coefficient 2.0,
-            which is data after to 5/16/2021.
-        '''
-        a1,b1,c1,d1 = [0.88025122, 1.0221639 , 4.39845723, 2.38911615]
-        a2,b2,c2,d2 = [2.28517281, 2.64619331, 4.38657476, 2.37753165]
-        hi = np.where(A > 300)
-        low = np.where(A <= 300)
-        eta = np.ones_like(x)
-        eta[hi] = (x[hi] + d1 - c1)/(a1*erf((x[hi]-c1)/b1) + d1)
-        eta[low] = (x[low] + d2 - c2)/(a2*erf((x[low]-c2)/b2) + d2)
-        return eta
-        
     # Determine required "m" value for standardized power level.  The power changes
     # depending on number of channels averaged, etc., and the SK m value keeps track
     # of all of that.
@@ -570,106 +680,155 @@ def autocorr_desat(out):
     nant = 16
     nf, = out['fghz'].shape
     nt, = out['time'].shape
-    npol, = out['pol'].shape
-    Px = copy.deepcopy(out['px'].reshape(nf, nant, 3, nt))
-    Py = copy.deepcopy(out['py'].reshape(nf, nant, 3, nt))
-#    n0 = len(np.where(out['band'] == np.max(out['band']))[0])
-#    # Modify measured power to correct for variable science-channel bandwidth
-#    for i in range(nf):
-#        bnd = out['band'][i]
-#        n = np.float64(len(np.where(out['band'] == bnd)[0]))
-#        Px[i] *= n/n0
-#        Py[i] *= n/n0
-    Px = Px[:,:,0]*m0/Px[:,:,2]
-    Py = Py[:,:,0]*m0/Py[:,:,2]
-    
-    x = np.log10(Px)
-    # Calculate correction for X pol (returns size [nf, nant, nt])
-    if mjd < 59350:   # 2021-05-16
-        eta_x = eta_f(x, abs(out['x'][:,np.arange(120,136),0]))
-    else:
-        eta_x = eta_2(x, abs(out['x'][:,np.arange(120,136),0]))
-    x = np.log10(Py)
-    # Calculate correction for Y pol (returns size [nf, nant, nt])
-    if mjd < 59350:   # 2021-05-16
-        eta_y = eta_f(x, abs(out['x'][:,np.arange(120,136),1]))
-    else:
-        eta_y = eta_2(x, abs(out['x'][:,np.arange(120,136),1]))
-    eta = np.zeros_like(out['x'])
-    # Loop over baselines and calculate correction for different polarization states.
-    for i in range(nant):
-        for j in range(i,nant):
-            eta[:,bl2ord[i,j],0] = eta_x[:,i]+eta_x[:,j]
-            eta[:,bl2ord[i,j],1] = eta_y[:,i]+eta_y[:,j]
-            eta[:,bl2ord[i,j],2] = eta_x[:,i]+eta_y[:,j]
-            eta[:,bl2ord[i,j],3] = eta_x[:,j]+eta_y[:,i]
-    eta = eta/2.
-    #  Correction is to log of values, so apply by raising to eta power.
-    amp = abs(out['x'])
-    pha = np.angle(out['x'])
-    amp = amp**eta
-    out['x'] = amp*np.exp(1j*pha)
+    Px = out['px'].reshape(nf, nant, 3, nt)
+    Py = out['py'].reshape(nf, nant, 3, nt)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.log10(Px[:,:,0]*m0/Px[:,:,2])
+        y = np.log10(Py[:,:,0]*m0/Py[:,:,2])
+    # Calculate correction for each pol (returns size [nf, nant, nt])
+    eta_x = desat.antenna_eta(x, abs(out['x'][:,np.arange(120,136),0]), mjd).astype(np.float32)
+    eta_y = desat.antenna_eta(y, abs(out['x'][:,np.arange(120,136),1]), mjd).astype(np.float32)
+    # Correction for each baseline (including autos) and polarization state, applied
+    # to the log of values, so apply by raising to eta power.
+    ant1, ant2 = desat.baseline_pairs(bl2ord, out['x'].shape[1])
+    out['x'] = desat.apply_eta(out['x'], desat.pair_eta(eta_x, eta_y, ant1, ant2, 1))
     return out
     
-def concatXdata(x0, x):
-    ''' Concatenates readXdata outputs'''
-    #check for ok variable
-    try:
-        x0
-    except:
-        print('udb_util.concatXdata: No initial input')
-        return []
-    #endexcept
-    #check for ok variable
-    try:
-        x
-    except:
-        print('udb_util.concatXdata: No concat input')
+# Keys of readXdata outputs with time as the last axis, which are concatenated
+_CONCAT_KEYS = ['x', 'uvw', 'px', 'py', 'delay', 'time', 'lst', 'ut']
+
+def concatXdata(x0, x=None, mmap_dir=None):
+    ''' Concatenates readXdata outputs.  Either two outputs x0 and x are
+        given, or x0 is a list of any number of them, which are all
+        concatenated at once: the output arrays are made once, and each
+        input is copied into them once, instead of the data so far being
+        copied again for each input.
+
+        If mmap_dir is given, the visibilities and their mask are made as
+        .npy files in that directory and returned as memory maps, so that a
+        long time range need not fit in memory.  The files are left for the
+        caller to remove.
+    '''
+    if x is None:
+        xlist = list(x0)
+    else:
+        xlist = [x0, x]
+    #endif
+    if len(xlist) == 0:
+        print('udb_util.concatXdata: No input')
         return []
-    #endexcept
+    #endif
 
     #Sometimes, the frequencies do not match -- typically this means
     #that the first x has crappy data, at least that is true in Jan
-    #2017, jmm. So keep x and ditch x0
-    xx_shape0 = np.shape(x0['x'])
-    nf0 = xx_shape0[0]
-    xx_shape = np.shape(x['x'])
-    nf = xx_shape[0]
-    if nf != nf0:
-        print('Frequency mismatch -- throwing out the first Xdata')
-        return x
+    #2017, jmm. So keep x and ditch those before it
+    first = 0
+    for n in range(1, len(xlist)):
+        if np.shape(xlist[n]['x'])[0] != np.shape(xlist[n-1]['x'])[0]:
+            print('Frequency mismatch -- throwing out the first Xdata')
+            first = n
+        #endif
+    #endfor
+    xlist = xlist[first:]
+    if len(xlist) == 1 and mmap_dir is None:
+        return xlist[0]
     #endif
 
+    x0 = xlist[0]
+    nt = [np.shape(xi['time'])[0] for xi in xlist]
+    offsets = np.concatenate(([0], np.cumsum(nt)))
+    out = {'i0':x0['i0'],'j0':x0['j0'],'pol':x0['pol'],'file0':x0['file0'],'fghz':x0['fghz']}
+    for key in _CONCAT_KEYS:
+        arrays = [ma.getdata(xi[key]) for xi in xlist]
+        shape = np.shape(arrays[0])[:-1]+(offsets[-1],)
+        dtype = np.result_type(*arrays)
+        if key == 'x' and mmap_dir is not None:
+            fd, name = tempfile.mkstemp(suffix='.npy', prefix='concatXdata_', dir=mmap_dir)
+            os.close(fd)
+            outarr = np.lib.format.open_memmap(name, mode='w+', dtype=dtype, shape=shape)
+        else:
+            outarr = np.empty(shape, dtype=dtype)
+        #endif
+        for n, arr in enumerate(arrays):
+            outarr[..., offsets[n]:offsets[n+1]] = arr
+        #endfor
+        out[key] = outarr
+    #endfor
     #vis array, is masked
-    outx = ma.concatenate((x0['x'], x['x']), axis = 3)
-    #uvw array
-    uvwarray = np.concatenate((x0['uvw'], x['uvw']), axis = 2)
-    #baseline to nt arrays
-    i0array = x0['i0']
-    j0array = x0['j0']
-    #polarizations
-    polarr = x0['pol']
-    #power (sampler) arrays
-    outpx = np.concatenate((x0['px'], x['px']), axis = 1)
-    outpy = np.concatenate((x0['py'], x['py']), axis = 1)
-    #delays
-    delayarray = np.concatenate((x0['delay'], x['delay']), axis = 1)
-    #times
-    timearray = np.concatenate((x0['time'], x['time']))
-    lstarray = np.concatenate((x0['lst'], x['lst']))
-    utarray = np.concatenate((x0['ut'], x['ut']))
-    #done
-    out = {'x':outx,'uvw':uvwarray,'time':timearray,'px':outpx,'py':outpy,
-           'i0':i0array,'j0':j0array,'lst':lstarray,'pol':polarr,'delay':delayarray,
-           'ut':utarray,'file0':x0['file0'],'fghz':x0['fghz']}
+    masks = [ma.getmask(xi['x']) for xi in xlist]
+    if all(m is ma.nomask for m in masks):
+        out['x'] = ma.masked_array(out['x'])
+    else:
+        if mmap_dir is not None:
+            fd, name = tempfile.mkstemp(suffix='.npy', prefix='concatXdata_mask_', dir=mmap_dir)
+            os.close(fd)
+            mask = np.lib.format.open_memmap(name, mode='w+', dtype=bool, shape=out['x'].shape)
+        else:
+            mask = np.empty(out['x'].shape, dtype=bool)
+        #endif
+        for n, m in enumerate(masks):
+            mask[..., offsets[n]:offsets[n+1]] = m
+        #endfor
+        out['x'] = ma.masked_array(out['x'], mask=mask)
+    #endelse
     return out
 #end of concatXdata
 
+# Items of a Miriad dataset that must be there, and not be empty
+_MIRIAD_ITEMS = ('flags', 'header', 'vartable', 'visdata')
+# probe_miriad_dataset() results, by path, with the item sizes and mtimes they are for
+_probe_cache = {}
+
+def probe_miriad_dataset(filename, nrec=True):
+    '''Checks a Miriad dataset from the sizes and modification times of its
+    items alone, without opening it through Miriad.  Returns a dictionary
+    with:
+        valid     True if the directory has non-empty flags, header,
+                  vartable and visdata items
+        size      total size of those items
+        mtime_ns  latest modification time of those items (ns)
+        nrec      number of records, from the ncorr header item and the
+                  first entries of visdata (see miriad_native.record_count),
+                  or None if it is not known (e.g. a file still being written)
+    Results are cached, and reused while the items have the same sizes
+    and modification times.  If nrec is False, the record count is not
+    worked out (but is returned if it is already cached).'''
+    stats = []
+    try:
+        with os.scandir(filename) as entries:
+            found = {e.name:e for e in entries if e.name in _MIRIAD_ITEMS and e.is_file()}
+        for item in _MIRIAD_ITEMS:
+            st = found[item].stat()
+            stats.append((st.st_size, st.st_mtime_ns))
+        #endfor
+    except (OSError, KeyError):
+        _probe_cache.pop(filename, None)
+        return {'valid':False, 'size':0, 'mtime_ns':0, 'nrec':None}
+    #endexcept
+    stats = tuple(stats)
+    cached = _probe_cache.get(filename)
+    if cached is None or cached[0] != stats:
+        valid = all(size > 0 for size, mtime in stats)
+        cached = (stats, {'valid':valid, 'size':sum(size for size, mtime in stats),
+                          'mtime_ns':max(mtime for size, mtime in stats), 'nrec':None}, False)
+    #endif
+    if nrec and not cached[2] and cached[1]['valid']:
+        try:
+            cached[1]['nrec'] = miriad_native.record_count(filename)
+        except (OSError, ValueError):
+            cached[1]['nrec'] = None
+        #endexcept
+        cached = (cached[0], cached[1], True)
+    #endif
+    _probe_cache[filename] = cached
+    return dict(cached[1])
+
 def valid_miriad_dataset(filelist0):
     '''Returns True or False for valid or invalid Miriad datasets,
     checks for existnce of the directory, and then for flags, header,
     vartable, and visdata. Also returns names of valid datasets, and
-    invalid ones'''
+    invalid ones.  The checks are made by probe_miriad_dataset(), which
+    caches them.'''
 
     if len(filelist0) == 0:
         print('valid_miriad_file: No files input')
@@ -683,38 +842,37 @@ def valid_miriad_dataset(filelist0):
         filelist = filelist0
     #endelse
 
-    n = len(filelist)
     otp = []
     ok_filelist = []
     bad_filelist = []
-    for j in range(n):
-        filename = filelist[j]
-        tempvar = True
-        if (os.path.isdir(filename) == False):
-            tempvar = False
-        if(os.path.isfile(filename+'/flags') == False or os.path.getsize(filename+'/flags') == 0):
-            tempvar = False
-        if(os.path.isfile(filename+'/header') == False or os.path.getsize(filename+'/header') == 0):
-            tempvar = False
-        if(os.path.isfile(filename+'/vartable') == False or os.path.getsize(filename+'/vartable') == 0):
-            tempvar = False
-        if(os.path.isfile(filename+'/visdata') == False or os.path.getsize(filename+'/visdata') == 0):
-            tempvar = False
-        #end ifs
+    for filename in filelist:
+        tempvar = probe_miriad_dataset(filename, nrec=False)['valid']
         otp.append(tempvar)
         if tempvar == True:
-            ok_filelist.append(filelist[j])
-        #end if
-        if tempvar == False:
-            bad_filelist.append(filelist[j])
+            ok_filelist.append(filename)
+        else:
+            bad_filelist.append(filename)
         #end if
     #endfor
     return otp, ok_filelist, bad_filelist
 #End of valid_miriad_dataset
 
-def udbfile_create(filelist, ufilename, nsec=60):
+def udbfile_create(filelist, ufilename, nsec=60, prefetch=None, profile=None, overwrite=False):
     '''Given a list of IDB filenames, create the appropriate UDB file, by
-    averaging over energy bands, but keep 1 second time resolution'''
+    averaging over energy bands, but keep 1 second time resolution.
+    If prefetch is set, that many files are read ahead in a background
+    thread while the current one is decoded.  If profile is True, a file
+    name or a read_profile.ReadProfile, the time spent in each stage is
+    collected (see read_profile.py), and if True, printed at the end.
+    If overwrite is True, an existing ufilename is replaced.'''
+    with read_profile.profiling(profile) as prof:
+        out = _udbfile_create(filelist, ufilename, nsec, prefetch, overwrite)
+    if profile is True:
+        print(prof.summary())
+    return out
+
+def _udbfile_create(filelist, ufilename, nsec, prefetch, overwrite):
+    '''Does the work of udbfile_create().'''
     print('UDBFILE_CREATE: UFILENAME: ', ufilename)
 
     if len(filelist) == 0:
@@ -733,7 +891,9 @@ def udbfile_create(filelist, ufilename, nsec=60):
     bad_filename = []
     ufile_out = []
     fc = 0
-    for filename in ok_filelist:
+    xlist = []
+    ahead = prefetch_mod.Prefetcher(ok_filelist, prefetch)
+    for filename in ahead:
         xj = readXdata(filename, desat=True)
         #print 'Out of readXdata'
 
@@ -744,13 +904,8 @@ def udbfile_create(filelist, ufilename, nsec=60):
             if len(xj) > 0:
                 print('concat :'+filename)
                 fc = fc+1
-                if fc == 1:
-                    x = xj
-                    print(x['x'].shape)
-                else:
-                    x = concatXdata(x, xj)
-                    print(x['x'].shape)
-                #endelse
+                xlist.append(xj)
+                print(xj['x'].shape)
             else:
                 print('file skipped: ', filename)
                 return [], filename
@@ -765,24 +920,148 @@ def udbfile_create(filelist, ufilename, nsec=60):
         #endeles
         #endif, error check, 2019-08-08, jmm
     #endfor
+    if prefetch:
+        print('udbfile_create: Read-ahead hits:', ahead.hits, 'misses:', ahead.misses)
     #Now do the time average
     if fc == 0:
         print('UDB_UTIL: No good data?')
         return ufilename, bad_filename
     #endif
+    #all files are concatenated at once
+    with read_profile.stage('concat'):
+        x = concatXdata(xlist)
+    del xlist
+    print(x['x'].shape)
     #average data here
-    y = avXdata(x,nsec=nsec)
+    with read_profile.stage('average'):
+        y = avXdata(x,nsec=nsec)
     print(y['x'].shape)
     #Now write the file
-    ufile_out = udbfile_write(y, ok_filelist[0], ufilename)
+    with read_profile.stage('write'):
+        ufile_out = udbfile_write(y, ok_filelist[0], ufilename, overwrite=overwrite)
     print('UDBFILE_CREATE: UFILE_OUT: ', ufile_out)
 
     return ufile_out, bad_filename
 #End of udbfile_create
 
-def xpx_comp(x):
+# Name of the manifest of udbfile_create_all(), in the directory of the outputs
+UDB_MANIFEST = '.udb_manifest.json'
+
+def _udb_fingerprint(filelist, nsec):
+    '''Returns the identity (names, sizes and modification times) of the
+    input files of a UDB file, and the averaging time.'''
+    return {'nsec':nsec, 'inputs':[idb_cache.source_signature(f) for f in filelist]}
+
+def _udbfile_create_one(filelist, ufilename, nsec):
+    '''Runs udbfile_create() for udbfile_create_all(), in a worker process.
+    Returns True if ufilename was written.'''
+    ufile_out, bad_filename = udbfile_create(filelist, ufilename, nsec=nsec, overwrite=True)
+    # A bad file gives an aipy object, which cannot be passed back
+    return isinstance(ufile_out, str) and ufile_out == ufilename and os.path.exists(ufilename)
+
+def _write_manifest(manifest, entries):
+    '''Writes the manifest file, by way of a temporary file, so that it is
+    never seen partly written.'''
+    tmp = manifest+'.tmp'+str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'version':1, 'outputs':entries}, f, indent=1)
+    os.replace(tmp, manifest)
+
+def udbfile_create_all(groups, nsec=60, workers=None, manifest=None, force=False):
+    '''Creates a UDB file for each group of IDB files, skipping those that
+    are already up to date.
+
+    groups is a list of (filelist, ufilename) pairs, one for each UDB file,
+    as given to udbfile_create().  The files are made concurrently in a pool
+    of worker processes, if workers is larger than 1.  Each one is written
+    under a temporary name and renamed when complete (see udbfile_write()).
+
+    A manifest of the files that were made, with the names, sizes and
+    modification times of their input files, is kept in the file manifest
+    (default UDB_MANIFEST in the directory of the first UDB file).  A UDB
+    file that exists and whose inputs and nsec match its manifest entry is
+    not made again, unless force is True, so that a run that was stopped
+    can be run again to finish the rest.
+
+    Returns a dictionary with 'created', 'skipped' and 'failed' lists of
+    UDB file names.'''
+    result = {'created':[], 'skipped':[], 'failed':[]}
+    if len(groups) == 0:
+        print('udbfile_create_all: No files input')
+        return result
+    #endif
+    if manifest is None:
+        manifest = os.path.join(os.path.dirname(os.path.abspath(groups[0][1])), UDB_MANIFEST)
+    #endif
+    try:
+        with open(manifest) as f:
+            entries = json.load(f)['outputs']
+    except (OSError, ValueError, KeyError):
+        entries = {}
+    #endexcept
+
+    todo = []
+    for filelist, ufilename in groups:
+        key = os.path.abspath(ufilename)
+        try:
+            fingerprint = _udb_fingerprint(filelist, nsec)
+        except OSError:
+            print('udbfile_create_all: Missing input for '+ufilename)
+            result['failed'].append(ufilename)
+            continue
+        #endexcept
+        if not force and entries.get(key) == fingerprint and os.path.exists(ufilename):
+            result['skipped'].append(ufilename)
+        else:
+            todo.append((filelist, ufilename, fingerprint))
+        #endif
+    #endfor
 
-    ''' Compares autocorrelations with Power calculations '''
+    def done(ufilename, fingerprint, ok):
+        # Record each file as soon as it is made, so that progress is kept
+        if ok:
+            result['created'].append(ufilename)
+            entries[os.path.abspath(ufilename)] = fingerprint
+            _write_manifest(manifest, entries)
+        else:
+            result['failed'].append(ufilename)
+        #endif
+
+    if workers is not None and workers > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            futures = {pool.submit(_udbfile_create_one, filelist, ufilename, nsec):(ufilename, fingerprint)
+                       for filelist, ufilename, fingerprint in todo}
+            for future in as_completed(futures):
+                ufilename, fingerprint = futures[future]
+                try:
+                    ok = future.result()
+                except Exception as err:
+                    print('udbfile_create_all: '+ufilename+' failed: '+str(err))
+                    ok = False
+                #endexcept
+                done(ufilename, fingerprint, ok)
+            #endfor
+    else:
+        for filelist, ufilename, fingerprint in todo:
+            try:
+                ok = _udbfile_create_one(filelist, ufilename, nsec)
+            except Exception as err:
+                print('udbfile_create_all: '+ufilename+' failed: '+str(err))
+                ok = False
+            #endexcept
+            done(ufilename, fingerprint, ok)
+        #endfor
+    #endif
+    return result
+
+def xpx_comp(x, pols=('x', 'y')):
+
+    ''' Compares autocorrelations with Power calculations.  The ratios are
+    worked out for all antennas, frequencies and times at once.  pols gives
+    the polarizations to compare, 'x' for XX (the xcfrac key of the output)
+    and 'y' for YY (ycfrac), so that only those that are needed are made.
+    x['px'] and x['py'] are not changed.'''
     try:
         x
     except:
@@ -791,29 +1070,23 @@ def xpx_comp(x):
     #endexcept
     
     xfactor = 64 #could be 16??
-    px = x['px']
-    py = x['py']
 
     nt = len(x['time'])
     nf = len(x['x'][:,0,0,0])
 
-    px.shape = (nf, 16, 3, nt)
-    py.shape = (nf, 16, 3, nt)
+    px = np.reshape(x['px'], (nf, 16, 3, nt))
+    py = np.reshape(x['py'], (nf, 16, 3, nt))
 
     M = px[:,0,2,0]/1792.0
     
-    xcfrac = np.zeros((nf, 16, nt), dtype = np.float64)
-    ycfrac = np.zeros((nf, 16, nt), dtype = np.float64)
-    i = 0
-    i1 = 1
-    for kk in range(16):
-        k = kk+120
-        for n in range(nt):
-            xcfrac[:,kk,n]  = x['x'][:,k,i,n]*M[:]/(xfactor*px[:,kk,0,n])
-            ycfrac[:,kk,n] = x['x'][:,k,i1,n]*M[:]/(xfactor*py[:,kk,0,n])
-        #endfor n
-    #endfor kk
-
-    out = {'xcfrac':xcfrac, 'ycfrac':ycfrac}
+    out = {}
+    #autocorrelations are baselines 120 to 135
+    for pol, key, p, i in [('x', 'xcfrac', px, 0), ('y', 'ycfrac', py, 1)]:
+        if pol in pols:
+            cfrac = np.zeros((nf, 16, nt), dtype = np.float64)
+            cfrac[:] = x['x'][:,120:136,i,:]*M[:,None,None]/(xfactor*p[:,:,0,:])
+            out[key] = cfrac
+        #endif
+    #endfor
     return out
 #End of xpx_comp
@@ -0,0 +1,202 @@
+"""Incremental UDB builder for a live IDB directory.
+
+UDB files are normally made in batch by ``udb_util.udbfile_create``, hours
+after the data were taken.  :class:`UDBWatcher` instead looks at an IDB
+directory every few seconds and, as soon as an IDB file is complete, reads
+it, averages it with ``udb_util.avXdata`` and writes its UDB file, named with
+the same time stamp (``IDB20230224180000`` gives ``UDB20230224180000``).  Each
+IDB file is read once, as in the batch production.
+
+A file counts as complete when ``udb_util.probe_miriad_dataset`` finds it
+valid (as ``valid_miriad_dataset`` does) and none of its parts have been
+modified for ``quiet`` seconds.  A file that cannot be read or written is
+tried again at the following polls, up to ``retries`` times in all, after
+which it is given up.  The watcher state (the latest name up to which all
+files are done or given up, the files after it that are done, and the number
+of attempts of each file that failed) is kept in a JSON file in the UDB
+directory, so a restarted watcher goes on from where it stopped, and only the
+names after that point are examined.  It can be run from the command line::
+
+    python -m eovsapy.udb_watch /data1/IDB/20230224 /data1/UDB/2023 --nsec 60
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from . import file_index, udb_util
+
+STATE_NAME = ".udb_watch.json"
+STATE_VERSION = 2
+
+
+class UDBWatcher:
+    """Makes a UDB file for each new IDB file of a directory.
+
+    :param idb_dir: Directory that the IDB files are written to.
+    :type idb_dir: str
+    :param udb_dir: Directory for the UDB files, created if needed.
+    :type udb_dir: str
+    :param nsec: Averaging time of the UDB files, in seconds.
+    :type nsec: int
+    :param quiet: Seconds without modification after which an IDB file is
+        taken to be complete.
+    :type quiet: float
+    :param state: File of the watcher state.  Default is ``STATE_NAME`` in
+        ``udb_dir``.
+    :type state: str, optional
+    :param verbose: If False (default), the progress messages of the UDB
+        routines are not printed.
+    :type verbose: bool
+    :param retries: Number of attempts at an IDB file that fails before it
+        is given up.
+    :type retries: int
+    """
+
+    def __init__(self, idb_dir: str, udb_dir: str, nsec: int = 60, quiet: float = 30.0,
+                 state: Optional[str] = None, verbose: bool = False, retries: int = 3) -> None:
+        self.idb_dir = idb_dir
+        self.udb_dir = udb_dir
+        self.nsec = nsec
+        self.quiet = quiet
+        self.verbose = verbose
+        self.retries = retries
+        os.makedirs(udb_dir, exist_ok=True)
+        self.state_path = state or os.path.join(udb_dir, STATE_NAME)
+        self.last = ""
+        self.done: Dict[str, str] = {}
+        # Number of failed attempts of each IDB file
+        self.failed: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path) as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return
+        if state.get("version") != STATE_VERSION or state.get("idb_dir") != os.path.abspath(self.idb_dir):
+            return
+        self.last = state.get("last", "")
+        self.done = dict(state.get("done", {}))
+        self.failed = {name: int(n) for name, n in state.get("failed", {}).items()}
+
+    def _save(self) -> None:
+        state = {"version": STATE_VERSION, "idb_dir": os.path.abspath(self.idb_dir), "nsec": self.nsec,
+                 "last": self.last, "done": self.done, "failed": self.failed}
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as handle:
+            json.dump(state, handle, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def pending(self) -> List[str]:
+        """Return the names of the IDB files after ``last`` that are not done
+        or given up, in time order.
+        """
+        names = []
+        with os.scandir(self.idb_dir) as entries:
+            for entry in entries:
+                match = file_index.FILENAME_RE.match(entry.name)
+                if match and match.group("prefix") == "IDB" and entry.name > self.last:
+                    if entry.name not in self.done and self.failed.get(entry.name, 0) < self.retries:
+                        names.append(entry.name)
+        return sorted(names)
+
+    def is_complete(self, name: str, now: Optional[float] = None) -> bool:
+        """Return True if the IDB file name is a valid Miriad dataset that has
+        not been modified for ``quiet`` seconds.
+        """
+        probe = udb_util.probe_miriad_dataset(os.path.join(self.idb_dir, name), nrec=False)
+        if not probe["valid"]:
+            return False
+        return (now if now is not None else time.time()) - probe["mtime_ns"] / 1e9 >= self.quiet
+
+    def udb_name(self, name: str) -> str:
+        """Return the UDB file name for the IDB file name."""
+        return os.path.join(self.udb_dir, "UDB" + name[3:])
+
+    def process(self, name: str) -> Optional[str]:
+        """Make the UDB file of the IDB file name.  Returns the UDB file name,
+        or None if the IDB file could not be read.
+        """
+        path = os.path.join(self.idb_dir, name)
+        ufile = self.udb_name(name)
+        log = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        with log:
+            x = udb_util.readXdata(path, desat=True)
+            if not isinstance(x, dict):
+                return None
+            y = udb_util.avXdata(x, nsec=self.nsec)
+            return udb_util.udbfile_write(y, path, ufile, overwrite=True)
+
+    def poll(self, now: Optional[float] = None) -> List[str]:
+        """Make the UDB files of the IDB files that have been completed since
+        the last poll.  Returns the names of the UDB files made.
+        """
+        made = []
+        waiting = False
+        for name in self.pending():
+            if not self.is_complete(name, now):
+                # Later files are still looked at, but last stays before this one
+                waiting = True
+                continue
+            try:
+                ufile = self.process(name)
+            except Exception as err:
+                print("udb_watch: " + name + " failed: " + str(err))
+                ufile = None
+            if ufile:
+                self.done[name] = ufile
+                self.failed.pop(name, None)
+                made.append(ufile)
+            else:
+                self.failed[name] = self.failed.get(name, 0) + 1
+                if self.failed[name] < self.retries:
+                    # Tried again at the next poll
+                    waiting = True
+                else:
+                    print("udb_watch: " + name + " given up after " + str(self.failed[name]) + " attempts")
+            if not waiting:
+                self.last = name
+                # Files up to last need not be listed
+                self.done = {key: path for key, path in self.done.items() if key > name}
+            self._save()
+        return made
+
+    def run(self, interval: float = 10.0, max_polls: Optional[int] = None) -> None:
+        """Poll every ``interval`` seconds, ``max_polls`` times (default forever)."""
+        npoll = 0
+        while max_polls is None or npoll < max_polls:
+            for ufile in self.poll():
+                print("udb_watch: wrote " + ufile)
+            npoll += 1
+            if max_polls is None or npoll < max_polls:
+                time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run a watcher from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("idb_dir", help="Directory of the IDB files.")
+    parser.add_argument("udb_dir", help="Directory for the UDB files.")
+    parser.add_argument("--nsec", type=int, default=60, help="Averaging time (s).")
+    parser.add_argument("--quiet", type=float, default=30.0, help="Seconds without change before a file is complete.")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds between polls.")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts at a failing file before it is given up.")
+    parser.add_argument("--once", action="store_true", help="Poll once and exit.")
+    parser.add_argument("--verbose", action="store_true", help="Print the progress of the UDB routines.")
+    args = parser.parse_args(argv)
+    watcher = UDBWatcher(args.idb_dir, args.udb_dir, nsec=args.nsec, quiet=args.quiet, verbose=args.verbose,
+                         retries=args.retries)
+    watcher.run(interval=args.interval, max_polls=1 if args.once else None)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())